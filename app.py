@@ -1,149 +1,178 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
-import joblib
 import numpy as np
 import rasterio
-import requests
 import os
 from glob import glob
 from pyproj import Transformer
 from datetime import datetime, timedelta
-import pandas as pd
 import math
-import random
+import time
+import threading
+import metrics
+from raster_cache import read_pixel, read_pixels, block_cache
+from tile_index import TileIndex
+from raster_pool import raster_pool, load_tile_metas
+from startup import FAILED
+from basins import BasinRegistry, array_nbytes, load_configs as load_basin_configs
+from catchment_store import CatchmentStore, load_catchment
+from runoff_kernel import DistributedRunoffKernel, stable_sample
+from inference import load_model
+from live_feed import LiveFeed, SYNC_STREAMS, SYNC_STREAM_SECONDS
+from point_codec import MapPoints, Frame, FrameHistory, encode as encode_frame, maybe_gzip, CONTENT_TYPE as FRAME_CONTENT_TYPE
+from scenario_cache import ScenarioCache, quantize, RAIN_STEP, SOIL_STEP, DAM_STEP
+from inundation import InundationTiles, calculate_inundation, get_water_surface_elevation, MIN_ZOOM, MAX_ZOOM
+from routing import Router
+from point_index import PointIndex, viewport_points, parse_bbox, AGGREGATES
+from sweep import sweep, axis_values, AXES as SWEEP_AXES, SWEEP_MAX_SCENARIOS
+from ensemble import (run_ensemble, summarize, simulated_rain_curve, ENSEMBLE_MEMBERS, ENSEMBLE_MAX_MEMBERS,
+                      ENSEMBLE_SEED, FORECAST_HOURS, MAX_FORECAST_HOURS)
+from hydrology import (scs_cn_discharge, calculate_lag_time, calculate_impact, rule_risk,
+                       WARNING_CUSECS, CRITICAL_CUSECS)
 
 app = Flask(__name__)
 CORS(app)
 
-# Loading AI Model
-try:
-    model = joblib.load('flood_model.pkl')
-    print("Advanced AI Brain Loaded")
-except:
-    print("Model not found. Run train_flood_ai.py first!")
-
-# Load LiDAR Tiles
-TILE_FOLDER = "tiles"
-tile_datasets = []
-tif_files = glob(os.path.join(TILE_FOLDER, "*.tif"))
-coverage_bounds = [] 
-
-if tif_files:
-    for tif_path in tif_files:
-        try:
-            ds = rasterio.open(tif_path)
-            tile_datasets.append(ds)
-            left, bottom, right, top = ds.bounds
-            dst_crs = 'EPSG:4326'
-            if ds.crs != dst_crs:
-                t = Transformer.from_crs(ds.crs, dst_crs, always_xy=True)
-                min_lon, min_lat = t.transform(left, bottom)
-                max_lon, max_lat = t.transform(right, top)
-                coverage_bounds.append({
-                    "coords": [[min_lon, max_lat], [max_lon, max_lat], [max_lon, min_lat], [min_lon, min_lat], [min_lon, max_lat]],
-                    "name": os.path.basename(tif_path)
-                })
-        except: pass
-    print(f"SYSTEM READY: {len(tile_datasets)} Tiles Active.")
-
-transformer = Transformer.from_crs("EPSG:4326", "EPSG:32644", always_xy=True)
-
-# Load & OPTIMIZE Catchment CSV
-try:
-    catchment_df = pd.read_csv("catchment_points.csv")
-    print(f"Loaded {len(catchment_df)} Catchment Points.")
-    # Pre-Calculate Static Physics
-    catchment_df['S'] = (25400 / (catchment_df['cn'])) - 254
-    catchment_df['Ia'] = 0.2 * catchment_df['S']
+# --- BASINS ---
+# Every basin in basins.json (or the single default basin) has its own tiles, catchment, model,
+# rating curve, base flow and weather cache (basins.py); requests pick one with ?basin=<id>.
+# Resources load on background threads (startup.py) while the server already answers: the
+# default basin right away, the others on first use. Routes that need a resource still loading
+# return 503; loaded basins beyond RIVERLY_BASIN_MEMORY_MB are unloaded, least recently used first.
+
+basins = BasinRegistry(*load_basin_configs())
+
+def reset_basin(basin):
+    """Empty resources: before the first load and after the basin is unloaded."""
+    catchment = CatchmentStore()
+    return dict(
+        model=None, model_token=None, tiles=[], tif_files=[], tile_index=TileIndex([]),
+        coverage_bounds=[], coverage_lonlat=[],
+        transformer=Transformer.from_crs("EPSG:4326", basin.config.utm_crs, always_xy=True),
+        catchment=catchment, runoff_kernel=DistributedRunoffKernel.from_store(catchment),
+        point_index=None, router=None,
+        inundation_tiles=InundationTiles(lambda lats, lons: get_elevations_from_mosaic(basin, lats, lons), [],
+                                         basin.config.inundation_dir, basin.config.base_level))
+
+def release_basin(basin, resources):
+    """After an unload: drop the basin's cached scenarios, and the decoded blocks and idle file handles
+    of tiles no other loaded basin uses, so the memory budget is really given back."""
+    dropped = scenario_cache.purge(lambda key: key[0] == basin.id)
+    in_use = {ds.name for other in basins.basins.values() if other is not basin for ds in other.resources.tiles}
+    paths = {ds.name for ds in resources.tiles} - in_use
+    freed = block_cache.purge(lambda key: key[0] in paths)
+    raster_pool.close_paths(paths)
+    print(f"Released basin {basin.id}: {dropped} cached scenarios, {freed / 1e6:.1f} MB of raster blocks")
+
+# Loading AI Model (flattened once into NumPy node arrays for fast scoring; basins on one file share it)
+def load_model_component(basin):
+    path = basin.config.model_path
+    if not os.path.exists(path): raise FileNotFoundError(f"{path} not found. Run train_flood_ai.py first!")
+    model = basins.shared(('model', os.path.abspath(path)), lambda: load_model(path))
+    # Part of every scenario-cache key: rule-based results cached before the model (or an older file) never outlive it
+    token = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    basin.update(model=model, model_token=token, charges={'model': (model, model.nbytes())})
+    print(f"Advanced AI Brain Loaded [{basin.id}]")
+    return {'path': path}
+
+# Load LiDAR Tiles (metadata only: file handles are opened on demand by raster_pool, one
+# thread at a time, so nothing GDAL-related is shared between threads or forked workers).
+# Headers are persisted in the basin's tile manifest: a restart only opens new or changed tiles.
+
+def coverage(metas):
+    """Resources describing the tiles' footprint (lon/lat boxes + /tiles-coverage polygons)."""
+    lonlat = [ds.lonlat for ds in metas]
+    return {'coverage_lonlat': lonlat, 'coverage_bounds': [{
+        "coords": [[w, n], [e, n], [e, s], [w, s], [w, n]],
+        "name": os.path.basename(ds.name)
+    } for ds, (w, s, e, n) in zip(metas, lonlat)]}
+
+def set_coverage(basin, metas, **values):
+    footprint = coverage(metas)
+    basin.resources.inundation_tiles.set_terrain(footprint['coverage_lonlat'], [ds.name for ds in metas])
+    basin.update(**footprint, **values)
+
+def load_tiles_component(basin):
+    def cached(metas):
+        # Known tiles from the manifest: /tiles-coverage can answer before the rest are opened
+        set_coverage(basin, metas)
+        basin.startup.finish("tile_bounds", tiles=len(metas), source="manifest")
+    tif_files = glob(os.path.join(basin.config.tile_folder, "*.tif"))
+    try:
+        metas, errors, counts = load_tile_metas(tif_files, basin.config.tile_manifest, on_cached=cached)
+    except Exception:
+        basin.startup.finish("tile_bounds", FAILED, "tile loading failed")
+        raise
+    for path, error in errors.items():
+        metrics.count("tile_load_error")
+        print(f"Skipped tile {path}: {error}")
+    # Spatial index over tile bounds (used by every lookup)
+    index = TileIndex([tuple(ds.bounds) for ds in metas])
+    set_coverage(basin, metas, tiles=metas, tile_index=index, tif_files=tif_files)
+    basin.startup.finish("tile_bounds", tiles=len(metas), source="tiles")
+    print(f"SYSTEM READY: {len(metas)} Tiles Active [{basin.id}].")
+    return {'tiles': len(metas), 'skipped': len(errors), **counts,
+            'errors': dict(list(errors.items())[:20])}
+
+# Load Catchment Store (memory-mapped columns, S & Ia pre-calculated by the generator; shared like the model)
+def load_catchment_component(basin):
+    config = basin.config
+    try:
+        store = basins.shared(('catchment', os.path.abspath(config.catchment_path)),
+                              lambda: load_catchment(config.catchment_path, csv_path=config.catchment_csv))
+    except FileNotFoundError:
+        raise FileNotFoundError("Catchment store not found. Run generate_catchment_csv.py first.")
+    # Preallocated NumPy runoff kernel over the catchment columns
+    kernel = DistributedRunoffKernel.from_store(store)
+    basin.update(catchment=store, runoff_kernel=kernel, charges={'catchment': (store, store.nbytes())})
+    print(f"Loaded {len(store)} Catchment Points [{basin.id}].")
     print("Physics Engine Optimized & Ready.")
-except:
-    print("CSV Not Found. Run generate_catchment_csv.py first.")
-    catchment_df = pd.DataFrame()
+    return {'points': len(store), 'path': store.path or config.catchment_path}
+
+basins.on_reset(reset_basin)
+basins.on_unload(release_basin)
+basins.add("model", load_model_component)
+basins.add("tiles", load_tiles_component)
+basins.add("tile_bounds")  # Finished by the tiles loader (early when the manifest has them)
+basins.add("catchment", load_catchment_component)
+
+# The default basin's components: /ready, gunicorn's pre_fork and scripts wait on these
+startup = basins.default.startup
+
+# Memoized simulation results of every basin (repeated slider positions skip all recomputation)
+scenario_cache = ScenarioCache()
+
+MAX_MAP_POINTS = 3000
 
 # --- HYDROLOGICAL FUNCTIONS ---
 
-def get_seasonal_base_flow():
-    """Returns typical base flow (cusecs) for Haridwar based on month."""
-    month = datetime.now().month
-    # Monsoon (Glacial Melt + Rain Base): June-Sept
-    if 6 <= month <= 9: return 45000 
-    # Post-Monsoon
-    elif 10 <= month <= 11: return 20000
-    # Winter (Dry)
-    elif 12 <= month or month <= 3: return 8500
-    # Pre-Summer Melt
-    else: return 15000
-
-def calculate_lag_time(rain_mm, soil_moisture):
-    if rain_mm < 5: return 0
-    L, Y = 30000, 5
-    S_adjusted = 10 * (1 - soil_moisture) 
-    numerator = (L ** 0.8) * ((S_adjusted + 1) ** 0.7)
-    denominator = 1900 * (Y ** 0.5)
-    return round((numerator / denominator) * (0.8 if rain_mm > 100 else 1), 1)
-
-def calculate_impact(discharge):
-    people_at_risk, crop_loss_acres = 0, 0
-    if discharge > 100000:
-        excess = discharge - 100000
-        people_at_risk = int(excess * 0.045)
-        crop_loss_acres = int(excess * 0.012)
-    return people_at_risk, crop_loss_acres
-
-def calculate_distributed_discharge(rain_input_mm):
-    """Vectorized Map Visualization Logic"""
-    if catchment_df.empty: return []
-    local_rain = rain_input_mm * catchment_df['rain_weight']
-    term1 = (local_rain - catchment_df['Ia']) ** 2
-    term2 = (local_rain - catchment_df['Ia'] + catchment_df['S'])
-    raw_runoff = np.where(local_rain > catchment_df['Ia'], term1 / term2, 0)
-    
-    active_indices = np.where(raw_runoff > 5)[0]
-    if len(active_indices) == 0: return []
-        
-    active_df = catchment_df.iloc[active_indices].copy()
-    active_df['runoff_mm'] = raw_runoff[active_indices]
-    active_df['status'] = np.where(active_df['runoff_mm'] > 35, 2, np.where(active_df['runoff_mm'] > 15, 1, 0))
-    
-    return active_df[['lat', 'lon', 'runoff_mm', 'status']].to_dict(orient='records')
+def get_seasonal_base_flow(basin):
+    """Returns typical base flow (cusecs) for the basin based on month (Haridwar: dry winter, monsoon peak)."""
+    return basin.config.base_flow[datetime.now().month - 1]
+
+def calculate_distributed_discharge(basin, rain_input_mm, max_points=None, resources=None):
+    """Vectorized Map Visualization Logic (NumPy kernel, sampled on indices)"""
+    res = resources or basin.resources  # One bundle: kernel and catchment of the same load
+    catchment = res.catchment
+    with metrics.span("runoff_kernel"):
+        point_ids, runoff_mm, status = res.runoff_kernel.run(rain_input_mm, max_points=max_points)
+    if len(point_ids) == 0: return MapPoints()
 
-def calculate_scs_cn_discharge(current_rain_mm, past_rain_sum_mm, dam_release_cusecs=0):
+    # Only the selected points ever become Python objects; the columns ride along for ?format=compact
+    with metrics.span("map_points"):
+        lat, lon = catchment['lat'][point_ids], catchment['lon'][point_ids]
+        lats = np.round(lat.astype(np.float64), 5)
+        lons = np.round(lon.astype(np.float64), 5)
+        return MapPoints(({'id': i, 'lat': la, 'lon': lo, 'runoff_mm': r, 'status': st} for i, la, lo, r, st in
+                          zip(point_ids.tolist(), lats.tolist(), lons.tolist(), runoff_mm.tolist(), status.tolist())),
+                         point_ids, lat, lon, runoff_mm, status)
+
+def calculate_scs_cn_discharge(basin, current_rain_mm, past_rain_sum_mm, dam_release_cusecs=0):
     """
-    REALISTIC Total Discharge Engine
+    REALISTIC Total Discharge Engine (hydrology.py; scalars or arrays)
     Q_total = Seasonal_Base + Direct_Runoff + Delayed_Runoff + Dam_Release
     """
-    # Seasonal Base Flow (Nature's Default)
-    base_flow_cusecs = get_seasonal_base_flow()
-    
-    # Direct Runoff (SCS-CN)
-    CN = 85 
-    S = (25400 / CN) - 254
-    Ia = 0.2 * S
-    
-    direct_runoff_mm = 0
-    if current_rain_mm > Ia:
-        direct_runoff_mm = ((current_rain_mm - Ia) ** 2) / (current_rain_mm - Ia + S)
-    
-    # Delayed Runoff (Basin Memory)
-    # 15% of previous days' rain drains into the river today
-    delayed_runoff_mm = past_rain_sum_mm * 0.15 
-    
-    # Volume Calculation
-    # Catchment Area ~ 20,000 sq km
-    total_runoff_mm = direct_runoff_mm + delayed_runoff_mm
-    
-    # Volume (m3) = Area * Depth
-    # Discharge (m3/s) = Volume / 86400 seconds
-    # 1 mm over 20,000 sqkm = ~231 cusecs roughly
-    discharge_from_rain_cusecs = (total_runoff_mm * 20000 * 1000 / 86400) * 35.31
-    
-    # Total Summation
-    total_cusecs = base_flow_cusecs + discharge_from_rain_cusecs + dam_release_cusecs
-    
-    # Safety Check for NaN
-    if math.isnan(total_cusecs): return base_flow_cusecs
-    
-    return float(round(total_cusecs, 0))
+    return scs_cn_discharge(current_rain_mm, past_rain_sum_mm, dam_release_cusecs, get_seasonal_base_flow(basin))
 
 def calculate_gumbel_return_period(rain_mm):
     if rain_mm < 20: return "Normal"
@@ -151,30 +180,230 @@ def calculate_gumbel_return_period(rain_mm):
     if rain_mm < 150: return "1-in-10 Year Event"
     return "1-in-100 Year Extreme Event"
 
-def get_elevation_from_mosaic(lat, lon):
-    if not tile_datasets: return None, "No Tiles"
-    utmx, utmy = transformer.transform(lon, lat)
-    for ds in tile_datasets:
+def get_elevation_from_mosaic(basin, lat, lon):
+    res = basin.resources
+    tiles, tile_index = res.tiles, res.tile_index
+    if not tiles: return None, "No Tiles"
+    utmx, utmy = res.transformer.transform(lon, lat)
+    for tile_id in tile_index.candidates(utmx, utmy):
+        ds = tiles[tile_id]
         try:
-            if (ds.bounds.left <= utmx <= ds.bounds.right) and (ds.bounds.bottom <= utmy <= ds.bounds.top):
-                row, col = ds.index(utmx, utmy)
-                val = ds.read(1)[row, col]
-                if -100 < val < 9000: return float(val), os.path.basename(ds.name)
-        except: continue
+            row, col = ds.index(utmx, utmy)
+            # Windowed read through the shared block cache (no full-band decode)
+            val = read_pixel(ds, row, col)
+            if val is not None and -100 < val < 9000: return float(val), os.path.basename(ds.name)
+        except:
+            metrics.count("tile_read_error")
+            continue
     return None, "Outside"
 
+def get_elevations_from_mosaic(basin, lats, lons, resources=None):
+    """Batch version: one vectorized CRS transform, points grouped by tile.
+    Returns (elevations with NaN where not found, tile id per point or -1)."""
+    res = resources or basin.resources
+    tiles, tile_index = res.tiles, res.tile_index
+    elevations = np.full(len(lats), np.nan)
+    tile_ids = np.full(len(lats), -1, dtype=np.int64)
+    if not tiles or len(lats) == 0: return elevations, tile_ids
+
+    utmx, utmy = res.transformer.transform(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    for tile_id, members in tile_index.group_points(utmx, utmy).items():
+        # First tile with a valid value wins (same order as the single lookup)
+        members = members[tile_ids[members] < 0]
+        if len(members) == 0: continue
+        ds = tiles[tile_id]
+        try:
+            rows, cols = rasterio.transform.rowcol(ds.transform, utmx[members], utmy[members])
+            vals = read_pixels(ds, rows, cols)
+        except Exception as e:
+            metrics.count("tile_read_error")
+            print(f"Batch lookup failed on {ds.name}: {e}")
+            continue
+        valid = (vals > -100) & (vals < 9000)
+        elevations[members[valid]] = vals[valid]
+        tile_ids[members[valid]] = tile_id
+    return elevations, tile_ids
+
+# --- INUNDATION (Rating Curve) ---
+# Point answers for /check-location and whole-tile masks for the map share inundation.py
+# (each basin's InundationTiles is made by reset_basin, its coverage set by the tiles loader)
+
+def run_scenario(basin, rain, soil_moisture, snow_depth, past_rain_sum, dam_release, resources=None):
+    """Full physics + AI pipeline for one set of inputs (no weather I/O)."""
+    res = resources or basin.resources
+    # Visualization Points (Sampled for speed)
+    with metrics.span("distributed_map"):
+        flood_points = calculate_distributed_discharge(basin, rain, max_points=MAX_MAP_POINTS, resources=res)
+
+    # TOTAL DISCHARGE CALCULATION (Using Past Rain)
+    with metrics.span("scs_cn"):
+        est_discharge_cusecs = calculate_scs_cn_discharge(basin, rain, past_rain_sum, dam_release)
+
+    people, crops = calculate_impact(est_discharge_cusecs)
+    lag_time_hours = calculate_lag_time(rain, soil_moisture)
+
+    features = np.array([[rain, soil_moisture, snow_depth, past_rain_sum, est_discharge_cusecs]])
+    try:
+        # One traversal gives class + confidence (identical to predict / predict_proba)
+        with metrics.span("model_inference"):
+            risk_prediction, confidence = res.model.predict_one(features)
+    except:
+        # No model (or it failed): rule-based fallback on discharge
+        metrics.count("model_fallback")
+        risk_prediction = rule_risk(est_discharge_cusecs)
+        confidence = 0.0
+
+    return_period = calculate_gumbel_return_period(rain)
+
+    adv_text = "Normal Flow."
+    if risk_prediction == 2:
+        adv_text = f"CRITICAL: Capacity exceeded ({int(est_discharge_cusecs)} cusecs). Evacuate Zone A."
+    elif risk_prediction == 1:
+        adv_text = f"WARNING: High flow due to antecedent rain ({int(past_rain_sum)}mm)."
+
+    return {
+        'total_discharge_cusecs': est_discharge_cusecs,
+        'impact_people': people,
+        'impact_crops': crops,
+        'lag_time_hours': lag_time_hours,
+        'distributed_points': flood_points,
+        'return_period': return_period,
+        'risk_level': risk_prediction,
+        'confidence': confidence,
+        'advisory': adv_text
+    }
+
 # --- API ROUTES ---
 
 @app.route('/tiles-coverage', methods=['GET'])
 def tiles_coverage():
-    return jsonify(coverage_bounds)
+    return jsonify(g.basin.resources.coverage_bounds)
 
-@app.route('/predict-distributed', methods=['GET'])
-def predict_distributed():
-    sim_rain = request.args.get('sim_rain')
-    sim_soil = request.args.get('sim_soil')
-    sim_dam = request.args.get('sim_dam')
-    
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'scenario': scenario_cache.stats(),
+        'raster_blocks': block_cache.stats(),
+        'raster_handles': raster_pool.stats(),
+        'weather': g.basin.weather_client.stats(),
+        'live_feed': get_live_feed(g.basin).stats(),
+        'inundation_tiles': g.basin.resources.inundation_tiles.stats(),
+        'basins': basins.stats()
+    })
+
+@app.route('/basins', methods=['GET'])
+def list_basins():
+    """Configured basins: load state, resident bytes and idle time (+ the registry's memory budget)."""
+    return jsonify(basins.stats())
+
+# --- METRICS ---
+# Per-route latency here, per-stage spans in the pipeline above; both exported at /metrics
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# --- READINESS ---
+# Startup components each route needs before it can answer; every other route serves from the start
+
+ROUTE_NEEDS = {
+    '/tiles-coverage': ("tile_bounds",),
+    '/predict-distributed': ("model", "tiles", "catchment"),
+    '/inundation-tiles/<int:level_cm>/<int:z>/<int:x>/<int:y>.png': ("tiles",),
+    '/check-location': ("tiles",),
+    '/check-locations': ("tiles",),
+    '/viewport-points': ("catchment",),
+    '/scenario-sweep': ("model",),
+    '/routed-hydrograph': ("catchment",),
+}
+
+def get_basin(basin_id):
+    """(basin, None) for a ?basin= value (None/empty: the default), else (None, (payload, status)) for an unknown id."""
+    try: return basins.get(basin_id), None
+    except KeyError as e:
+        metrics.count("invalid_request")
+        return None, ({'error': str(e.args[0]), 'basins': basins.ids()}, 404)
+
+def not_ready_payload(route, basin=None):
+    """(payload, status) while a component the route needs is still loading (loading it on first use), else None."""
+    basin = basin or basins.default
+    needs = ROUTE_NEEDS.get(route)
+    if not needs or basins.ready(basin, *needs): return None
+    metrics.count("not_ready")
+    return {'error': "Starting up, retry shortly", 'basin': basin.id, 'loading': basin.startup.pending(*needs)}, 503
+
+@app.before_request
+def select_basin():
+    g.basin, unknown = get_basin(request.args.get('basin'))
+    if unknown is not None:
+        payload, status = unknown
+        return jsonify(payload), status
+
+@app.before_request
+def wait_for_startup():
+    not_ready = not_ready_payload(request.url_rule.rule if request.url_rule else None, g.basin)
+    if not_ready is not None:
+        payload, status = not_ready
+        return jsonify(payload), status, {'Retry-After': '2'}
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process answers (resources may still be loading, see /ready)."""
+    return jsonify({'status': 'ok', 'uptime_seconds': startup.status()['uptime_seconds']})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 once every component is loaded (or has failed: status 'degraded'), 503 while loading."""
+    status = startup.status()
+    return jsonify(status), 200 if status['status'] != 'loading' else 503
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(route, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format: route + stage latency histograms, failure/fallback counters, cache gauges."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Folded stacks from the sampling profiler (flamegraph.pl / speedscope). ?reset=1 clears them."""
+    if metrics.profiler is None:
+        return jsonify({'error': "Profiler off (set RIVERLY_PROFILE_HZ, e.g. 99)"}), 404
+    folded = metrics.profiler.folded()
+    if request.args.get('reset'): metrics.profiler.reset()
+    return Response(folded, mimetype='text/plain')
+
+metrics.gauge("riverly_scenario_cache_hits_total", "Simulation results served from the scenario cache.", lambda: scenario_cache.hits, "counter")
+metrics.gauge("riverly_scenario_cache_misses_total", "Simulation results computed.", lambda: scenario_cache.misses, "counter")
+metrics.gauge("riverly_raster_cache_bytes", "Decoded LiDAR blocks held in memory.", lambda: block_cache.current_bytes)
+metrics.gauge("riverly_raster_cache_hits_total", "LiDAR block reads served from memory.", lambda: block_cache.hits, "counter")
+metrics.gauge("riverly_raster_cache_misses_total", "LiDAR blocks decoded from disk.", lambda: block_cache.misses, "counter")
+metrics.gauge("riverly_raster_handles_open", "LiDAR files open in this process.", lambda: raster_pool.open_count)
+metrics.gauge("riverly_raster_handle_opens_total", "LiDAR files opened (pool misses).", lambda: raster_pool.opened, "counter")
+metrics.gauge("riverly_weather_fetches_total", "Upstream weather fetches.", lambda: sum(b.weather_client.fetch_count for b in basins.basins.values()), "counter")
+metrics.gauge("riverly_weather_errors_total", "Failed upstream weather fetches.", lambda: sum(b.weather_client.error_count for b in basins.basins.values()), "counter")
+metrics.gauge("riverly_weather_age_seconds", "Age of the default basin's weather snapshot.", lambda: basins.default.weather_client.stats()["age_seconds"])
+metrics.gauge("riverly_live_feed_subscribers", "Dashboards connected to /stream-distributed.", lambda: sum(f.stats()["subscribers"] for f in list(live_feeds.values())))
+metrics.gauge("riverly_startup_pending", "Default basin components still loading.", lambda: len(startup.pending()))
+metrics.gauge("riverly_basins_loaded", "Basins with resources loaded (or loading).", lambda: basins.stats()["loaded"])
+metrics.gauge("riverly_basin_resident_bytes", "Bytes held by loaded basins.", lambda: basins.resident_bytes())
+metrics.gauge("riverly_basin_unloads_total", "Basins unloaded to stay within the memory budget.", lambda: basins.evictions, "counter")
+metrics.start_profiler()
+
+def build_distributed_state(basin, sim_rain=None, sim_soil=None, sim_dam=None):
+    """Dashboard state: live weather (+ optional simulation overrides) through the full pipeline."""
+    with metrics.span("weather"):
+        resp = basin.weather_client.get_snapshot()
+    return state_from_snapshot(basin, resp, sim_rain, sim_soil, sim_dam)
+
+def weather_inputs(resp, live_rain=True):
+    """Model inputs from a weather snapshot (calm defaults if it is missing or malformed)."""
     weather_info = {
         'rain': 0.0, 'temp': 25.0, 'humidity': 60, 'wind': 5.0,
         'soil_moisture': 0.2, 'snow_depth': 0.0, 'past_rain_sum': 0.0, # Default to moderate history
@@ -182,205 +411,528 @@ def predict_distributed():
     }
 
     try:
-        try:
-            url = "https://api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": 29.956, "longitude": 78.18,
-                "current": ["temperature_2m", "relative_humidity_2m", "wind_speed_10m", "rain", "showers", "soil_moisture_0_to_7cm", "snow_depth"],
-                "hourly": "rain", "past_days": 5, "timezone": "Asia/Kolkata"
-            }
-            resp = requests.get(url, params=params, timeout=1).json()
-            curr = resp['current']
-            weather_info.update({
-                'temp': curr['temperature_2m'],
-                'humidity': curr['relative_humidity_2m'],
-                'wind': curr['wind_speed_10m'],
-                'soil_moisture': curr['soil_moisture_0_to_7cm'],
-                'snow_depth': curr['snow_depth']
-            })
+        curr = resp['current']
+        weather_info.update({
+            'temp': curr['temperature_2m'],
+            'humidity': curr['relative_humidity_2m'],
+            'wind': curr['wind_speed_10m'],
+            'soil_moisture': curr['soil_moisture_0_to_7cm'],
+            'snow_depth': curr['snow_depth']
+        })
+        
+        if live_rain: weather_info['rain'] = curr['rain'] + curr['showers']
+        past_rains = resp['hourly']['rain']
+        if len(past_rains) >= 120: weather_info['past_rain_sum'] = sum(past_rains[:120])
             
-            if not sim_rain: weather_info['rain'] = curr['rain'] + curr['showers']
-            past_rains = resp['hourly']['rain']
-            if len(past_rains) >= 120: weather_info['past_rain_sum'] = sum(past_rains[:120])
-                
-        except: pass
+    except:
+        # No (or malformed) snapshot: calm defaults above
+        metrics.count("weather_defaults_used")
+    return weather_info
 
-        if sim_rain: weather_info['rain'] = float(sim_rain)
-        if sim_soil: weather_info['soil_moisture'] = float(sim_soil)
-        if sim_dam: weather_info['dam_release'] = float(sim_dam)
+def state_from_snapshot(basin, resp, sim_rain=None, sim_soil=None, sim_dam=None):
+    """CPU half of build_distributed_state: no I/O, so async servers can run it on a worker thread."""
+    weather_info = weather_inputs(resp, live_rain=not sim_rain)
 
-        real_rain = weather_info['rain']
+    # Simulation inputs are quantized so repeated slider positions share one cache entry
+    if sim_rain: weather_info['rain'] = quantize(sim_rain, RAIN_STEP)
+    if sim_soil: weather_info['soil_moisture'] = quantize(sim_soil, SOIL_STEP)
+    if sim_dam: weather_info['dam_release'] = quantize(sim_dam, DAM_STEP)
 
-        # Visualization Points (Sampled for speed)
-        flood_points = calculate_distributed_discharge(real_rain)
-        if len(flood_points) > 3000: flood_points = random.sample(flood_points, 3000)
+    real_rain = weather_info['rain']
+    res = basin.resources  # Key and result from the same loaded model / catchment
 
-        # TOTAL DISCHARGE CALCULATION (Using Past Rain)
-        est_discharge_cusecs = calculate_scs_cn_discharge(
-            real_rain, weather_info['past_rain_sum'], weather_info['dam_release']
-        )
-        
-        people, crops = calculate_impact(est_discharge_cusecs)
-        lag_time_hours = calculate_lag_time(real_rain, weather_info['soil_moisture'])
+    if sim_rain or sim_soil or sim_dam:
+        # Simulation: same inputs -> same answer, computed once
+        key = (basin.id, res.generation, res.model_token, real_rain, weather_info['soil_moisture'], weather_info['dam_release'],
+               weather_info['snow_depth'], weather_info['past_rain_sum'], get_seasonal_base_flow(basin))
+        scenario = scenario_cache.get_or_compute(key, lambda: run_scenario(
+            basin, real_rain, weather_info['soil_moisture'], weather_info['snow_depth'],
+            weather_info['past_rain_sum'], weather_info['dam_release'], res))
+    else:
+        scenario = run_scenario(
+            basin, real_rain, weather_info['soil_moisture'], weather_info['snow_depth'],
+            weather_info['past_rain_sum'], weather_info['dam_release'], res)
 
-        features = np.array([[real_rain, weather_info['soil_moisture'], weather_info['snow_depth'], weather_info['past_rain_sum'], est_discharge_cusecs]])
-        try:
-            risk_prediction = int(model.predict(features)[0])
-            probs = model.predict_proba(features)[0]
-            confidence = round(max(probs) * 100, 1)
-        except:
-            risk_prediction = 2 if est_discharge_cusecs > 140000 else (1 if est_discharge_cusecs > 80000 else 0)
-            confidence = 0.0
+    return {
+        'rainfall_input': real_rain,
+        'temperature': weather_info['temp'],
+        'humidity': weather_info['humidity'],
+        'wind_speed': weather_info['wind'],
+        'soil_moisture': weather_info['soil_moisture'],
+        'snow_depth': weather_info['snow_depth'],
+        'dam_release': weather_info['dam_release'],
+        **scenario,
+        # Flood extent raster for the current discharge (XYZ template, relative to the API root)
+        'inundation_tiles': res.inundation_tiles.url_template(
+            scenario['total_discharge_cusecs'], "" if basin is basins.default else f"?basin={basin.id}")
+    }
 
-        return_period = calculate_gumbel_return_period(real_rain)
-        
-        adv_text = "Normal Flow."
-        if risk_prediction == 2: 
-            adv_text = f"CRITICAL: Capacity exceeded ({int(est_discharge_cusecs)} cusecs). Evacuate Zone A."
-        elif risk_prediction == 1: 
-            adv_text = f"WARNING: High flow due to antecedent rain ({int(weather_info['past_rain_sum'])}mm)."
-
-        return jsonify({
-            'rainfall_input': real_rain,
-            'temperature': weather_info['temp'],
-            'humidity': weather_info['humidity'],
-            'wind_speed': weather_info['wind'],
-            'soil_moisture': weather_info['soil_moisture'],
-            'snow_depth': weather_info['snow_depth'],
-            'dam_release': weather_info['dam_release'],
-            'total_discharge_cusecs': est_discharge_cusecs,
-            'impact_people': people,
-            'impact_crops': crops,
-            'lag_time_hours': lag_time_hours,
-            'distributed_points': flood_points,
-            'return_period': return_period,
-            'risk_level': risk_prediction,
-            'confidence': confidence,
-            'advisory': adv_text
-        })
+# Live state is computed once per tick and pushed to every connected dashboard of the basin
+live_feeds = {}
+live_feeds_lock = threading.Lock()
 
+def get_live_feed(basin):
+    """The basin's LiveFeed, made on first use (its thread only runs while dashboards are connected)."""
+    with live_feeds_lock:
+        feed = live_feeds.get(basin.id)
+        if feed is None:
+            feed = live_feeds[basin.id] = LiveFeed(lambda: build_distributed_state(basin),
+                                                   ready=lambda: basins.ready(basin, *ROUTE_NEEDS['/predict-distributed']))
+        return feed
+
+live_feed = get_live_feed(basins.default)
+
+# Each SSE viewer holds one of this process's worker threads: beyond SYNC_STREAMS the rest are
+# left for the other routes (viewers get 503 and poll; asgi_app.py streams without threads)
+sync_streams = threading.BoundedSemaphore(SYNC_STREAMS)
+
+# Frames recently sent to ?format=compact pollers (per process): ?base=<frame> gets a delta against it
+frame_history = FrameHistory()
+
+def encode_compact(state, base_id=None):
+    """Binary frame for one state: a delta when this process still holds the client's base frame, else a keyframe."""
+    with metrics.span("compact_encode"):
+        frame = Frame.from_points(state.get('distributed_points'))
+        base = frame_history.get(base_id)
+        frame_history.remember(frame)
+        return encode_frame(state, frame, base)
+
+def compressed(response):
+    """gzips the body when the client accepts it (3000 map points: ~230 KB of JSON, ~45 KB gzipped)."""
+    with metrics.span("compress"):
+        body, encoding = maybe_gzip(response.get_data(), request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/predict-distributed', methods=['GET'])
+def predict_distributed():
+    try:
+        state = build_distributed_state(
+            g.basin, request.args.get('sim_rain'), request.args.get('sim_soil'), request.args.get('sim_dam')
+        )
+        if request.args.get('format') == 'compact':
+            return compressed(Response(encode_compact(state, request.args.get('base')), mimetype=FRAME_CONTENT_TYPE))
+        with metrics.span("serialize"):
+            return compressed(jsonify(state))
     except Exception as e:
+        metrics.count("predict_distributed_error")
         print(e)
         return jsonify({'error': str(e)})
 
-@app.route('/check-location', methods=['POST'])
-def check_location():
-    data = request.json
+@app.route('/stream-distributed', methods=['GET'])
+def stream_distributed():
+    """Server-Sent Events feed of the live state (same fields as /predict-distributed; ?format=compact for frames)."""
+    if not sync_streams.acquire(blocking=False):
+        metrics.count("stream_rejected")
+        return jsonify({'error': "Too many live streams, poll /predict-distributed"}), 503, {'Retry-After': '30'}
+    events = get_live_feed(g.basin).subscribe(request.args.get('format') == 'compact', SYNC_STREAM_SECONDS)
+    response = Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(sync_streams.release)  # Also when the client left before the first event
+    return response
+
+@app.route('/inundation-tiles/<int:level_cm>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def inundation_tile(level_cm, z, x, y):
+    """Flood extent / depth map tile. level_cm is the water surface level in centimetres."""
+    if not (MIN_ZOOM <= z <= MAX_ZOOM) or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': "Tile out of range"}), 404
+    png = g.basin.resources.inundation_tiles.get_tile(level_cm, z, x, y)
+    # A level's tiles only change with the LiDAR, and new LiDAR gets new URLs (?v=<terrain digest>)
+    return Response(png, mimetype='image/png', headers={'Cache-Control': 'public, max-age=86400'})
+
+def check_point(basin, lat, lon, discharge):
+    """One /check-location answer (terrain lookup + the basin's rating curve)."""
+    with metrics.span("terrain_lookup"):
+        elevation, source = get_elevation_from_mosaic(basin, lat, lon)
+    if elevation is None: return {'found': False, 'source': source}
+
+    # Rating Curve: Base level (292.5m at Haridwar) + Rise, Local Flow from depth
+    result = {'found': True, 'elevation': round(elevation, 3), 'source': source}
+    result.update(calculate_inundation(elevation, discharge, basin.config.base_level))
+    return result
+
+def parse_point(data):
+    """(lat, lon, discharge) from a /check-location body; raises ValueError if malformed."""
     try:
         lat, lon = round(float(data.get('lat')), 4), round(float(data.get('lon')), 4)
         discharge = float(data.get('discharge', 0))
-    except: return jsonify({'found': False, 'source': "Invalid"})
-    
-    elevation, source = get_elevation_from_mosaic(lat, lon)
-    if elevation is None: return jsonify({'found': False, 'source': source})
-    
-    # Rating Curve: Base 292.5m + Rise
-    BASE_LEVEL = 292.5
-    flood_rise = discharge / 55000 
-    water_surface_elevation = BASE_LEVEL + flood_rise
-    
-    status = "Terrain"; flood_depth = 0; is_active_river = False
-    local_flow = 0
-    
-    if elevation < water_surface_elevation:
-        is_active_river = True
-        status = "Inundated" if elevation > 294 else "Active Channel"
-        flood_depth = round(water_surface_elevation - elevation, 2)
-        
-        # --- LOCAL FLOW CALCULATION (The Fix) ---
-        # Deepest part of channel ~12m. 
-        # Formula: Local Flow = Total * (Depth / Max_Depth)^1.5
-        MAX_DEPTH_PROXY = 15.0 
-        ratio = min(flood_depth / MAX_DEPTH_PROXY, 1.0)
-        
-        # Apply exponential factor (Manning's Eq approx)
-        local_flow = int(discharge * (ratio ** 1.5))
-        if local_flow < 100: local_flow = 100 # Minimum visible flow
+    except: raise ValueError("Invalid")
+    return lat, lon, discharge
+
+@app.route('/check-location', methods=['POST'])
+def check_location():
+    try: lat, lon, discharge = parse_point(request.json)
+    except ValueError:
+        metrics.count("invalid_request")
+        return jsonify({'found': False, 'source': "Invalid"})
     
-    return jsonify({
-        'found': True, 'elevation': round(elevation, 3), 'is_river': is_active_river,
-        'status': status, 'flood_depth': flood_depth, 
-        'local_discharge': local_flow, # <--- Sends Dynamic Local Flow
-        'water_level': round(water_surface_elevation, 2), 'source': source
-    })
+    return jsonify(check_point(g.basin, lat, lon, discharge))
+
+MAX_BATCH_POINTS = 50000
+
+def parse_batch_points(data):
+    """(coords, discharge) from a /check-locations body. Raises ValueError with the client-facing message."""
+    try:
+        points = data.get('points') or []
+    except: raise ValueError("Invalid points")
+    if not isinstance(points, list): raise ValueError("points must be a list")
+    if len(points) > MAX_BATCH_POINTS:
+        raise ValueError(f"Too many points (max {MAX_BATCH_POINTS})")
+    try:
+        if points and isinstance(points[0], dict):
+            points = [[p.get('lat'), p.get('lon')] for p in points]
+        coords = np.round(np.array(points, dtype=np.float64).reshape(-1, 2), 4)
+        discharge = float(data.get('discharge', 0))
+    except: raise ValueError("Invalid points")
+    return coords, discharge
+
+def check_points(basin, coords, discharge):
+    """Batch check_point over an (n, 2) lat/lon array."""
+    res, base_level = basin.resources, basin.config.base_level
+    tiles = res.tiles  # Tile ids below index this same list
+    source = "No Tiles" if not tiles else "Outside"
+    with metrics.span("terrain_lookup_batch"):
+        elevations, tile_ids = get_elevations_from_mosaic(basin, coords[:, 0], coords[:, 1], res)
+    tile_names = [os.path.basename(ds.name) for ds in tiles]
+
+    results = []
+    for elevation, tile_id in zip(elevations.tolist(), tile_ids.tolist()):
+        if tile_id < 0:
+            results.append({'found': False, 'source': source})
+            continue
+        result = {'found': True, 'elevation': round(elevation, 3), 'source': tile_names[tile_id]}
+        result.update(calculate_inundation(elevation, discharge, base_level))
+        results.append(result)
+
+    return {
+        'count': len(results),
+        'water_level': round(get_water_surface_elevation(discharge, base_level), 2),
+        'results': results
+    }
+
+@app.route('/check-locations', methods=['POST'])
+def check_locations():
+    """Batch /check-location for road networks and building footprints.
+    Body: {"points": [[lat, lon], ...] or [{"lat":.., "lon":..}, ...], "discharge": ...}"""
+    try:
+        coords, discharge = parse_batch_points(request.json or {})
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return jsonify({'error': str(e)}), 400
+    return jsonify(check_points(g.basin, coords, discharge))
 
 @app.route('/get-forecast', methods=['GET'])
 def get_forecast():
+    if request.args.get('ensemble'):
+        try: members, hours, seed = parse_ensemble_args(request.args)
+        except ValueError as e:
+            metrics.count("invalid_request")
+            return jsonify({'error': str(e)}), 400
     try:
-        sim_rain = request.args.get('sim_rain')
-        forecast_data = []
-        now = datetime.now()
+        with metrics.span("weather"):
+            resp = g.basin.weather_client.get_snapshot()
+        if request.args.get('ensemble'):
+            # Probabilistic mode: {"forecast": [...same as below...], "bands", "exceedance", "peak", ...}
+            return jsonify(build_ensemble_forecast(g.basin, request.args.get('sim_rain'), resp, members, hours, seed))
+        with metrics.span("forecast"):
+            forecast = build_forecast(g.basin, request.args.get('sim_rain'), resp)
+        return jsonify(forecast)
+    except Exception as e:
+        metrics.count("get_forecast_error")
+        print(e)
+        return jsonify([])
+
+def build_forecast(basin, sim_rain, resp, hours=FORECAST_HOURS):
+    """Hourly hydrograph (12 h by default) from a weather snapshot (None = unavailable). No I/O."""
+    now = datetime.now()
+    hourly_rains, past_rain_sum = forecast_inputs(sim_rain, resp, hours, now)
+    return forecast_points(basin, hourly_rains, past_rain_sum, now)
+
+def forecast_inputs(sim_rain, resp, hours, now):
+    """(hourly rain for the next `hours`, past 5-day rain sum) from the snapshot or the simulation slider."""
+    # 1. Initialize Variables
+    base_rain = float(sim_rain) if sim_rain else 0.0
+    hourly_rains = []
+    past_rain_sum = 0.0 # Default to 0 for consistency
+    
+    # 2. FETCH REAL DATA (The Fix)
+    # We need both Future Rain (for the curve) AND Past Rain (for the baseline level)
+    try:
+        # Shared snapshot: past 5 days (Critical for matching live dashboard) + next 48 hours
+        # A. Calculate Past Rain (The Basin Memory)
+        # The API returns one big array: [Past 120 hrs] + [Future 48 hrs]
+        # We assume the first 120 items are "past"
+        all_rain = resp['hourly']['rain']
+        if len(all_rain) >= 120:
+            past_rain_sum = sum(all_rain[:120])
         
-        # 1. Initialize Variables
-        base_rain = float(sim_rain) if sim_rain else 0.0
-        hourly_rains = []
-        past_rain_sum = 0.0 # Default to 0 for consistency
+        # B. Get Future Rain (The Forecast)
+        if not sim_rain:
+            # Find the index for "Now" (current hour)
+            # This approximates the split point between past and future
+            current_hour_idx = 120 + now.hour 
+            # Slice the next `hours` hours
+            if current_hour_idx + hours < len(all_rain):
+                hourly_rains = all_rain[current_hour_idx : current_hour_idx + hours]
+            else:
+                hourly_rains = [0] * hours
+    except: 
+        metrics.count("forecast_defaults_used")
+        hourly_rains = [0] * hours
         
-        # 2. FETCH REAL DATA (The Fix)
-        # We need both Future Rain (for the curve) AND Past Rain (for the baseline level)
-        try:
-            url = "https://api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": 29.956, "longitude": 78.18,
-                "hourly": "rain", 
-                "forecast_days": 2, # Get next 48 hours
-                "past_days": 5,     # Get past 5 days (Critical for matching live dashboard)
-                "timezone": "Asia/Kolkata"
-            }
-            resp = requests.get(url, params=params, timeout=1).json()
-            
-            # A. Calculate Past Rain (The Basin Memory)
-            # The API returns one big array: [Past 120 hrs] + [Future 48 hrs]
-            # We assume the first 120 items are "past"
-            all_rain = resp['hourly']['rain']
-            if len(all_rain) >= 120:
-                past_rain_sum = sum(all_rain[:120])
-            
-            # B. Get Future Rain (The Forecast)
-            if not sim_rain:
-                # Find the index for "Now" (current hour)
-                # This approximates the split point between past and future
-                current_hour_idx = 120 + now.hour 
-                # Slice next 12 hours
-                if current_hour_idx + 12 < len(all_rain):
-                    hourly_rains = all_rain[current_hour_idx : current_hour_idx + 12]
-                else:
-                    hourly_rains = [0] * 12
-        except: 
-            hourly_rains = [0] * 12
-            
-        # 3. Simulation Override (If Simulation Mode is ON)
-        if sim_rain:
-            # If simulating, we ignore real weather and generate a curve
-            hourly_rains = []
-            for i in range(12):
-                if i == 0: factor = 0.2
-                elif i == 1: factor = 0.6
-                elif i == 2: factor = 1.0 
-                elif i == 3: factor = 0.8
-                else: factor = 0.8 * (0.75 ** (i-3))
-                hourly_rains.append(base_rain * factor)
-            # In simulation, we assume some base wetness (e.g. 50mm) to show a "What-If" scenario
-            # But in Live Mode (else), we use the real 'past_rain_sum' calculated above.
-            past_rain_sum = 50.0 
-
-        # 4. Generate Data Points
-        for i, rain in enumerate(hourly_rains):
-            # We use the correct 'past_rain_sum' (0 for live winter, 50 for sim)
-            q = calculate_scs_cn_discharge(rain, past_rain_sum, 0)
-            
-            risk = 2 if q > 140000 else (1 if q > 80000 else 0)
-            forecast_data.append({
-                "time": (now + timedelta(hours=i)).strftime("%H:%M"),
-                "rain": round(rain, 1),
-                "discharge": q,
-                "risk": risk
-            })
-            
-        return jsonify(forecast_data)
+    # 3. Simulation Override (If Simulation Mode is ON)
+    if sim_rain:
+        # If simulating, we ignore real weather and generate a curve
+        hourly_rains = simulated_rain_curve(base_rain, hours).tolist()
+        # In simulation, we assume some base wetness (e.g. 50mm) to show a "What-If" scenario
+        # But in Live Mode (else), we use the real 'past_rain_sum' calculated above.
+        past_rain_sum = 50.0 
+
+    return hourly_rains, past_rain_sum
+
+def forecast_points(basin, hourly_rains, past_rain_sum, now):
+    """4. Generate Data Points: one {time, rain, discharge, risk} row per hour."""
+    forecast_data = []
+    for i, rain in enumerate(hourly_rains):
+        # We use the correct 'past_rain_sum' (0 for live winter, 50 for sim)
+        q = calculate_scs_cn_discharge(basin, rain, past_rain_sum, 0)
+        
+        risk = rule_risk(q)
+        forecast_data.append({
+            "time": (now + timedelta(hours=i)).strftime("%H:%M"),
+            "rain": round(rain, 1),
+            "discharge": q,
+            "risk": risk
+        })
+        
+    return forecast_data
+
+def parse_ensemble_args(args):
+    """(members, hours, seed) from /get-forecast query args; raises ValueError with the client-facing message."""
+    try:
+        members = int(args.get('members', ENSEMBLE_MEMBERS))
+        hours = int(args.get('hours', FORECAST_HOURS))
+        seed = int(args.get('seed', ENSEMBLE_SEED))
+    except (TypeError, ValueError): raise ValueError("members, hours and seed must be integers")
+    if not 1 <= members <= ENSEMBLE_MAX_MEMBERS: raise ValueError(f"members must be 1-{ENSEMBLE_MAX_MEMBERS}")
+    if not 1 <= hours <= MAX_FORECAST_HOURS: raise ValueError(f"hours must be 1-{MAX_FORECAST_HOURS}")
+    return members, hours, seed
+
+def build_ensemble_forecast(basin, sim_rain, resp, members=ENSEMBLE_MEMBERS, hours=FORECAST_HOURS, seed=ENSEMBLE_SEED):
+    """Deterministic hydrograph + ensemble bands (members x hours in one array pass). No I/O."""
+    now = datetime.now()
+    hourly_rains, past_rain_sum = forecast_inputs(sim_rain, resp, hours, now)
+    with metrics.span("ensemble"):
+        discharge = run_ensemble(hourly_rains, past_rain_sum, get_seasonal_base_flow(basin), 0.0, members, seed)
+        summary = summarize(discharge)
+    return {
+        'forecast': forecast_points(basin, hourly_rains, past_rain_sum, now),
+        'members': members, 'hours': hours, 'seed': seed,
+        'thresholds': {'warning': WARNING_CUSECS, 'critical': CRITICAL_CUSECS},
+        **summary
+    }
+
+# --- VIEWPORT LEVEL OF DETAIL ---
+# Runoff for the points inside the map view only: full detail zoomed in, binned cells zoomed out (point_index.py)
+
+def first_use(basin, res, name, build):
+    """
+    Resource `name` of bundle res, built by build(res) on first use (point index, router). It is
+    swapped into the basin's bundle only while res is still current, so a build that raced an
+    unload serves its own request and is dropped with the old bundle.
+    """
+    obj = getattr(res, name)
+    if obj is None:
+        with basin.lock:
+            current = basin.resources
+            obj = getattr(current, name) if current.generation == res.generation else None
+            if obj is None:
+                obj = build(res)
+                basin.update(res.generation, charges={name: (obj, array_nbytes(obj))}, **{name: obj})
+        basins.enforce(keep=basin)
+    return obj
+
+def get_point_index(basin, resources=None):
+    """Grid index over the basin's catchment coordinates, built on first use."""
+    def build(res):
+        started = time.perf_counter()
+        catchment = res.catchment
+        index = PointIndex(catchment['lat'], catchment['lon']) if not catchment.empty else PointIndex([], [])
+        print(f"Point index ready [{basin.id}]: {index.nx}x{index.ny} cells in {time.perf_counter() - started:.1f}s")
+        return index
+    return first_use(basin, resources or basin.resources, 'point_index', build)
+
+def parse_viewport_args(args):
+    """(bbox, zoom, aggregate) from query args; raises ValueError with the client-facing message."""
+    bbox = parse_bbox(args.get('bbox', ''))
+    try: zoom = float(args.get('zoom', ''))
+    except ValueError: raise ValueError("zoom must be a number")
+    if not 0 <= zoom <= 24: raise ValueError("zoom must be 0-24")
+    how = args.get('aggregate', 'max')
+    if how not in AGGREGATES: raise ValueError(f"aggregate must be one of {', '.join(AGGREGATES)}")
+    return bbox, zoom, how
+
+def build_viewport(basin, bbox, zoom, how, sim_rain, resp):
+    """Viewport map for the live (or simulated) rain. No I/O."""
+    rain = quantize(sim_rain, RAIN_STEP) if sim_rain else weather_inputs(resp)['rain']
+    res = basin.resources
+    index, kernel, catchment = get_point_index(basin, res), res.runoff_kernel, res.catchment
+    # No catchment points (none built, or unloaded): an empty view, like the empty point index
+    lat, lon = (catchment['lat'], catchment['lon']) if not catchment.empty else (np.empty(0, np.float32),) * 2
+    with metrics.span("viewport_points"):
+        view = viewport_points(index, kernel, lat, lon, rain, bbox, zoom, how)
+    view['rainfall_input'] = rain
+    return view
+
+@app.route('/viewport-points', methods=['GET'])
+def viewport():
+    """?bbox=west,south,east,north&zoom=z[&aggregate=max|mean][&sim_rain=...]: runoff points or cells in view."""
+    try: bbox, zoom, how = parse_viewport_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return jsonify({'error': str(e)}), 400
+    try:
+        with metrics.span("weather"):
+            resp = g.basin.weather_client.get_snapshot()
+        view = build_viewport(g.basin, bbox, zoom, how, request.args.get('sim_rain'), resp)
+        with metrics.span("serialize"):
+            return compressed(jsonify(view))
     except Exception as e:
+        metrics.count("viewport_points_error")
         print(e)
-        return jsonify([])
+        return jsonify({'error': str(e)}), 500
+
+# --- SCENARIO SWEEP ---
+# Decision matrices over rain x soil moisture x dam release x antecedent rain in one array pass (sweep.py)
+
+def parse_sweep_args(args):
+    """{axis: values, or None to hold it at the live value} from query args; raises ValueError with the client-facing message."""
+    axes = {name: axis_values(args[name], name) if args.get(name) else None for name in SWEEP_AXES}
+    if all(values is None for values in axes.values()):
+        raise ValueError(f"Give at least one axis ({', '.join(SWEEP_AXES)}) as start:stop:step or a,b,c")
+    count = math.prod(len(values) for values in axes.values() if values is not None)
+    if count > SWEEP_MAX_SCENARIOS: raise ValueError(f"{count} scenarios requested (max {SWEEP_MAX_SCENARIOS})")
+    return axes
+
+def build_sweep(basin, axes, resp):
+    """Sweep table with missing axes (and snow depth) taken from the weather snapshot. No I/O."""
+    live = weather_inputs(resp)
+    held = {name: live[name] for name, values in axes.items() if values is None}
+    with metrics.span("scenario_sweep"):
+        table = sweep(**{name: [held[name]] if values is None else values for name, values in axes.items()},
+                      base_flow=get_seasonal_base_flow(basin), snow_depth=live['snow_depth'], model=basin.resources.model)
+    table['held'] = {**held, 'snow_depth': live['snow_depth']}
+    return table
+
+@app.route('/scenario-sweep', methods=['GET'])
+def scenario_sweep():
+    """
+    Discharge, risk, confidence, impact and lag time for every combination of the given axes
+    (?rain=0:300:10&soil_moisture=0.1,0.3,0.5&dam_release=...&past_rain_sum=...). Columnar, gzipped.
+    """
+    try: axes = parse_sweep_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return jsonify({'error': str(e)}), 400
+    try:
+        with metrics.span("weather"):
+            resp = g.basin.weather_client.get_snapshot()
+        table = build_sweep(g.basin, axes, resp)
+        with metrics.span("serialize"):
+            return compressed(jsonify(table))
+    except Exception as e:
+        metrics.count("scenario_sweep_error")
+        print(e)
+        return jsonify({'error': str(e)}), 500
+
+# --- DISTRIBUTED ROUTING ---
+# Travel time per catchment point + unit-hydrograph routing to the basin's gauge (routing.py)
+
+MAX_ROUTED_POINTS = 1000
+
+def get_router(basin, resources=None):
+    """Router over the basin's catchment, built on first use (travel times + point grouping)."""
+    def build(res):
+        started = time.perf_counter()
+        config = basin.config
+        router = Router.from_store(res.catchment, outlet=(config.lat, config.lon, config.base_level))
+        print(f"Routing ready [{basin.id}]: {router.size} points in {router.groups} groups, {len(router.uh)} unit hydrographs "
+              f"({time.perf_counter() - started:.1f}s)")
+        return router
+    return first_use(basin, resources or basin.resources, 'router', build)
+
+def parse_routing_args(args):
+    """(hours, sampled points) from /routed-hydrograph query args; raises ValueError with the client-facing message."""
+    try:
+        hours = int(args.get('hours', FORECAST_HOURS))
+        points = int(args.get('points', 0))
+    except (TypeError, ValueError): raise ValueError("hours and points must be integers")
+    if not 1 <= hours <= MAX_FORECAST_HOURS: raise ValueError(f"hours must be 1-{MAX_FORECAST_HOURS}")
+    if not 0 <= points <= MAX_ROUTED_POINTS: raise ValueError(f"points must be 0-{MAX_ROUTED_POINTS}")
+    return hours, points
+
+def build_routed_hydrograph(basin, sim_rain, resp, hours=FORECAST_HOURS, points=0):
+    """
+    Outlet hydrograph for the next `hours`: the lumped engine's runoff (same inputs as build_forecast)
+    routed from the past 5 days of rain + the forecast. No I/O.
+    """
+    now = datetime.now()
+    future, past_rain_sum = forecast_inputs(sim_rain, resp, hours, now)
+    if sim_rain:
+        # The simulated antecedent rain replaces the live past days (spread evenly over the 5 days)
+        history = [past_rain_sum / 120] * 120
+    else:
+        try: history = [float(r or 0) for r in resp['hourly']['rain'][:120 + now.hour]]
+        except: history = []
+    rain = history + [float(r) for r in future]
+
+    res = basin.resources
+    routing, catchment = get_router(basin, res), res.catchment
+    with metrics.span("routing"):
+        flow = routing.outlet_hydrograph(rain, past_rain_sum, get_seasonal_base_flow(basin))[len(history):]
+    result = {
+        'hydrograph': [{
+            "time": (now + timedelta(hours=i)).strftime("%H:%M"),
+            "rain": round(r, 1),
+            "discharge": float(round(q, 0)),
+            "risk": rule_risk(q)
+        } for i, (r, q) in enumerate(zip(future, flow.tolist()))],
+        'peak_discharge': float(round(flow.max(), 0)) if len(flow) else None,
+        'hours_to_peak': int(flow.argmax()) if len(flow) else None,
+        'catchment_points': routing.size
+    }
+    if points and routing.size:
+        # Per-point routed runoff (mm/h arriving at the outlet) for a sample of points, the same on every poll
+        ids = stable_sample(np.arange(routing.size), min(points, routing.size))
+        with metrics.span("routing_points"):
+            series = routing.point_series(rain, ids, past_rain_sum)[:, len(history):]
+        result['points'] = [{'lat': round(float(catchment['lat'][i]), 5), 'lon': round(float(catchment['lon'][i]), 5),
+                             'travel_hours': round(float(routing.travel_hours[i]), 2), 'runoff_mm': np.round(row, 3).tolist()}
+                            for i, row in zip(ids.tolist(), series)]
+    return result
+
+@app.route('/routed-hydrograph', methods=['GET'])
+def routed_hydrograph():
+    """Time-stepped distributed routing: outlet hydrograph (+ optional per-point series, ?points=N)."""
+    try: hours, points = parse_routing_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return jsonify({'error': str(e)}), 400
+    try:
+        with metrics.span("weather"):
+            resp = g.basin.weather_client.get_snapshot()
+        return jsonify(build_routed_hydrograph(g.basin, request.args.get('sim_rain'), resp, hours, points))
+    except Exception as e:
+        metrics.count("routed_hydrograph_error")
+        print(e)
+        return jsonify({'error': str(e)}), 500
+
+# Everything is defined: load the pinned basins' heavy resources in the background
+basins.start()
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,147 @@
+#archive.py
+import os
+import numpy as np
+
+# CONFIGURATION
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+ARCHIVE_CACHE_DIR = os.environ.get("RIVERLY_ARCHIVE_DIR", "archive_cache")
+DAILY_VARIABLES = ["rain_sum", "soil_moisture_0_to_7cm_mean", "snowfall_sum"]
+TIMEZONE = "Asia/Kolkata"
+
+
+# --- PROVIDERS ---
+# A provider has one method, fetch(lat, lon, start, end, variables), returning columns:
+# {"date": datetime64[D] array, "<variable>": float32 array, ...} for start..end inclusive.
+
+class OpenMeteoArchiveProvider:
+    """ERA5-Land daily data from the Open-Meteo historical archive."""
+
+    def __init__(self, url=ARCHIVE_URL, timezone=TIMEZONE):
+        import openmeteo_requests
+        import requests_cache
+        from retry_requests import retry
+        self.url, self.timezone = url, timezone
+        cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+        retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
+        self.client = openmeteo_requests.Client(session = retry_session)
+
+    def fetch(self, lat, lon, start, end, variables):
+        params = {
+            "latitude": lat, "longitude": lon,
+            "start_date": str(start), "end_date": str(end),
+            "daily": list(variables), "timezone": self.timezone
+        }
+        response = self.client.weather_api(self.url, params=params)[0]
+        daily = response.Daily()
+        # Local calendar days (timestamps are UTC; shift by the location's offset)
+        offset = response.UtcOffsetSeconds()
+        first = np.datetime64((daily.Time() + offset) // 86400, "D")
+        n = len(daily.Variables(0).ValuesAsNumpy())
+        columns = {"date": first + np.arange(n)}
+        for i, name in enumerate(variables):
+            columns[name] = daily.Variables(i).ValuesAsNumpy().astype(np.float32)
+        return columns
+
+
+class LocalArchiveProvider:
+    """Offline provider: a CSV fixture with a 'date' column and one column per daily variable."""
+
+    def __init__(self, path):
+        import pandas as pd
+        df = pd.read_csv(path)
+        self.dates = pd.to_datetime(df["date"]).to_numpy().astype("datetime64[D]")
+        self.columns = {name: df[name].to_numpy(dtype=np.float32) for name in df.columns if name != "date"}
+
+    def fetch(self, lat, lon, start, end, variables):
+        keep = (self.dates >= np.datetime64(start, "D")) & (self.dates <= np.datetime64(end, "D"))
+        missing = [name for name in variables if name not in self.columns]
+        if missing: raise KeyError(f"Fixture has no column(s) {missing}")
+        columns = {"date": self.dates[keep]}
+        for name in variables: columns[name] = self.columns[name][keep]
+        return columns
+
+
+# --- LOCAL COLUMNAR CACHE ---
+
+class ArchiveCache:
+    """
+    Daily archive data per location, kept as one column per variable in an .npz file
+    ({cache_dir}/{lat}_{lon}.npz). A request only fetches the days (or variables)
+    the file does not have yet; everything already on disk is reused.
+    cache_dir=None skips the disk entirely (e.g. for fixtures, which are local already).
+    """
+
+    def __init__(self, provider=None, cache_dir=ARCHIVE_CACHE_DIR):
+        self.provider = provider
+        self.cache_dir = cache_dir
+        self.fetches = 0
+
+    def path(self, lat, lon):
+        return os.path.join(self.cache_dir, f"{lat:.3f}_{lon:.3f}.npz")
+
+    def load(self, lat, lon):
+        if self.cache_dir is None: return None
+        path = self.path(lat, lon)
+        if not os.path.exists(path): return None
+        with np.load(path) as f:
+            columns = {name: f[name] for name in f.files}
+        columns["date"] = columns["date"].astype("datetime64[D]")
+        return columns
+
+    def save(self, lat, lon, columns):
+        if self.cache_dir is None: return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(lat, lon)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **columns)
+        os.replace(tmp, path)
+
+    def get(self, lat, lon, start, end, variables=DAILY_VARIABLES):
+        """Columns for start..end (inclusive), fetching only what is missing locally."""
+        start, end = np.datetime64(start, "D"), np.datetime64(end, "D")
+        wanted = np.arange(start, end + 1)
+        cached = self.load(lat, lon)
+
+        if cached is not None and all(name in cached for name in variables):
+            missing_days = wanted[~np.isin(wanted, cached["date"])]
+        else:
+            # New location or new variable: the requested span is fetched in full
+            missing_days = wanted
+        ranges = missing_ranges(missing_days)
+        if ranges:
+            if self.provider is None:
+                raise LookupError(f"{len(missing_days)} day(s) not cached for ({lat}, {lon}) and no provider to fetch them")
+            for range_start, range_end in ranges:
+                print(f"Fetching archive {range_start} -> {range_end} ({lat}, {lon})...")
+                fetched = self.provider.fetch(lat, lon, range_start, range_end, variables)
+                self.fetches += 1
+                cached = merge_columns(cached, fetched)
+            self.save(lat, lon, cached)
+
+        keep = (cached["date"] >= start) & (cached["date"] <= end)
+        return {name: cached[name][keep] for name in ["date"] + list(variables)}
+
+
+def missing_ranges(days):
+    """Sorted datetime64[D] days -> [(first, last), ...] contiguous runs."""
+    if len(days) == 0: return []
+    days = np.sort(days)
+    breaks = np.flatnonzero(np.diff(days) != np.timedelta64(1, "D"))
+    starts = np.r_[0, breaks + 1]
+    ends = np.r_[breaks, len(days) - 1]
+    return [(days[s], days[e]) for s, e in zip(starts, ends)]
+
+
+def merge_columns(old, new):
+    """Union of two column sets by date (new values win), sorted by date."""
+    if old is None or len(old["date"]) == 0: return {name: np.asarray(v) for name, v in new.items()}
+    dates = np.union1d(old["date"], new["date"])
+    merged = {"date": dates}
+    for name in set(old) | set(new):
+        if name == "date": continue
+        column = np.full(len(dates), np.nan, dtype=np.float32)
+        for source in (old, new):
+            if name in source:
+                column[np.searchsorted(dates, source["date"])] = source[name]
+        merged[name] = column
+    return merged
@@ -0,0 +1,455 @@
+#asgi_app.py
+# Async (ASGI) entry point for the same API as app.py.
+# Weather comes from a non-blocking aiohttp client; terrain lookups and the hydrology /
+# AI pipeline run on a small bounded thread pool, so a slow upstream or a heavy request
+# never stalls the event loop.
+#
+#   uvicorn asgi_app:app --port 5000        (or: python asgi_app.py)
+#
+# app.py is imported for its basin registry (model, tiles and catchment per basin); the Flask
+# server keeps working. ?basin=<id> selects the basin here too.
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+import app as core
+import metrics
+from weather import create_async_weather_client, WEATHER_TIMEOUT
+from live_feed import LiveFeed
+
+# CONFIGURATION
+CPU_WORKERS = int(os.environ.get("RIVERLY_CPU_WORKERS", min(4, os.cpu_count() or 1)))  # Threads for CPU work
+MAX_PENDING = int(os.environ.get("RIVERLY_MAX_PENDING", CPU_WORKERS * 8))  # Offloaded jobs admitted at once
+QUEUE_WAIT = 5.0                  # Seconds a request may wait for a slot before getting 503
+MAX_BODY_BYTES = 16 * 1024 * 1024  # 50k batch points fit comfortably
+
+executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="riverly-cpu")
+weathers = {}  # basin id -> AsyncWeatherClient (used from the event loop only)
+state = {"loop": None, "slots": None, "pending": 0, "rejected": 0}
+
+
+class ServerBusy(Exception):
+    pass
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def offload(fn, *args):
+    """Runs fn(*args) on the CPU pool. Admission is bounded so a burst queues briefly, then sheds."""
+    try:
+        await asyncio.wait_for(state["slots"].acquire(), QUEUE_WAIT)
+    except asyncio.TimeoutError:
+        state["rejected"] += 1
+        metrics.count("server_busy")
+        raise ServerBusy()
+    state["pending"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        state["pending"] -= 1
+        state["slots"].release()
+
+
+def weather_for(basin):
+    """The basin's async weather client, made on first use."""
+    client = weathers.get(basin.id)
+    if client is None:
+        config = basin.config
+        client = weathers[basin.id] = create_async_weather_client(config.lat, config.lon, config.weather_file)
+    return client
+
+weather = weather_for(core.basins.default)
+
+def live_state(basin):
+    """Live-feed tick (runs on the feed thread): weather from the loop's client, compute right here."""
+    future = asyncio.run_coroutine_threadsafe(weather_for(basin).get_snapshot(), state["loop"])
+    try: snapshot = future.result(WEATHER_TIMEOUT + 1)
+    except Exception:
+        metrics.count("weather_unavailable")
+        snapshot = None
+    return core.state_from_snapshot(basin, snapshot)
+
+live_feeds = {}  # basin id -> LiveFeed (made on the event loop, so no lock)
+
+def get_live_feed(basin):
+    """The basin's LiveFeed, made on first use (its thread only runs while dashboards are connected)."""
+    feed = live_feeds.get(basin.id)
+    if feed is None:
+        feed = live_feeds[basin.id] = LiveFeed(lambda: live_state(basin), ready=lambda: core.basins.ready(
+            basin, *core.ROUTE_NEEDS['/predict-distributed']))
+    return feed
+
+live_feed = get_live_feed(core.basins.default)
+
+# Same gauge names as app.py, pointed at this server's weather clients and feeds
+metrics.gauge("riverly_weather_fetches_total", "Upstream weather fetches.", lambda: sum(w.fetch_count for w in list(weathers.values())), "counter")
+metrics.gauge("riverly_weather_errors_total", "Failed upstream weather fetches.", lambda: sum(w.error_count for w in list(weathers.values())), "counter")
+metrics.gauge("riverly_weather_age_seconds", "Age of the default basin's weather snapshot.", lambda: weather.stats()["age_seconds"])
+metrics.gauge("riverly_live_feed_subscribers", "Dashboards connected to /stream-distributed.", lambda: sum(f.stats()["subscribers"] for f in list(live_feeds.values())))
+metrics.gauge("riverly_startup_pending", "Default basin components still loading.", lambda: len(core.startup.pending()))
+metrics.gauge("riverly_cpu_jobs_pending", "Jobs admitted to the CPU pool.", lambda: state["pending"])
+metrics.gauge("riverly_cpu_jobs_rejected_total", "Requests shed with 503 (CPU pool full).", lambda: state["rejected"], "counter")
+
+
+# --- REQUEST / RESPONSE HELPERS ---
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope, self.receive = scope, receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        self.args = {k: v[0] for k, v in query.items()}
+
+    async def body(self):
+        chunks, size = [], 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect": break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES: raise BodyTooLarge()
+            chunks.append(chunk)
+            if not message.get("more_body"): break
+        return b"".join(chunks)
+
+    async def json(self):
+        """Parsed JSON body, or None if missing/malformed (like Flask's silent mode)."""
+        body = await self.body()
+        try: return json.loads(body or b"null")
+        except ValueError: return None
+
+
+def cors_headers(scope):
+    headers = [(b"access-control-allow-origin", b"*")]
+    for name, value in scope.get("headers", []):
+        if name == b"access-control-request-headers":
+            headers.append((b"access-control-allow-headers", value))
+    return headers
+
+
+async def send_bytes(send, scope, body, content_type, status=200, extra_headers=()):
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", content_type), (b"content-length", str(len(body)).encode())
+    ] + list(extra_headers) + cors_headers(scope)})
+    await send({"type": "http.response.body", "body": body})
+
+def request_header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name: return value.decode("latin-1")
+    return None
+
+async def send_compressed(send, scope, body, content_type, status=200):
+    """send_bytes, gzipped when the client accepts it (same rule as the Flask app)."""
+    with metrics.span("compress"):
+        body, encoding = core.maybe_gzip(body, request_header(scope, b"accept-encoding"))
+    extra = [(b"vary", b"Accept-Encoding")] + ([(b"content-encoding", encoding.encode())] if encoding else [])
+    await send_bytes(send, scope, body, content_type, status, extra)
+
+async def send_json(send, scope, payload, status=200, compress=False):
+    with metrics.span("serialize"):
+        body = json.dumps(payload, separators=(",", ":")).encode()
+    if compress: await send_compressed(send, scope, body, b"application/json", status)
+    else: await send_bytes(send, scope, body, b"application/json", status)
+
+
+# --- API ROUTES ---
+# Handlers return (payload, status). Same paths and payloads as the Flask app.
+
+async def health(request):
+    return {'status': 'ok', 'uptime_seconds': core.startup.status()['uptime_seconds']}, 200
+
+async def ready(request):
+    status = core.startup.status()
+    return status, 200 if status['status'] != 'loading' else 503
+
+async def tiles_coverage(request):
+    return request.basin.resources.coverage_bounds, 200
+
+async def list_basins(request):
+    return core.basins.stats(), 200
+
+async def cache_stats(request):
+    basin = request.basin
+    return {
+        'scenario': core.scenario_cache.stats(),
+        'raster_blocks': core.block_cache.stats(),
+        'raster_handles': core.raster_pool.stats(),
+        'weather': weather_for(basin).stats(),
+        'live_feed': get_live_feed(basin).stats(),
+        'inundation_tiles': basin.resources.inundation_tiles.stats(),
+        'basins': core.basins.stats(),
+        'executor': {'workers': CPU_WORKERS, 'max_pending': MAX_PENDING,
+                     'pending': state["pending"], 'rejected': state["rejected"]}
+    }, 200
+
+async def get_forecast(request):
+    args = request.args
+    if args.get('ensemble'):
+        try: members, hours, seed = core.parse_ensemble_args(args)
+        except ValueError as e:
+            metrics.count("invalid_request")
+            return {'error': str(e)}, 400
+    try:
+        with metrics.span("weather"):
+            snapshot = await weather_for(request.basin).get_snapshot()
+        if args.get('ensemble'):
+            # Thousands of members: array work, so it goes to the CPU pool
+            return await offload(core.build_ensemble_forecast, request.basin, args.get('sim_rain'), snapshot, members, hours, seed), 200
+        # 12 rating-curve evaluations: cheaper inline than a thread hop
+        with metrics.span("forecast"):
+            return core.build_forecast(request.basin, args.get('sim_rain'), snapshot), 200
+    except ServerBusy: raise
+    except Exception as e:
+        metrics.count("get_forecast_error")
+        print(e)
+        return [], 200
+
+async def routed_hydrograph(request):
+    try: hours, points = core.parse_routing_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return {'error': str(e)}, 400
+    try:
+        with metrics.span("weather"):
+            snapshot = await weather_for(request.basin).get_snapshot()
+        return await offload(core.build_routed_hydrograph, request.basin, request.args.get('sim_rain'), snapshot, hours, points), 200
+    except ServerBusy: raise
+    except Exception as e:
+        metrics.count("routed_hydrograph_error")
+        print(e)
+        return {'error': str(e)}, 500
+
+async def viewport_points(request):
+    try: bbox, zoom, how = core.parse_viewport_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return {'error': str(e)}, 400
+    try:
+        with metrics.span("weather"):
+            snapshot = await weather_for(request.basin).get_snapshot()
+        return await offload(core.build_viewport, request.basin, bbox, zoom, how, request.args.get('sim_rain'), snapshot), 200
+    except ServerBusy: raise
+    except Exception as e:
+        metrics.count("viewport_points_error")
+        print(e)
+        return {'error': str(e)}, 500
+
+async def scenario_sweep(request):
+    try: axes = core.parse_sweep_args(request.args)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return {'error': str(e)}, 400
+    try:
+        with metrics.span("weather"):
+            snapshot = await weather_for(request.basin).get_snapshot()
+        return await offload(core.build_sweep, request.basin, axes, snapshot), 200
+    except ServerBusy: raise
+    except Exception as e:
+        metrics.count("scenario_sweep_error")
+        print(e)
+        return {'error': str(e)}, 500
+
+async def check_location(request):
+    try: lat, lon, discharge = core.parse_point(await request.json())
+    except ValueError:
+        metrics.count("invalid_request")
+        return {'found': False, 'source': "Invalid"}, 200
+    return await offload(core.check_point, request.basin, lat, lon, discharge), 200
+
+async def check_locations(request):
+    data = await request.json() or {}
+    try:
+        coords, discharge = await offload(core.parse_batch_points, data)
+    except ValueError as e:
+        metrics.count("invalid_request")
+        return {'error': str(e)}, 400
+    return await offload(core.check_points, request.basin, coords, discharge), 200
+
+ROUTES = {
+    ('GET', '/health'): health,
+    ('GET', '/ready'): ready,
+    ('GET', '/tiles-coverage'): tiles_coverage,
+    ('GET', '/cache-stats'): cache_stats,
+    ('GET', '/basins'): list_basins,
+    ('GET', '/get-forecast'): get_forecast,
+    ('GET', '/routed-hydrograph'): routed_hydrograph,
+    ('GET', '/scenario-sweep'): scenario_sweep,
+    ('GET', '/viewport-points'): viewport_points,
+    ('POST', '/check-location'): check_location,
+    ('POST', '/check-locations'): check_locations,
+}
+COMPRESSED_ROUTES = {'/scenario-sweep', '/viewport-points'}  # Large tables: gzipped when the client accepts it
+
+
+async def inundation_tile(request, send):
+    """/inundation-tiles/<level_cm>/<z>/<x>/<y>.png, rendered on the CPU pool."""
+    try:
+        level_cm, z, x, y = (int(p) for p in request.path[len("/inundation-tiles/"):].removesuffix(".png").split("/"))
+    except ValueError:
+        return await send_json(send, request.scope, {'error': "Not found"}, 404)
+    if not (core.MIN_ZOOM <= z <= core.MAX_ZOOM) or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return await send_json(send, request.scope, {'error': "Tile out of range"}, 404)
+    try:
+        png = await offload(request.basin.resources.inundation_tiles.get_tile, level_cm, z, x, y)
+    except ServerBusy:
+        return await send_json(send, request.scope, {'error': "Server busy, retry shortly"}, 503)
+    await send_bytes(send, request.scope, png, b"image/png", extra_headers=[(b"cache-control", b"public, max-age=86400")])
+
+
+async def metrics_endpoint(request, send):
+    """Prometheus text format (same families as the Flask app's /metrics)."""
+    await send_bytes(send, request.scope, metrics.render().encode(), b"text/plain; version=0.0.4")
+
+
+async def debug_profile(request, send):
+    """Folded stacks from the sampling profiler; ?reset=1 clears them."""
+    if metrics.profiler is None:
+        return await send_json(send, request.scope, {'error': "Profiler off (set RIVERLY_PROFILE_HZ, e.g. 99)"}, 404)
+    folded = metrics.profiler.folded()
+    if request.args.get('reset'): metrics.profiler.reset()
+    await send_bytes(send, request.scope, folded.encode(), b"text/plain")
+
+
+async def predict_distributed(request, send):
+    """JSON by default, binary frames with ?format=compact (&base=<frame> for a delta); gzipped either way."""
+    args, scope = request.args, request.scope
+    try:
+        with metrics.span("weather"):
+            snapshot = await weather_for(request.basin).get_snapshot()
+        payload = await offload(core.state_from_snapshot, request.basin, snapshot,
+                                args.get('sim_rain'), args.get('sim_soil'), args.get('sim_dam'))
+        if args.get('format') == 'compact':
+            body = await offload(core.encode_compact, payload, args.get('base'))
+            return await send_compressed(send, scope, body, core.FRAME_CONTENT_TYPE.encode())
+    except ServerBusy:
+        return await send_json(send, scope, {'error': "Server busy, retry shortly"}, 503)
+    except Exception as e:
+        metrics.count("predict_distributed_error")
+        print(e)
+        payload = {'error': str(e)}
+    await send_json(send, scope, payload, compress=True)
+
+
+async def stream_distributed(request, send):
+    """Server-Sent Events feed of the live state. Idle subscribers cost a coroutine, not a thread."""
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream; charset=utf-8"),
+        (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")
+    ] + cors_headers(request.scope)})
+
+    async def wait_disconnect():
+        while (await request.receive())["type"] != "http.disconnect": pass
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    events = get_live_feed(request.basin).subscribe_async(request.args.get('format') == 'compact')
+    try:
+        while True:
+            nxt = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({nxt, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not nxt.done():
+                nxt.cancel()
+                await asyncio.wait({nxt})  # Let the generator unwind before closing it
+                break
+            await send({"type": "http.response.body", "body": nxt.result().encode(), "more_body": True})
+    except OSError:
+        pass  # Client went away mid-write
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+# --- ASGI APPLICATION ---
+
+def bind_loop():
+    if state["loop"] is None:
+        state["loop"] = asyncio.get_running_loop()
+        state["slots"] = asyncio.Semaphore(MAX_PENDING)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            bind_loop()
+            print(f"ASGI READY: {CPU_WORKERS} CPU workers, {MAX_PENDING} pending jobs max.")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for client in list(weathers.values()): await client.close()
+            executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+RAW_ROUTES = {
+    ('GET', '/predict-distributed'): predict_distributed,
+    ('GET', '/metrics'): metrics_endpoint,
+    ('GET', '/debug/profile'): debug_profile,
+}
+
+def route_label(request):
+    """Route template for metrics (same labels as the Flask app; tile coordinates never become labels)."""
+    if request.path.startswith("/inundation-tiles/"): return "/inundation-tiles/<int:level_cm>/<int:z>/<int:x>/<int:y>.png"
+    if (request.method, request.path) in ROUTES or (request.method, request.path) in RAW_ROUTES: return request.path
+    return "unmatched"
+
+async def dispatch(request, send, unknown_basin=None):
+    scope = request.scope
+    if unknown_basin is not None:
+        return await send_json(send, scope, *unknown_basin)
+    not_ready = core.not_ready_payload(route_label(request), request.basin)
+    if not_ready is not None:
+        body = json.dumps(not_ready[0]).encode()
+        return await send_bytes(send, scope, body, b"application/json", not_ready[1], [(b"retry-after", b"2")])
+    if request.method == "GET" and request.path.startswith("/inundation-tiles/"):
+        return await inundation_tile(request, send)
+    raw = RAW_ROUTES.get((request.method, request.path))
+    if raw is not None:
+        return await raw(request, send)
+
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None:
+        known = any(path == request.path for _, path in list(ROUTES) + list(RAW_ROUTES))
+        return await send_json(send, scope, {'error': "Method not allowed" if known else "Not found"}, 405 if known else 404)
+    try:
+        payload, status = await handler(request)
+    except ServerBusy:
+        payload, status = {'error': "Server busy, retry shortly"}, 503
+    except BodyTooLarge:
+        payload, status = {'error': f"Request body too large (max {MAX_BODY_BYTES} bytes)"}, 413
+    await send_json(send, scope, payload, status, request.path in COMPRESSED_ROUTES)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan": return await lifespan(receive, send)
+    if scope["type"] != "http": return
+    bind_loop()
+
+    request = Request(scope, receive)
+    if request.method == "OPTIONS":
+        # CORS preflight (flask_cors does this for the Flask app)
+        await send({"type": "http.response.start", "status": 204, "headers": [
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS")
+        ] + cors_headers(scope)})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    request.basin, unknown_basin = core.get_basin(request.args.get('basin'))
+    if request.method == "GET" and request.path == "/stream-distributed" and unknown_basin is None:
+        return await stream_distributed(request, send)  # Long-lived: not timed
+
+    started = time.perf_counter()
+    response = {"status": 500}
+    async def send_recorded(message):
+        if message["type"] == "http.response.start": response["status"] = message["status"]
+        await send(message)
+    try:
+        await dispatch(request, send_recorded, unknown_basin)
+    finally:
+        metrics.observe_request(route_label(request), response["status"], time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=5000)
@@ -0,0 +1,362 @@
+#backtest.py
+# Historical replay: archive weather (daily or hourly) through the live pipeline in vectorized
+# batches -- rolling 5-day antecedent rain, SCS-CN discharge (hydrology.py) with the basin's
+# seasonal base flow for each row's own date, then the basin's risk model (or the discharge
+# thresholds) -- with alert timelines, hit/miss statistics against observed (or training)
+# labels and a days-per-second figure.
+#
+#   python backtest.py --fixture history.csv                             # daily or hourly CSV / .npz
+#   python backtest.py --fixture history.csv --basin rishikesh           # another basin from basins.json
+#   python backtest.py --offline --start 1990-01-01 --end 2024-01-01     # local archive cache
+#   python backtest.py --fixture history.csv --policy thresholds --warning 90000 --critical 150000
+import os
+import json
+import time
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from archive import ArchiveCache, ARCHIVE_CACHE_DIR
+from hydrology import scs_cn_discharge, calculate_impact, rule_risk, WARNING_CUSECS, CRITICAL_CUSECS
+from sweep import classify
+from basins import default_config, load_configs
+
+# CONFIGURATION
+START_DATE, END_DATE = "1990-01-01", "2024-01-01"
+BATCH_ROWS = 65536                          # Rows per vectorized batch (CSV chunks, model traversals)
+ANTECEDENT_DAYS = 5                         # app: past_rain_sum is the 120 hourly rains before now
+DEFAULT_SOIL_MOISTURE = 0.2                 # app.weather_inputs defaults
+LEAD_DAYS = 1.0                             # An alert up to this long before an event counts as a hit
+TRUTH_WARNING, TRUTH_CRITICAL = 100000, 180000  # Flood-stage labels of train_flood_ai.py (observed discharge)
+SEED = 42                                   # train_flood_ai label noise, for --truth labels
+
+# Pipeline input -> accepted column names (hourly forecast names first, then daily archive names)
+INPUT_COLUMNS = {
+    "rain": ("rain", "rain_sum", "rain_mm"),
+    "showers": ("showers", "showers_sum"),   # app: rain = rain + showers
+    "soil_moisture": ("soil_moisture_0_to_7cm", "soil_moisture_0_to_7cm_mean", "soil_moisture"),
+    "snow": ("snow_depth", "snowfall_sum", "snow_mm"),
+    "dam_release": ("dam_release", "dam_release_cusecs"),
+}
+TIME_COLUMNS = ("time", "date")
+LEVELS = {"warning": 1, "critical": 2}
+
+
+def seasonal_base_flow_array(config, times):
+    """Vectorized app.get_seasonal_base_flow: the basin's base flow for the month of every timestamp."""
+    months = np.asarray(times).astype("datetime64[M]").astype(np.int64) % 12
+    return np.asarray(config.base_flow, dtype=np.float64)[months]
+
+
+def column(columns, name, default=None):
+    for key in INPUT_COLUMNS[name]:
+        if key in columns: return np.asarray(columns[key], dtype=np.float64)
+    return None if default is None else np.full(len(next(iter(columns.values()))), default, dtype=np.float64)
+
+
+# --- SOURCES ---
+# A source yields batches of columns: {"time": datetime64[s] array, "<column>": array, ...}
+
+def file_batches(path, start=None, end=None, batch_rows=BATCH_ROWS):
+    """Streams a CSV (read in chunks) or an .npz of columns with a 'time' or 'date' column."""
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            data = {name: f[name] for name in f.files}
+        chunks = [data]
+    else:
+        import pandas as pd
+        chunks = ({name: df[name].to_numpy() for name in df.columns} for df in pd.read_csv(path, chunksize=batch_rows))
+    for data in chunks:
+        time_key = next((k for k in TIME_COLUMNS if k in data), None)
+        if time_key is None: raise KeyError(f"{path} has no {' / '.join(TIME_COLUMNS)} column")
+        times = np.asarray(data.pop(time_key), dtype="datetime64[s]")
+        for first in range(0, len(times), batch_rows):
+            rows = slice(first, first + batch_rows)
+            yield clip({"time": times[rows], **{k: np.asarray(v)[rows] for k, v in data.items()}}, start, end)
+
+
+def archive_batches(cache, lat, lon, start, end, batch_rows=BATCH_ROWS):
+    """Daily columns from the local archive cache (fetching only what it lacks, if it has a provider)."""
+    data = cache.get(lat, lon, start, end)
+    times = data.pop("date").astype("datetime64[s]")
+    for first in range(0, len(times), batch_rows):
+        rows = slice(first, first + batch_rows)
+        yield {"time": times[rows], **{k: v[rows] for k, v in data.items()}}
+
+
+def clip(batch, start=None, end=None):
+    keep = np.ones(len(batch["time"]), dtype=bool)
+    if start is not None: keep &= batch["time"] >= np.datetime64(start, "s")
+    if end is not None: keep &= batch["time"] < np.datetime64(end, "s") + np.timedelta64(1, "D")
+    return batch if keep.all() else {k: v[keep] for k, v in batch.items()}
+
+
+# --- REPLAY ---
+
+class Replay:
+    """
+    Pushes batches through the pipeline in time order. The antecedent window (the rain of the
+    last ANTECEDENT_DAYS) carries over from one batch to the next, so results do not depend
+    on the batch size.
+    """
+
+    def __init__(self, model=None, policy="model", warning=WARNING_CUSECS, critical=CRITICAL_CUSECS, config=None):
+        self.config = config or default_config()  # Seasonal base flow
+        self.model = model if policy == "model" else None
+        self.policy = "model" if self.model is not None else "thresholds"
+        self.warning, self.critical = warning, critical
+        self.window = None          # Antecedent window in rows, from the time step of the first batch
+        self.step = None
+        self.tail = np.empty(0)     # Rain of the last `window` rows seen
+        self.last_time = None
+        self.gaps = 0               # Steps longer than the series step (antecedent sums span them)
+        self.missing_rain = 0
+        self.parts = []
+
+    def feed(self, batch):
+        times = batch["time"]
+        if len(times) == 0: return
+        if self.step is None:
+            diffs = np.diff(times)
+            self.step = np.median(diffs) if len(diffs) else np.timedelta64(1, "D")
+            self.window = max(1, int(round(np.timedelta64(ANTECEDENT_DAYS, "D") / self.step)))
+        edges = np.diff(times if self.last_time is None else np.concatenate([[self.last_time], times]))
+        self.gaps += int(np.count_nonzero(edges > self.step))
+        if np.any(edges <= np.timedelta64(0, "s")): raise ValueError("Rows must be in strictly increasing time order")
+        self.last_time = times[-1]
+
+        rain = column(batch, "rain")
+        if rain is None: raise KeyError(f"No rain column (expected one of {INPUT_COLUMNS['rain']})")
+        showers = column(batch, "showers")
+        if showers is not None: rain = rain + np.nan_to_num(showers)
+        self.missing_rain += int(np.count_nonzero(np.isnan(rain)))
+        rain = np.nan_to_num(rain)
+        soil = column(batch, "soil_moisture", DEFAULT_SOIL_MOISTURE)
+        soil = np.where(np.isnan(soil), DEFAULT_SOIL_MOISTURE, soil)
+        snow = np.nan_to_num(column(batch, "snow", 0.0))
+        dam = np.nan_to_num(column(batch, "dam_release", 0.0))
+
+        # Rain of the `window` rows before each row (today / this hour excluded, like the app)
+        # (a windowed sum, not a cumsum difference: no drift over decades of rows)
+        extended = np.r_[np.zeros(self.window - len(self.tail)), self.tail, rain]
+        past = sliding_window_view(extended[:-1], self.window).sum(axis=1)
+        self.tail = extended[-self.window:]
+
+        discharge = scs_cn_discharge(rain, past, dam, seasonal_base_flow_array(self.config, times))
+        if self.model is not None:
+            features = np.column_stack([rain, soil, snow, past, discharge])
+            risk, confidence = classify(self.model, features)
+        else:
+            risk, confidence = rule_risk(discharge, self.warning, self.critical), np.zeros(len(rain))
+
+        truth = None
+        if "observed_risk" in batch:
+            truth = np.asarray(batch["observed_risk"], dtype=np.float64)
+        elif "observed_discharge_cusecs" in batch:
+            observed = np.asarray(batch["observed_discharge_cusecs"], dtype=np.float64)
+            truth = np.where(np.isnan(observed), np.nan, rule_risk(observed, TRUTH_WARNING, TRUTH_CRITICAL))
+        self.parts.append({"time": times, "rain": rain, "soil": soil, "snow": snow, "past": past,
+                           "discharge": discharge, "risk": risk.astype(np.int8), "confidence": confidence,
+                           "truth": truth})
+
+    def columns(self):
+        """Every replayed row as whole columns (truth is None unless every batch had it)."""
+        if not self.parts: raise ValueError("Nothing to replay")
+        merged = {k: np.concatenate([p[k] for p in self.parts]) for k in self.parts[0] if k != "truth"}
+        truths = [p["truth"] for p in self.parts]
+        merged["truth"] = np.concatenate(truths) if all(t is not None for t in truths) else None
+        return merged
+
+
+def training_labels(rows, seed=SEED):
+    """Daily risk labels exactly as train_flood_ai.py makes them (same rating curve and seeded noise)."""
+    import pandas as pd
+    from train_flood_ai import calculate_hydrology_advanced
+    df = pd.DataFrame({"date": pd.to_datetime(rows["time"]), "rain_mm": rows["rain"],
+                       "soil_moisture": rows["soil"], "snow_mm": rows["snow"]})
+    return calculate_hydrology_advanced(df, np.random.default_rng(seed))[1].astype(np.float64)
+
+
+# --- REPORTS ---
+
+def runs(mask):
+    """(start, stop) row ranges of the True runs of a boolean array."""
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def alert_timeline(rows):
+    """One entry per alert episode (consecutive rows at warning or above)."""
+    starts, stops = runs(rows["risk"] >= 1)
+    if len(starts) == 0: return []
+    peak = np.array([a + int(np.argmax(rows["discharge"][a:b])) for a, b in zip(starts.tolist(), stops.tolist())])
+    level = np.maximum.reduceat(rows["risk"], starts)
+    people, crops = calculate_impact(rows["discharge"][peak])
+    return [{"start": str(rows["time"][a]), "end": str(rows["time"][b - 1]), "steps": int(b - a),
+             "level": "critical" if lv == 2 else "warning", "peak_time": str(rows["time"][p]),
+             "peak_discharge_cusecs": float(rows["discharge"][p]), "peak_rain_mm": round(float(rows["rain"][p]), 2),
+             "impact_people": int(n), "impact_crops": int(c)}
+            for a, b, lv, p, n, c in zip(starts.tolist(), stops.tolist(), level.tolist(), peak.tolist(),
+                                         people.tolist(), crops.tolist())]
+
+
+def skill(alert, event, known, lead_rows):
+    """
+    Hit/miss statistics of one alert level. Per row: hits, misses, false alarms, correct
+    negatives, POD, FAR, CSI. Per event (consecutive rows at the level): detected when an
+    alert is raised at most lead_rows before it starts or while it lasts, with the median lead.
+    """
+    a, e = alert[known], event[known]
+    hits, misses = int(np.sum(a & e)), int(np.sum(~a & e))
+    false_alarms, negatives = int(np.sum(a & ~e)), int(np.sum(~a & ~e))
+    stats = {"hits": hits, "misses": misses, "false_alarms": false_alarms, "correct_negatives": negatives,
+             "pod": round(hits / (hits + misses), 4) if hits + misses else None,
+             "far": round(false_alarms / (hits + false_alarms), 4) if hits + false_alarms else None,
+             "csi": round(hits / (hits + misses + false_alarms), 4) if hits + misses + false_alarms else None}
+
+    alert_rows = np.flatnonzero(alert)
+    alerts_before = np.r_[0, np.cumsum(alert)]
+    event_starts, event_stops = runs(event & known)
+    window_start = np.maximum(event_starts - lead_rows, 0)
+    detected = alerts_before[event_stops] - alerts_before[window_start] > 0
+    first_alert = alert_rows[np.minimum(np.searchsorted(alert_rows, window_start), max(len(alert_rows) - 1, 0))] \
+        if len(alert_rows) else window_start
+    leads = (event_starts - first_alert)[detected]
+
+    events_before = np.r_[0, np.cumsum(event & known)]
+    alert_starts, alert_stops = runs(alert & known)
+    matched = events_before[np.minimum(alert_stops + lead_rows, len(event))] - events_before[alert_starts] > 0
+    stats["events"] = {"observed": len(event_starts), "detected": int(detected.sum()),
+                       "missed": int((~detected).sum()), "alerts": len(alert_starts),
+                       "false_alarm_alerts": int((~matched).sum()),
+                       "median_lead_rows": float(np.median(leads)) if len(leads) else None}
+    return stats
+
+
+def backtest(batches, model=None, policy="model", warning=WARNING_CUSECS, critical=CRITICAL_CUSECS,
+             lead_days=LEAD_DAYS, truth="auto", seed=SEED, config=None):
+    """
+    Replays every batch and returns the report: run summary, alert counts, the alert timeline
+    and hit/miss statistics per level (None when there is nothing to score against).
+    truth: "auto" (observed columns, else training labels for daily data), "observed", "labels" or "none".
+    config: the BasinConfig whose seasonal base flow applies (Haridwar's by default).
+    """
+    started = time.perf_counter()
+    replay = Replay(model, policy, warning, critical, config)
+    for batch in batches: replay.feed(batch)
+    rows = replay.columns()
+    replay_seconds = time.perf_counter() - started
+
+    daily = replay.step >= np.timedelta64(1, "D")
+    truth_source, labels = None, None
+    if truth in ("auto", "observed") and rows["truth"] is not None:
+        truth_source, labels = "observed", rows["truth"]
+    elif truth == "labels" or (truth == "auto" and daily):
+        if not daily: raise ValueError("Training labels are daily; hourly data needs observed_risk or observed_discharge_cusecs")
+        truth_source, labels = "training_labels", training_labels(rows, seed)
+    elif truth == "observed":
+        raise ValueError("No observed_risk or observed_discharge_cusecs column in the data")
+
+    span_days = float((rows["time"][-1] - rows["time"][0] + replay.step) / np.timedelta64(1, "D"))
+    report = {
+        "basin": replay.config.id, "rows": len(rows["time"]), "first": str(rows["time"][0]), "last": str(rows["time"][-1]),
+        "step_hours": float(replay.step / np.timedelta64(1, "h")), "days": round(span_days, 2),
+        "gaps": replay.gaps, "missing_rain": replay.missing_rain,
+        "policy": replay.policy, "thresholds": {"warning": warning, "critical": critical},
+        "antecedent_rows": replay.window, "seconds": round(replay_seconds, 4),
+        "days_per_second": round(span_days / replay_seconds, 1) if replay_seconds > 0 else None,
+        "rows_per_second": round(len(rows["time"]) / replay_seconds, 1) if replay_seconds > 0 else None,
+        "alerts": {name: int(np.sum(rows["risk"] >= level)) for name, level in LEVELS.items()},
+        "peak_discharge_cusecs": float(rows["discharge"].max()),
+        "timeline": alert_timeline(rows),
+        "truth": truth_source, "skill": None,
+    }
+    if labels is not None:
+        lead_rows = int(round(np.timedelta64(int(lead_days * 86400), "s") / replay.step))
+        known = ~np.isnan(labels)
+        report["skill"] = {name: skill(rows["risk"] >= level, np.nan_to_num(labels) >= level, known, lead_rows)
+                           for name, level in LEVELS.items()}
+        report["skill"]["lead_rows"] = lead_rows
+    return report
+
+
+def print_report(report):
+    print(f"[{report['basin']}] Replayed {report['rows']} rows ({report['days']:.0f} days, {report['step_hours']:g} h steps) "
+          f"{report['first']} -> {report['last']} in {report['seconds']:.3f}s: "
+          f"{report['days_per_second']:,.0f} days/s ({report['rows_per_second']:,.0f} rows/s)")
+    if report["gaps"] or report["missing_rain"]:
+        print(f"   {report['gaps']} gap(s) in the series, {report['missing_rain']} row(s) without rain (counted as 0 mm)")
+    t = report["thresholds"]
+    rule = "risk model" if report["policy"] == "model" else f"thresholds {t['warning']:,.0f} / {t['critical']:,.0f} cusecs"
+    print(f"Alerts ({rule}): {report['alerts']['warning']} rows at warning or above, {report['alerts']['critical']} critical, "
+          f"{len(report['timeline'])} episode(s); peak {report['peak_discharge_cusecs']:,.0f} cusecs")
+    for episode in sorted(report["timeline"], key=lambda e: -e["peak_discharge_cusecs"])[:10]:
+        print(f"   {episode['start']} -> {episode['end']}  {episode['level']:8s} peak {episode['peak_discharge_cusecs']:>10,.0f} "
+              f"cusecs ({episode['peak_rain_mm']} mm)")
+    if report["skill"] is None:
+        print("Nothing to score against (no observed_* column, or --truth none): hit/miss statistics skipped.")
+        return
+    print(f"Skill vs {report['truth'].replace('_', ' ')} (lead window {report['skill']['lead_rows']} rows):")
+    for name in LEVELS:
+        s = report["skill"][name]
+        ev = s["events"]
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        print(f"   {name:8s} hits {s['hits']:6d}  misses {s['misses']:6d}  false alarms {s['false_alarms']:6d}  "
+              f"POD {fmt(s['pod'])}  FAR {fmt(s['far'])}  CSI {fmt(s['csi'])}  | events {ev['detected']}/{ev['observed']} "
+              f"detected, {ev['false_alarm_alerts']}/{ev['alerts']} alert episodes false")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical weather through the live flood pipeline.")
+    parser.add_argument("--fixture", help="CSV or .npz with a time/date column and rain (+ soil, snow, observed_*) columns")
+    parser.add_argument("--offline", action="store_true", help="Use only the local archive cache; never call the API")
+    parser.add_argument("--cache-dir", default=ARCHIVE_CACHE_DIR)
+    parser.add_argument("--basin", help="Basin id from basins.json (default: the default basin)")
+    parser.add_argument("--lat", type=float, default=None, help="Archive location (default: the basin's gauge)")
+    parser.add_argument("--lon", type=float, default=None)
+    parser.add_argument("--start", default=None, help=f"First day (archive default {START_DATE})")
+    parser.add_argument("--end", default=None, help=f"Last day (archive default {END_DATE})")
+    parser.add_argument("--model", default=None, help="Risk model (default: the basin's model_path)")
+    parser.add_argument("--policy", choices=["model", "thresholds"], default="model",
+                        help="Alert on the model's risk class, or on discharge thresholds alone")
+    parser.add_argument("--warning", type=float, default=WARNING_CUSECS, help="Warning threshold (cusecs)")
+    parser.add_argument("--critical", type=float, default=CRITICAL_CUSECS, help="Critical threshold (cusecs)")
+    parser.add_argument("--truth", choices=["auto", "observed", "labels", "none"], default="auto",
+                        help="What alerts are scored against (labels: train_flood_ai.py's, daily data only)")
+    parser.add_argument("--lead-days", type=float, default=LEAD_DAYS)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--out", help="Write the full report (timeline included) as JSON")
+    args = parser.parse_args()
+
+    configs, default_id = load_configs()
+    config = next((c for c in configs if c.id == (args.basin or default_id)), None)
+    if config is None: parser.error(f"Unknown basin {args.basin!r} (known: {', '.join(c.id for c in configs)})")
+
+    model = None
+    if args.policy == "model":
+        import warnings
+        from inference import load_model
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        path = args.model or config.model_path
+        if os.path.exists(path):
+            model = load_model(path)
+        else:
+            print(f"No model at {path}: alerting on thresholds instead.")
+
+    if args.fixture:
+        batches = file_batches(args.fixture, args.start, args.end, args.batch_rows)
+    else:
+        from archive import OpenMeteoArchiveProvider
+        cache = ArchiveCache(None if args.offline else OpenMeteoArchiveProvider(), args.cache_dir)
+        lat = config.lat if args.lat is None else args.lat
+        lon = config.lon if args.lon is None else args.lon
+        batches = archive_batches(cache, lat, lon, args.start or START_DATE, args.end or END_DATE, args.batch_rows)
+
+    report = backtest(batches, model, args.policy, args.warning, args.critical, args.lead_days, args.truth, config=config)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f: json.dump(report, f, indent=1)
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
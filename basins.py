@@ -0,0 +1,293 @@
+#basins.py
+# Basin registry: one process serves many gauges. Every basin has its own config (gauge
+# coordinates, LiDAR tiles, catchment store, model, rating-curve base level, seasonal base
+# flow), its own weather cache and its own startup components (startup.py).
+# Requests pick a basin by id (?basin=<id>, the default basin otherwise). Pinned basins load
+# in the background at startup; the others load on first use, and loaded basins are unloaded
+# least recently used first once their resources exceed RIVERLY_BASIN_MEMORY_MB.
+# A basin's loaded resources are one immutable bundle (Resources) swapped as a whole, so a
+# request that reads basin.resources once is never left with half of an unloaded basin.
+#
+# basins.json (RIVERLY_BASINS); without it the single default basin is Haridwar, from the
+# usual tiles/, RIVERLY_CATCHMENT_PATH and RIVERLY_MODEL_PATH:
+#   {"default": "haridwar",
+#    "basins": [{"id": "haridwar", "name": "Haridwar", "lat": 29.956, "lon": 78.18,
+#                "tile_folder": "tiles", "catchment_path": "catchment_points.bin"},
+#               {"id": "rishikesh", "lat": 30.103, "lon": 78.298, "base_level": 337.0}]}
+# Paths a basin leaves out default to basins/<id>/ (tiles/, catchment_points.bin, ...).
+import os
+import re
+import json
+import time
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import metrics
+from startup import Startup
+from weather import create_weather_client, HARIDWAR_LAT, HARIDWAR_LON
+from inference import MODEL_PATH
+from inundation import BASE_LEVEL, INUNDATION_CACHE_DIR
+from raster_pool import TILE_MANIFEST
+
+# CONFIGURATION
+BASINS_FILE = os.environ.get("RIVERLY_BASINS", "basins.json")
+BASIN_MEMORY_MB = float(os.environ.get("RIVERLY_BASIN_MEMORY_MB", 2048))  # Loaded basin resources before LRU unloading
+BASINS_DIR = "basins"      # Home of a configured basin's files: basins/<id>/...
+CATCHMENT_PATH = os.environ.get("RIVERLY_CATCHMENT_PATH", "catchment_points.bin")
+BASIN_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+# Base flow (cusecs) by month, Jan..Dec: winter dry, pre-summer melt, monsoon, post-monsoon
+SEASONAL_BASE_FLOW = [8500, 8500, 8500, 15000, 15000, 45000, 45000, 45000, 45000, 20000, 20000, 8500]
+
+
+class BasinConfig:
+    """Static description of one basin. Raises ValueError for a malformed entry."""
+
+    def __init__(self, id, name=None, lat=HARIDWAR_LAT, lon=HARIDWAR_LON, tile_folder=None, catchment_path=None,
+                 catchment_csv=None, model_path=MODEL_PATH, tile_manifest=None, inundation_dir=None,
+                 utm_crs="EPSG:32644", base_level=BASE_LEVEL, base_flow=SEASONAL_BASE_FLOW, weather_file=None,
+                 pinned=False):
+        if not BASIN_ID.match(str(id)): raise ValueError(f"Basin id {id!r} must be lowercase letters, digits, - or _")
+        home = os.path.join(BASINS_DIR, id)
+        self.id, self.name = id, name or id
+        self.lat, self.lon = float(lat), float(lon)
+        self.tile_folder = tile_folder or os.path.join(home, "tiles")
+        self.catchment_path = catchment_path or os.path.join(home, "catchment_points.bin")
+        self.catchment_csv = catchment_csv or os.path.splitext(self.catchment_path)[0] + ".csv"
+        self.model_path = model_path
+        self.tile_manifest = tile_manifest or os.path.join(home, "tile_manifest.json")
+        self.inundation_dir = inundation_dir or os.path.join(INUNDATION_CACHE_DIR, id)
+        self.utm_crs = utm_crs
+        self.base_level = float(base_level)
+        self.base_flow = [q if isinstance(q, int) else float(q) for q in base_flow]
+        if len(self.base_flow) != 12: raise ValueError(f"Basin {id}: base_flow needs 12 monthly values")
+        self.weather_file = weather_file
+        self.pinned = bool(pinned)
+
+    @classmethod
+    def from_dict(cls, d):
+        try: return cls(**d)
+        except TypeError as e: raise ValueError(f"Basin {d.get('id')!r}: {e}")
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def array_nbytes(obj):
+    """Bytes of the NumPy arrays an object holds as attributes (point index, router)."""
+    return sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray))
+
+
+def default_config():
+    """The single Haridwar basin of a deployment without basins.json (the original file layout)."""
+    return BasinConfig("haridwar", "Haridwar", tile_folder="tiles", catchment_path=CATCHMENT_PATH,
+                       catchment_csv="catchment_points.csv", tile_manifest=TILE_MANIFEST,
+                       inundation_dir=INUNDATION_CACHE_DIR, pinned=True)
+
+
+def load_configs(path=BASINS_FILE):
+    """([BasinConfig, ...], default basin id) from basins.json, or the default basin alone."""
+    if not os.path.exists(path): return [default_config()], "haridwar"
+    with open(path) as f: data = json.load(f)
+    configs = [BasinConfig.from_dict(d) for d in data.get("basins", [])]
+    if not configs: raise ValueError(f"{path} lists no basins")
+    ids = [c.id for c in configs]
+    if len(set(ids)) != len(ids): raise ValueError(f"{path} lists a basin id twice")
+    default = data.get("default", ids[0])
+    if default not in ids: raise ValueError(f"{path}: default basin {default!r} is not listed")
+    return configs, default
+
+
+class Resources:
+    """
+    Immutable bundle of a basin's loaded resources (model, tiles, catchment, ...) and their
+    memory charges: resource name -> (object, bytes), an object shared by basins counting once.
+    Loads and unloads swap the whole bundle, never one attribute in place; a request holding
+    an unloaded bundle keeps using it and it is freed when the last such request drops it.
+    """
+
+    def __init__(self, generation=0, charges=None, **values):
+        object.__setattr__(self, "generation", generation)   # Bumped on every unload
+        object.__setattr__(self, "charges", dict(charges or {}))
+        for name, value in values.items(): object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Resources are immutable: swap a new bundle in with Basin.update()")
+
+    def replace(self, charges=None, **values):
+        current = {k: v for k, v in vars(self).items() if k not in ("generation", "charges")}
+        return Resources(self.generation, {**self.charges, **(charges or {})}, **{**current, **values})
+
+
+class Basin:
+    """
+    Runtime of one basin: config, weather cache and its current Resources bundle. The
+    registry puts an empty bundle in place before the first load and after every unload.
+    """
+
+    def __init__(self, config):
+        self.config, self.id = config, config.id
+        self.weather_client = create_weather_client(config.lat, config.lon, config.weather_file)
+        self.lock = threading.Lock()     # For resources built on first use (point index, router)
+        self.startup = None
+        self.started = False             # Loaders running or done (False: nothing loaded)
+        self.last_used = time.monotonic()
+        self.loads = 0
+        self.resources = Resources()
+        self._swap = threading.Lock()    # Serializes bundle swaps
+
+    def update(self, generation=None, charges=None, **values):
+        """
+        Swaps in a bundle with these resources (and memory charges) changed. With a generation,
+        only while that bundle is still current: a first-use build that raced an unload is
+        dropped instead of landing on the emptied basin. Returns True when applied.
+        """
+        with self._swap:
+            if generation is not None and generation != self.resources.generation: return False
+            self.resources = self.resources.replace(charges, **values)
+            return True
+
+    def charges(self):
+        return dict(self.resources.charges)
+
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self.resources.charges.values())
+
+
+class BasinRegistry:
+    """Basins by id with lazy loading (per-basin startup components) and LRU unloading under a memory budget."""
+
+    def __init__(self, configs, default_id, memory_mb=BASIN_MEMORY_MB):
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self.basins = OrderedDict((c.id, Basin(c)) for c in configs)
+        self.default = self.basins[default_id]
+        self.default.config.pinned = True
+        self.evictions = 0
+        self._components = []   # (name, load(basin) or None)
+        self._reset = None
+        self._unload = None
+        self._shared = weakref.WeakValueDictionary()
+        self._building = {}     # key -> lock held while that shared object is built
+        self._lock = threading.RLock()
+
+    def on_reset(self, reset):
+        """reset(basin) returns the empty resources of a basin (a dict): used now, and again after every unload."""
+        self._reset = reset
+        for basin in self.basins.values(): self._renew(basin)
+
+    def on_unload(self, unload):
+        """unload(basin, resources) runs after a basin is unloaded, with the bundle it held (cache purges)."""
+        self._unload = unload
+
+    def add(self, name, load=None):
+        """Registers a component for every basin; load(basin) returns details like a startup loader."""
+        self._components.append((name, load))
+        for basin in self.basins.values(): self._add_to(basin, name, load)
+
+    def _add_to(self, basin, name, load):
+        basin.startup.add(name, None if load is None else lambda: self._load(basin, load))
+
+    def _renew(self, basin):
+        """Puts a fresh, empty bundle and startup on the basin; returns the bundle it held."""
+        empty = self._reset(basin) if self._reset is not None else {}
+        with basin._swap:
+            old = basin.resources
+            basin.resources = Resources(old.generation + 1, **empty)
+        basin.startup = Startup()
+        basin.started = False
+        for name, load in self._components: self._add_to(basin, name, load)
+        return old
+
+    def _load(self, basin, load):
+        details = load(basin)
+        self.enforce(keep=basin)
+        return details
+
+    def ids(self):
+        return list(self.basins)
+
+    def get(self, basin_id=None):
+        """Basin by id (None: the default). Raises KeyError for an unknown id."""
+        basin = self.default if not basin_id else self.basins.get(basin_id)
+        if basin is None: raise KeyError(f"Unknown basin {basin_id!r}")
+        basin.last_used = time.monotonic()
+        return basin
+
+    def activate(self, basin):
+        """Starts loading a basin that has nothing loaded (no-op otherwise)."""
+        if basin.started: return   # Every gated request passes here: no registry lock once loading
+        with self._lock:
+            if basin.started: return
+            basin.started = True
+            basin.loads += 1
+        metrics.count("basin_load")
+        print(f"Loading basin {basin.id}...")
+        basin.startup.start()
+
+    def ready(self, basin, *names):
+        """True once the named components of the basin are loaded, starting the load if needed."""
+        basin.last_used = time.monotonic()
+        self.activate(basin)
+        return basin.startup.ready(*names)
+
+    def start(self):
+        """Loads the pinned basins in the background (call once, before any fork)."""
+        for basin in self.basins.values():
+            if basin.config.pinned: self.activate(basin)
+
+    def shared(self, key, build):
+        """
+        One object per key for as long as any basin holds it (e.g. a model file several basins use).
+        Built under a lock of its own key, never the registry lock: a slow load does not stall
+        requests (ready, enforce) for the other basins.
+        """
+        with self._lock:
+            obj = self._shared.get(key)
+            if obj is not None: return obj
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock: obj = self._shared.get(key)   # Built while this thread waited
+            if obj is None:
+                obj = build()
+                with self._lock: self._shared[key] = obj
+            return obj
+
+    def resident_bytes(self):
+        """Bytes held by loaded basins, each shared object counted once."""
+        with self._lock:
+            unique = {id(obj): nbytes for b in self.basins.values() for obj, nbytes in b.charges().values()}
+        return sum(unique.values())
+
+    def enforce(self, keep=None):
+        """Unloads least recently used basins until the loaded ones fit the budget. Returns ids unloaded."""
+        unloaded, released = [], []
+        with self._lock:
+            while self.resident_bytes() > self.memory_budget:
+                # Only fully loaded basins: a loader still running would repopulate an unloaded one
+                candidates = [b for b in self.basins.values() if b.started and not b.config.pinned
+                              and b is not keep and b.startup.ready()]
+                if not candidates: break
+                victim = min(candidates, key=lambda b: b.last_used)
+                freed = victim.nbytes()
+                released.append((victim, self._renew(victim)))
+                self.evictions += 1
+                unloaded.append(victim.id)
+                metrics.count("basin_unload")
+                print(f"Unloaded basin {victim.id} ({freed / 1e6:.0f} MB, memory budget {self.memory_budget / 1e6:.0f} MB)")
+        if self._unload is not None:
+            for victim, resources in released: self._unload(victim, resources)
+        return unloaded
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            basins = {b.id: {"name": b.config.name, "lat": b.config.lat, "lon": b.config.lon,
+                             "pinned": b.config.pinned, "default": b is self.default,
+                             "state": b.startup.status()["status"] if b.started else "unloaded",
+                             "bytes": b.nbytes(), "loads": b.loads,
+                             "idle_seconds": round(now - b.last_used, 1)}
+                      for b in self.basins.values()}
+        return {"basins": basins, "loaded": sum(b.started for b in self.basins.values()),
+                "resident_bytes": self.resident_bytes(), "memory_budget_bytes": self.memory_budget,
+                "evictions": self.evictions}
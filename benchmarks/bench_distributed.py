@@ -0,0 +1,117 @@
+#bench_distributed.py
+# Compares the original pandas calculate_distributed_discharge (+ random.sample)
+# with the NumPy runoff kernel on synthetic catchments.
+#
+#   python benchmarks/bench_distributed.py --sizes 100000 1000000 10000000
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catchment_store import compute_physics
+from runoff_kernel import DistributedRunoffKernel, classify_runoff
+
+MAX_POINTS = 3000
+
+
+def make_catchment(n, seed=42):
+    """Synthetic catchment with the generator's elevation -> weight / CN rules."""
+    rng = np.random.default_rng(seed)
+    elevation = rng.uniform(285, 400, n).astype(np.float32)
+    rain_weight = np.where(elevation > 350, 1.2, 1.0).astype(np.float32)
+    cn = np.where(elevation < 294, 90, 70).astype(np.uint8)
+    S, Ia = compute_physics(cn)
+    return {
+        "lat": rng.uniform(29.9, 30.0, n).astype(np.float32),
+        "lon": rng.uniform(78.1, 78.2, n).astype(np.float32),
+        "elevation": elevation, "rain_weight": rain_weight, "cn": cn,
+        "S": S.astype(np.float32), "Ia": Ia.astype(np.float32),
+    }
+
+
+def legacy_distributed(catchment_df, rain_input_mm):
+    """The original app.py implementation, kept verbatim for comparison."""
+    if catchment_df.empty: return []
+    local_rain = rain_input_mm * catchment_df['rain_weight']
+    term1 = (local_rain - catchment_df['Ia']) ** 2
+    term2 = (local_rain - catchment_df['Ia'] + catchment_df['S'])
+    raw_runoff = np.where(local_rain > catchment_df['Ia'], term1 / term2, 0)
+
+    active_indices = np.where(raw_runoff > 5)[0]
+    if len(active_indices) == 0: return []
+
+    active_df = catchment_df.iloc[active_indices].copy()
+    active_df['runoff_mm'] = raw_runoff[active_indices]
+    active_df['status'] = np.where(active_df['runoff_mm'] > 35, 2, np.where(active_df['runoff_mm'] > 15, 1, 0))
+
+    return active_df[['lat', 'lon', 'runoff_mm', 'status']].to_dict(orient='records')
+
+
+def legacy_pipeline(catchment_df, rain):
+    points = legacy_distributed(catchment_df, rain)
+    if len(points) > MAX_POINTS: points = random.sample(points, MAX_POINTS)
+    return points
+
+
+def kernel_pipeline(kernel, columns, rain):
+    point_ids, runoff_mm, status = kernel.run(rain, max_points=MAX_POINTS)
+    lats = np.round(columns["lat"][point_ids].astype(np.float64), 5)
+    lons = np.round(columns["lon"][point_ids].astype(np.float64), 5)
+    return [{'lat': a, 'lon': b, 'runoff_mm': r, 'status': s}
+            for a, b, r, s in zip(lats.tolist(), lons.tolist(), runoff_mm.tolist(), status.tolist())]
+
+
+def time_call(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return np.median(samples) * 1000, min(samples) * 1000
+
+
+def check_agreement(catchment_df, kernel, rain):
+    """Same active set, statuses and runoff (within float32 rounding) as the legacy path."""
+    legacy = legacy_distributed(catchment_df, rain)
+    point_ids, runoff_mm, status = kernel.run(rain)
+    assert len(legacy) == len(point_ids), (len(legacy), len(point_ids))
+    if legacy:
+        legacy_runoff = np.array([p['runoff_mm'] for p in legacy])
+        assert np.allclose(legacy_runoff, runoff_mm, rtol=1e-5, atol=1e-4)
+        assert (classify_runoff(legacy_runoff) == status).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy pandas vs NumPy kernel for the distributed runoff map.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--rain", type=float, default=120.0, help="Rain (mm); 120 mm activates most points")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-legacy-above", type=int, default=10_000_000,
+                        help="Skip the pandas path above this size (it needs several GB at 10M)")
+    args = parser.parse_args()
+
+    print(f"{'points':>10} | {'legacy ms':>10} | {'kernel ms':>10} | {'speedup':>8}")
+    print("-" * 48)
+    for n in args.sizes:
+        columns = make_catchment(n)
+        kernel = DistributedRunoffKernel(columns["rain_weight"], columns["Ia"], columns["S"])
+        kernel_ms, _ = time_call(lambda: kernel_pipeline(kernel, columns, args.rain), args.repeats)
+
+        legacy_ms = None
+        if n <= args.skip_legacy_above:
+            catchment_df = pd.DataFrame(columns)
+            check_agreement(catchment_df, kernel, args.rain)
+            legacy_ms, _ = time_call(lambda: legacy_pipeline(catchment_df, args.rain), max(1, args.repeats // 2))
+            del catchment_df
+
+        legacy_txt = f"{legacy_ms:10.1f}" if legacy_ms is not None else f"{'skipped':>10}"
+        speedup = f"{legacy_ms / kernel_ms:7.1f}x" if legacy_ms is not None else f"{'-':>8}"
+        print(f"{n:>10,} | {legacy_txt} | {kernel_ms:10.2f} | {speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#bench_suite.py
+# Benchmark suite for the hydrology engine, model inference, the offline scripts and
+# the Flask routes, on synthetic LiDAR tiles + catchments (benchmarks/synthetic.py).
+# Each scale runs in its own process, so peak RSS and import-time state are per scale.
+#
+#   python benchmarks/bench_suite.py --scales small medium
+#   python benchmarks/bench_suite.py --scales small --save-baseline main
+#   python benchmarks/bench_suite.py --scales small --compare main   # exit code 1 on regressions
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+import synthetic
+
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "riverly-bench")
+TOLERANCE = 0.20  # p50 slowdown (fraction) that counts as a regression
+
+
+# --- MEASUREMENT ---
+
+def measure(fn, iterations, warmup=1):
+    """Latency percentiles + throughput over `iterations` calls, then one traced call for peak allocation."""
+    for _ in range(warmup): fn()
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = samples * 1000
+    return {
+        "calls": iterations,
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "mean_ms": round(float(ms.mean()), 4),
+        "throughput_per_s": round(iterations / float(samples.sum()), 2),
+        "peak_alloc_mb": round(peak / 2**20, 3),
+    }
+
+
+def cycle(items):
+    """fn() -> next item, forever (so repeated calls don't hit the same cache entry)."""
+    state = {"i": 0}
+    def next_item():
+        item = items[state["i"] % len(items)]
+        state["i"] += 1
+        return item
+    return next_item
+
+
+# --- BENCHMARKS (run inside the worker, after app is imported) ---
+
+def run_benchmarks(workspace, iterations, only=None):
+    import warnings
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    import app
+    import inference
+    import backtest
+    import scan_risk
+    import generate_catchment_csv
+    from weather import WeatherClient, LocalWeatherProvider, default_snapshot
+
+    # Default basin's resources, stubbed weather: the API benchmarks never touch the network
+    basin = app.basins.default
+    res = basin.resources  # The pinned default basin is never unloaded
+    basin.weather_client = WeatherClient(LocalWeatherProvider(snapshot=default_snapshot(rain_mm=60.0, hours=168)))
+    client = app.app.test_client()
+
+    n_tiles, size, _ = synthetic.SCALES[os.path.basename(workspace)]
+    bounds = synthetic.coverage_lonlat(n_tiles, size)
+    lats, lons = synthetic.random_points(10_000, bounds, seed=7)
+    point = cycle(list(zip(lats.tolist(), lons.tolist())))
+    rains = cycle([float(r) for r in np.random.default_rng(3).uniform(5, 300, 997)])
+    batch_lats, batch_lons = lats[:1000], lons[:1000]
+    features = inference.sample_features(1000, seed=1)
+    feature_row = cycle([features[i:i + 1] for i in range(len(features))])
+    tif = sorted(res.tif_files)[0]
+    part_path = os.path.join(workspace, "bench_part.bin")
+    slow = max(3, iterations // 20)  # Whole-tile scripts are much slower per call
+    # 34 years of daily archive weather for the replay engine
+    days = np.arange(np.datetime64("1990-01-01"), np.datetime64("2024-01-01")).astype("datetime64[s]")
+    history_rng = np.random.default_rng(5)
+    history = {"time": days, "rain_sum": history_rng.gamma(0.4, 20.0, len(days)),
+               "soil_moisture_0_to_7cm_mean": history_rng.uniform(0.1, 0.5, len(days)),
+               "snowfall_sum": np.zeros(len(days))}
+
+    def post_check():
+        lat, lon = point()
+        return client.post("/check-location", json={"lat": lat, "lon": lon, "discharge": 150000})
+
+    benches = {
+        # Hydrology engine
+        "engine.distributed_discharge": (lambda: app.calculate_distributed_discharge(basin, rains(), max_points=app.MAX_MAP_POINTS), iterations),
+        "engine.distributed_discharge_all": (lambda: app.calculate_distributed_discharge(basin, rains()), max(3, iterations // 10)),
+        "engine.scs_cn_discharge": (lambda: app.calculate_scs_cn_discharge(basin, rains(), 85.0, 2000), iterations * 10),
+        "engine.elevation_single": (lambda: app.get_elevation_from_mosaic(basin, *point()), iterations * 10),
+        "engine.elevation_batch_1000": (lambda: app.get_elevations_from_mosaic(basin, batch_lats, batch_lons), iterations),
+        # Model inference
+        "model.predict_one": (lambda: res.model.predict_one(feature_row()), iterations * 10),
+        "model.predict_batch_1000": (lambda: res.model.predict_with_confidence(features), iterations),
+        # Offline scripts (one tile)
+        "scripts.generate_sample_tile": (lambda: generate_catchment_csv.sample_tile(tif, part_path, 10), slow),
+        "scripts.scan_tile": (lambda: scan_risk.scan_tile(tif, step=10), slow),
+        "scripts.backtest_34y_daily": (lambda: backtest.backtest([history], res.model, truth="none", config=basin.config), slow),
+        # API routes (Flask test client)
+        "api.predict_distributed_live": (lambda: client.get("/predict-distributed"), iterations),
+        "api.predict_distributed_sim": (lambda: client.get(f"/predict-distributed?sim_rain={rains():.1f}"), iterations),
+        "api.predict_distributed_compact": (lambda: client.get(f"/predict-distributed?sim_rain={rains():.1f}&format=compact"), iterations),
+        "api.viewport_points": (lambda: client.get(f"/viewport-points?bbox={bounds[0]},{bounds[1]},{bounds[2]},{bounds[3]}&zoom=11&sim_rain={rains():.1f}"), iterations),
+        "api.scenario_sweep_10k": (lambda: client.get("/scenario-sweep?rain=0:247.5:2.5&soil_moisture=0.05:0.5:0.05&past_rain_sum=0:180:20"), slow),
+        "api.check_location": (post_check, iterations * 5),
+        "api.get_forecast": (lambda: client.get("/get-forecast"), iterations * 5),
+    }
+    if res.model is None:
+        print("   (no model loaded: model.* benchmarks skipped)")
+        benches = {k: v for k, v in benches.items() if not k.startswith("model.")}
+
+    results = {}
+    for name, (fn, calls) in benches.items():
+        if only and not any(name.startswith(prefix) for prefix in only): continue
+        results[name] = measure(fn, calls)
+        r = results[name]
+        print(f"   {name:36s} p50 {r['p50_ms']:9.3f} ms  p99 {r['p99_ms']:9.3f} ms  {r['throughput_per_s']:10.1f}/s  peak {r['peak_alloc_mb']:8.2f} MB")
+    if os.path.exists(part_path): os.remove(part_path)
+    return results
+
+
+def worker(args):
+    """One scale: build/reuse the synthetic workspace, import the app inside it, run everything."""
+    workspace = os.path.abspath(synthetic.make_workspace(args.workdir, args.worker))
+    os.environ["RIVERLY_WEATHER_PROVIDER"] = "local"
+    os.environ["RIVERLY_CATCHMENT_PATH"] = os.path.join(workspace, "catchment_points.bin")
+    os.environ.setdefault("RIVERLY_MODEL_PATH", os.path.join(REPO_DIR, "flood_model.pkl"))
+    os.environ.setdefault("RIVERLY_INUNDATION_DIR", os.path.join(workspace, "inundation_cache"))
+    os.chdir(workspace)  # app.py loads tiles/ relative to the working directory
+
+    started = time.perf_counter()
+    import app  # Resources load on background threads from here
+    import_s = time.perf_counter() - started
+    app.startup.wait()  # Timed: tile + catchment + model loading
+    ready_s = time.perf_counter() - started
+    print(f"   app import {import_s:.2f}s, ready {ready_s:.2f}s")
+
+    results = run_benchmarks(workspace, args.iterations, args.only)
+    results["startup.app_import"] = {"calls": 1, "p50_ms": round(import_s * 1000, 2), "p95_ms": round(import_s * 1000, 2),
+                                     "p99_ms": round(import_s * 1000, 2), "mean_ms": round(import_s * 1000, 2),
+                                     "throughput_per_s": None, "peak_alloc_mb": None}
+    results["startup.app_ready"] = {"calls": 1, "p50_ms": round(ready_s * 1000, 2), "p95_ms": round(ready_s * 1000, 2),
+                                    "p99_ms": round(ready_s * 1000, 2), "mean_ms": round(ready_s * 1000, 2),
+                                    "throughput_per_s": None, "peak_alloc_mb": None}
+    report = {"results": results, "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    with open(args.result, "w") as f: json.dump(report, f)
+
+
+# --- BASELINES ---
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Prints p50 deltas per benchmark; returns the names that slowed down by more than tolerance."""
+    regressions = []
+    print(f"\nComparison with baseline ({baseline['meta'].get('commit')}, {baseline['meta'].get('created')}):")
+    for scale, report in current["scales"].items():
+        base = baseline["scales"].get(scale)
+        if not base:
+            print(f"   {scale}: not in baseline")
+            continue
+        for name, r in report["results"].items():
+            b = base["results"].get(name)
+            if not b or not b.get("p50_ms"): continue
+            delta = r["p50_ms"] / b["p50_ms"] - 1
+            flag = "REGRESSION" if delta > tolerance else ("faster" if delta < -tolerance else "")
+            if delta > tolerance: regressions.append(f"{scale}/{name}")
+            print(f"   {scale:6s} {name:36s} {b['p50_ms']:9.3f} -> {r['p50_ms']:9.3f} ms  {delta * 100:+7.1f}%  {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hydrology engine, inference, scripts and API on synthetic data.")
+    parser.add_argument("--scales", nargs="+", default=["small"], choices=list(synthetic.SCALES))
+    parser.add_argument("--iterations", type=int, default=50, help="Base number of timed calls per benchmark")
+    parser.add_argument("--only", nargs="+", help="Benchmark name prefixes to run (e.g. engine. api.check)")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="Where synthetic workspaces are built (reused across runs)")
+    parser.add_argument("--out", help="Write the full report (JSON) here")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"Save the report as {os.path.relpath(BASELINE_DIR, REPO_DIR)}/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare p50 latencies with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="p50 slowdown counted as a regression (0.2 = 20%%)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    import numpy
+    report = {"meta": {"commit": git_commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(), "numpy": numpy.__version__,
+                       "machine": platform.machine(), "cpus": os.cpu_count(), "iterations": args.iterations},
+              "scales": {}}
+    for scale in args.scales:
+        print(f"\n[{scale}] {synthetic.SCALES[scale]}")
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp: result_path = tmp.name
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", scale, "--result", result_path,
+               "--workdir", os.path.abspath(args.workdir), "--iterations", str(args.iterations)]
+        if args.only: cmd += ["--only", *args.only]
+        try:
+            subprocess.run(cmd, check=True)
+            with open(result_path) as f: report["scales"][scale] = json.load(f)
+        finally:
+            os.remove(result_path)
+        print(f"   peak RSS {report['scales'][scale]['max_rss_mb']} MB")
+
+    if args.out:
+        with open(args.out, "w") as f: json.dump(report, f, indent=1)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f: json.dump(report, f, indent=1)
+        print(f"\nBaseline saved to {path}")
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f: baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance * 100:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#synthetic.py
+# Synthetic LiDAR tiles and catchment stores for the benchmarks.
+# Tiles are float32 GeoTIFFs (EPSG:32644, 1 m pixels, 256x256 blocks) laid out in a
+# square grid near Haridwar: a river channel (~285 m) rising to banks and hills (~400 m),
+# so every threshold in the code (294 / 296 / 300 / 350 m) is exercised.
+import os
+import sys
+import math
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from pyproj import Transformer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catchment_store import CatchmentWriter, REQUIRED
+
+ORIGIN_LAT, ORIGIN_LON = 29.965, 78.15
+
+# name -> (tiles, tile size in pixels, catchment points)
+SCALES = {
+    "small": (2, 1024, 100_000),
+    "medium": (4, 2048, 1_000_000),
+    "large": (9, 4096, 10_000_000),
+}
+
+
+def tile_origins(n_tiles, size):
+    """Top-left UTM corner of each tile in a square grid."""
+    to_utm = Transformer.from_crs("EPSG:4326", "EPSG:32644", always_xy=True)
+    x0, y0 = to_utm.transform(ORIGIN_LON, ORIGIN_LAT)
+    side = math.ceil(math.sqrt(n_tiles))
+    return [(x0 + (i % side) * size, y0 - (i // side) * size) for i in range(n_tiles)]
+
+
+def elevation_rows(x_left, y_top, row_off, rows, size, rng):
+    """Elevation for rows [row_off, row_off + rows) of a tile: a meandering channel plus hills."""
+    xs = x_left + np.arange(size) + 0.5
+    ys = y_top - (row_off + np.arange(rows)) - 0.5
+    X, Y = np.meshgrid(xs, ys)
+    channel_x = 800 * np.sin(Y / 1500.0)                # River meanders north-south
+    distance = np.abs((X % 6000) - 3000 - channel_x)     # One valley every 6 km
+    elevation = 285 + np.minimum(distance / 25.0, 115) + 3 * np.sin(X / 300.0) * np.cos(Y / 350.0)
+    return (elevation + rng.normal(0, 0.3, elevation.shape)).astype(np.float32)
+
+
+def make_tiles(folder, n_tiles, size, seed=0):
+    """Writes n_tiles GeoTIFFs (size x size) into folder, streaming 256 rows at a time."""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i, (x_left, y_top) in enumerate(tile_origins(n_tiles, size)):
+        path = os.path.join(folder, f"synthetic_{i:03d}.tif")
+        with rasterio.open(path, "w", driver="GTiff", height=size, width=size, count=1, dtype="float32",
+                           crs="EPSG:32644", transform=from_origin(x_left, y_top, 1.0, 1.0),
+                           tiled=True, blockxsize=256, blockysize=256, compress="deflate") as ds:
+            for row_off in range(0, size, 256):
+                rows = min(256, size - row_off)
+                ds.write(elevation_rows(x_left, y_top, row_off, rows, size, rng), 1, window=Window(0, row_off, size, rows))
+        paths.append(path)
+    return paths
+
+
+def coverage_lonlat(n_tiles, size):
+    """(west, south, east, north) of the whole synthetic mosaic."""
+    to_lonlat = Transformer.from_crs("EPSG:32644", "EPSG:4326", always_xy=True)
+    origins = tile_origins(n_tiles, size)
+    xs = [x for x, _ in origins] + [x + size for x, _ in origins]
+    ys = [y for _, y in origins] + [y - size for _, y in origins]
+    lons, lats = to_lonlat.transform(xs, ys)
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def random_points(n, bounds, seed=0, margin=0.05):
+    """n random (lat, lon) points inside bounds (shrunk by margin so they land on tiles)."""
+    west, south, east, north = bounds
+    dx, dy = (east - west) * margin, (north - south) * margin
+    rng = np.random.default_rng(seed)
+    return rng.uniform(south + dy, north - dy, n), rng.uniform(west + dx, east - dx, n)
+
+
+def make_catchment(path, n_points, bounds, seed=42, chunk=1_000_000):
+    """Catchment store with the generator's elevation -> weight / CN rules, written in chunks."""
+    rng = np.random.default_rng(seed)
+    writer = CatchmentWriter(path, list(REQUIRED))
+    for start in range(0, n_points, chunk):
+        n = min(chunk, n_points - start)
+        lats, lons = random_points(n, bounds, seed=seed + start)
+        elevation = rng.uniform(285, 300, n)
+        writer.append({
+            "lat": lats, "lon": lons, "elevation": elevation,
+            "rain_weight": np.where(elevation > 350, 1.2, 1.0),
+            "cn": np.where(elevation < 294, 90, 70),
+        })
+    writer.close()
+    return path
+
+
+def make_workspace(root, scale):
+    """tiles/ + catchment_points.bin for a scale under root/scale (reused if already built)."""
+    n_tiles, size, n_points = SCALES[scale]
+    workspace = os.path.join(root, scale)
+    tiles = os.path.join(workspace, "tiles")
+    catchment = os.path.join(workspace, "catchment_points.bin")
+    done = os.path.join(workspace, ".complete")
+    if not os.path.exists(done):
+        print(f"Building synthetic '{scale}' workspace: {n_tiles} tiles of {size}x{size}, {n_points:,} catchment points...")
+        make_tiles(tiles, n_tiles, size)
+        make_catchment(catchment, n_points, coverage_lonlat(n_tiles, size))
+        open(done, "w").close()
+    return workspace
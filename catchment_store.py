@@ -0,0 +1,222 @@
+#catchment_store.py
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+
+# Binary Catchment Format (little-endian)
+#   [8 bytes]  magic  b"RVCATCH1"
+#   [4 bytes]  header length (uint32)
+#   [N bytes]  JSON header {"version", "count", "columns": [{"name", "dtype", "offset"}]}
+#   [........] one contiguous array per column, each aligned to 64 bytes
+# Row i of every column is catchment point id i.
+
+MAGIC = b"RVCATCH1"
+VERSION = 1
+ALIGN = 64
+
+# Column name -> on-disk dtype. Physics constants (S, Ia) are stored, not recomputed.
+SCHEMA = {
+    "lat": "<f4",
+    "lon": "<f4",
+    "elevation": "<f4",
+    "rain_weight": "<f4",
+    "cn": "u1",
+    "S": "<f4",
+    "Ia": "<f4",
+    "upstream_area": "<f4",  # Optional (generate_catchment_csv.py --flow): m2 draining through the point
+    "flow_length": "<f4",    # Optional: D8 flow path length to the gauge (m), used by routing.py
+}
+REQUIRED = ("lat", "lon", "elevation", "rain_weight", "cn")
+
+
+def compute_physics(cn):
+    """SCS-CN potential retention S and initial abstraction Ia (mm) per point."""
+    cn = np.asarray(cn, dtype=np.float64)
+    S = (25400 / cn) - 254
+    return S, 0.2 * S
+
+
+class CatchmentStore:
+    """Column arrays for every catchment point (memory-mapped when opened from disk)."""
+
+    def __init__(self, columns=None, path=None):
+        self.columns = dict(columns or {})
+        self.path = path
+
+    @classmethod
+    def open(cls, path):
+        """Memory-maps a .bin catchment file. Nothing is parsed or copied."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC: raise ValueError(f"{path} is not a catchment store")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+        if header.get("version") != VERSION: raise ValueError(f"Unsupported catchment store version {header.get('version')}")
+
+        count = header["count"]
+        columns = {}
+        if count:
+            raw = np.memmap(path, dtype=np.uint8, mode="r")
+            for col in header["columns"]:
+                dtype = np.dtype(col["dtype"])
+                start = col["offset"]
+                columns[col["name"]] = raw[start:start + count * dtype.itemsize].view(dtype)
+        else:
+            columns = {col["name"]: np.empty(0, dtype=col["dtype"]) for col in header["columns"]}
+        return cls(columns, path)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Builds a store from a catchment DataFrame / CSV (legacy path)."""
+        columns = {name: df[name].to_numpy() for name in df.columns if name != "id"}
+        return cls(prepare_columns(columns))
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def __len__(self):
+        if not self.columns: return 0
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.columns.values())
+
+    def to_dataframe(self):
+        import pandas as pd
+        df = pd.DataFrame({name: np.asarray(arr) for name, arr in self.columns.items()})
+        df.insert(0, "id", np.arange(len(df)))
+        return df
+
+    def write(self, path):
+        write_catchment(path, self.columns)
+
+    def to_csv(self, path):
+        """Same layout as the old catchment_points.csv (id, lat, lon, elevation, rain_weight, cn)."""
+        df = self.to_dataframe().drop(columns=["S", "Ia"])
+        df["lat"] = df["lat"].astype(np.float64).round(5)
+        df["lon"] = df["lon"].astype(np.float64).round(5)
+        df["elevation"] = df["elevation"].astype(np.float64).round(2)
+        df.to_csv(path, index=False)
+
+
+def prepare_columns(columns):
+    """Casts columns to the on-disk schema and fills in S / Ia."""
+    missing = [name for name in REQUIRED if name not in columns]
+    if missing: raise ValueError(f"Catchment data missing columns: {missing}")
+    out = {}
+    for name, values in columns.items():
+        out[name] = np.ascontiguousarray(values, dtype=SCHEMA.get(name, "<f4"))
+    if "S" not in out or "Ia" not in out:
+        S, Ia = compute_physics(out["cn"])
+        out["S"] = S.astype(SCHEMA["S"])
+        out["Ia"] = Ia.astype(SCHEMA["Ia"])
+    return out
+
+
+def _layout(names, dtypes, count):
+    # Header size depends on the offsets and vice versa, so iterate until it settles
+    header_len = 0
+    while True:
+        offset = _align(len(MAGIC) + 4 + header_len)
+        cols = []
+        for name in names:
+            cols.append({"name": name, "dtype": dtypes[name], "offset": offset})
+            offset = _align(offset + count * np.dtype(dtypes[name]).itemsize)
+        header = json.dumps({"version": VERSION, "count": count, "columns": cols}).encode()
+        if len(header) == header_len: return header, cols
+        header_len = len(header)
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_catchment(path, columns):
+    """Writes columns to a new .bin catchment file (atomic rename)."""
+    writer = CatchmentWriter(path, list(columns))
+    writer.append(columns)
+    writer.close()
+
+
+class CatchmentWriter:
+    """
+    Incremental writer: rows are appended in chunks and spilled to one temp
+    file per column, then stitched into the final columnar file on close().
+    Memory use is bounded by the chunk size, not the total point count.
+    """
+
+    def __init__(self, path, names=None):
+        self.path = path
+        self.names = list(names) if names else None
+        self.count = 0
+        self._dir = tempfile.mkdtemp(prefix=".catchment_", dir=os.path.dirname(os.path.abspath(path)))
+        self._files = {}
+        self._dtypes = {}
+
+    def append(self, columns):
+        columns = prepare_columns(columns)
+        if self.names is None: self.names = list(columns)
+        for name in ("S", "Ia"):
+            if name not in self.names: self.names.append(name)
+        n = len(columns[self.names[0]])
+        if n == 0: return
+        for name in self.names:
+            arr = columns[name]
+            if name not in self._files:
+                self._dtypes[name] = arr.dtype.str
+                self._files[name] = open(os.path.join(self._dir, name), "wb")
+            self._files[name].write(arr.astype(self._dtypes[name], copy=False).tobytes())
+        self.count += n
+
+    def close(self):
+        for f in self._files.values(): f.close()
+        names = self.names or list(REQUIRED) + ["S", "Ia"]
+        dtypes = {name: self._dtypes.get(name, SCHEMA.get(name, "<f4")) for name in names}
+        header, cols = _layout(names, dtypes, self.count)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(MAGIC)
+            out.write(struct.pack("<I", len(header)))
+            out.write(header)
+            for col in cols:
+                out.write(b"\0" * (col["offset"] - out.tell()))
+                spill = os.path.join(self._dir, col["name"])
+                if os.path.exists(spill):
+                    with open(spill, "rb") as f:
+                        while True:
+                            chunk = f.read(1 << 22)
+                            if not chunk: break
+                            out.write(chunk)
+            out.write(b"\0" * (_align(out.tell()) - out.tell()))
+        os.replace(tmp_path, self.path)
+        self._cleanup()
+
+    def abort(self):
+        """Drops everything appended so far (no output file is written)."""
+        for f in self._files.values(): f.close()
+        self._cleanup()
+
+    def _cleanup(self):
+        for name in list(self._files):
+            try: os.remove(os.path.join(self._dir, name))
+            except OSError: pass
+        try: os.rmdir(self._dir)
+        except OSError: pass
+
+
+def load_catchment(bin_path, csv_path=None):
+    """Opens the binary store, falling back to parsing the legacy CSV."""
+    if os.path.exists(bin_path): return CatchmentStore.open(bin_path)
+    if csv_path and os.path.exists(csv_path):
+        import pandas as pd
+        return CatchmentStore.from_dataframe(pd.read_csv(csv_path))
+    raise FileNotFoundError(bin_path)
@@ -0,0 +1,647 @@
+#flow_engine.py
+# Drainage topology of the LiDAR mosaic: depression filling (priority-flood), D8 flow
+# directions, upstream (contributing) area and flow length to the gauge.
+#
+# The mosaic is cut into square chunks; a chunk only ever holds its own pixels plus a
+# one-pixel halo, so the mosaic never has to fit in RAM. Stages:
+#   1. fill        every chunk is flooded from its edges; the halo says how high water must
+#                  rise to escape through the neighbour. Chunks are re-run whenever a
+#                  neighbour's edge changes (halo exchange) until nothing changes.
+#   2. flats       distance to the nearest exit across flat (filled) ground, same exchange,
+#                  so flats drain without cycles across chunk borders.
+#   3. d8          steepest descent on the filled DEM (flats: towards the exit).
+#   4. accumulate  per-chunk upstream area, then the chunk-to-chunk flow graph (edge pixels
+#                  only) solved once for the whole mosaic, then a second per-chunk pass.
+# Chunks of a stage run in a process pool. Results are cached as GeoTIFFs in flow_cache/.
+#
+#   python flow_engine.py --workers 8
+import os
+import time
+import shutil
+import argparse
+import numpy as np
+import rasterio
+from glob import glob
+from affine import Affine
+from rasterio.warp import transform
+from rasterio.windows import Window
+from scipy.ndimage import minimum_filter
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree, breadth_first_order, dijkstra
+from concurrent.futures import ProcessPoolExecutor
+from scan_risk import load_manifest, save_manifest, tile_fingerprint
+from routing import distance_to_outlet_m, FLOW_PATH_SINUOSITY
+
+# CONFIGURATION
+TILE_FOLDER = "tiles"
+FLOW_CACHE = os.environ.get("RIVERLY_FLOW_DIR", "flow_cache")
+CHUNK_SIZE = int(os.environ.get("RIVERLY_FLOW_CHUNK", 1024))  # Pixels per chunk side (~60 MB of scratch per worker at 1024)
+OUTPUTS = ("filled", "d8", "upstream_area", "flow_length")
+D8_OUTLET = 0     # Drains off the mosaic (edge or no-data)
+D8_NODATA = 255
+
+# D8 neighbours (row, col, ESRI direction code): E, SE, S, SW, W, NW, N, NE
+NEIGHBOURS = ((0, 1, 1), (1, 1, 2), (1, 0, 4), (1, -1, 8), (0, -1, 16), (-1, -1, 32), (-1, 0, 64), (-1, 1, 128))
+CODE_OFFSETS = {code: (dr, dc) for dr, dc, code in NEIGHBOURS}
+
+
+# --- MOSAIC GRID ---
+
+def mosaic_grid(tif_files, chunk=CHUNK_SIZE):
+    """
+    The common pixel grid of all tiles (same CRS and resolution, laid out edge to edge):
+    {"crs", "transform", "height", "width", "chunk", "tiles": [(path, row_off, col_off, height, width)]}.
+    """
+    found = []
+    crs = res = None
+    for path in sorted(tif_files):
+        with rasterio.open(path) as ds:
+            if crs is None: crs, res = ds.crs, ds.res
+            elif ds.crs != crs or not np.allclose(ds.res, res):
+                print(f"Skipped {path}: grid {ds.crs} {ds.res} differs from the mosaic ({crs} {res})")
+                continue
+            found.append((path, ds.bounds.left, ds.bounds.top, ds.height, ds.width))
+    if not found: raise ValueError("No tiles to build the mosaic from")
+
+    west, north = min(t[1] for t in found), max(t[2] for t in found)
+    tiles = [(path, int(round((north - top) / res[1])), int(round((left - west) / res[0])), h, w)
+             for path, left, top, h, w in found]
+    return {
+        "crs": crs.to_wkt(), "transform": tuple(Affine(res[0], 0, west, 0, -res[1], north))[:6],
+        "height": max(r + h for _, r, _, h, _ in tiles), "width": max(c + w for _, _, c, _, w in tiles),
+        "chunk": int(chunk), "tiles": tiles,
+    }
+
+
+_datasets = {}  # Per-process tile handles (opened lazily, so pool workers open their own)
+
+
+def read_dem(grid, row, col, height, width):
+    """Mosaic window as float32, NaN where there is no tile, no data or elevation <= 0."""
+    out = np.full((height, width), np.nan, dtype=np.float32)
+    for path, r0, c0, h, w in grid["tiles"]:
+        top, left = max(row, r0), max(col, c0)
+        bottom, right = min(row + height, r0 + h), min(col + width, c0 + w)
+        if top >= bottom or left >= right: continue
+        ds = _datasets.get(path)
+        if ds is None: ds = _datasets[path] = rasterio.open(path)
+        data = ds.read(1, window=Window(left - c0, top - r0, right - left, bottom - top), masked=True)
+        block = data.filled(np.nan).astype(np.float32)
+        block[~(block > 0)] = np.nan
+        out[top - row:bottom - row, left - col:right - col] = block
+    return out
+
+
+def chunk_keys(grid):
+    size = grid["chunk"]
+    return [(i, j) for i in range(-(-grid["height"] // size)) for j in range(-(-grid["width"] // size))]
+
+
+def chunk_window(grid, key):
+    size = grid["chunk"]
+    r0, c0 = key[0] * size, key[1] * size
+    return r0, c0, min(size, grid["height"] - r0), min(size, grid["width"] - c0)
+
+
+def chunk_of(grid, pixels_or_key):
+    """Chunk number of global pixel indices (array), or of a chunk key (tuple)."""
+    size = grid["chunk"]
+    per_row = -(-grid["width"] // size)
+    if isinstance(pixels_or_key, tuple): return pixels_or_key[0] * per_row + pixels_or_key[1]
+    rows, cols = np.divmod(pixels_or_key, grid["width"])
+    return (rows // size) * per_row + cols // size
+
+
+# --- WORK ARRAYS (memory-mapped, shared by the pool workers) ---
+
+WORK_DTYPES = {"filled": "<f4", "flat_dist": "<f4", "d8": "u1", "upstream_area": "<f4", "flow_length": "<f4"}
+
+
+def work_array(work_dir, name, grid, mode="r+"):
+    return np.memmap(os.path.join(work_dir, name + ".dat"), dtype=WORK_DTYPES[name], mode=mode,
+                     shape=(grid["height"], grid["width"]))
+
+
+def padded(arr, r0, c0, h, w, pad, fill):
+    """arr[r0 - pad : r0 + h + pad, c0 - pad : c0 + w + pad], with `fill` outside the array."""
+    out = np.full((h + 2 * pad, w + 2 * pad), fill, dtype=arr.dtype)
+    top, left = max(r0 - pad, 0), max(c0 - pad, 0)
+    bottom, right = min(r0 + h + pad, arr.shape[0]), min(c0 + w + pad, arr.shape[1])
+    out[top - r0 + pad:bottom - r0 + pad, left - c0 + pad:right - c0 + pad] = arr[top:bottom, left:right]
+    return out
+
+
+def shifted(a, dr, dc):
+    """Neighbour view of a 1-pixel padded array: value at (r + dr, c + dc) for every core (r, c)."""
+    h, w = a.shape[0] - 2, a.shape[1] - 2
+    return a[1 + dr:1 + dr + h, 1 + dc:1 + dc + w]
+
+
+def halo_readers(old, new):
+    """Offsets of the neighbouring chunks whose halo (our outer pixels) changed."""
+    differs = lambda a, b: not np.array_equal(a, b, equal_nan=True)
+    sides = {(-1, 0): np.s_[0, :], (1, 0): np.s_[-1, :], (0, -1): np.s_[:, 0], (0, 1): np.s_[:, -1],
+             (-1, -1): np.s_[0, 0], (-1, 1): np.s_[0, -1], (1, -1): np.s_[-1, 0], (1, 1): np.s_[-1, -1]}
+    return [offset for offset, side in sides.items() if differs(old[side], new[side])]
+
+
+# --- CHUNK KERNELS ---
+
+def grid_edges(valid):
+    """(u, v) flat index pairs of 8-connected neighbouring valid pixels (each pair once)."""
+    idx = np.arange(valid.size).reshape(valid.shape)
+    pairs = [(idx[:, :-1], idx[:, 1:]), (idx[:-1, :], idx[1:, :]), (idx[:-1, :-1], idx[1:, 1:]), (idx[:-1, 1:], idx[1:, :-1])]
+    u = np.concatenate([a.ravel() for a, _ in pairs])
+    v = np.concatenate([b.ravel() for _, b in pairs])
+    flat_valid = valid.ravel()
+    keep = flat_valid[u] & flat_valid[v]
+    return u[keep], v[keep]
+
+
+def max_to_root(value, parent, root):
+    """Highest value on each node's tree path to root (pointer jumping, O(n log depth))."""
+    best, up = value.copy(), parent.copy()
+    active = np.flatnonzero(up != root)
+    while active.size:
+        nxt = up[active]
+        best[active] = np.maximum(best[active], best[nxt])
+        up[active] = up[nxt]
+        active = active[up[active] != root]
+    return best
+
+
+def flood(z, escape, edges=None):
+    """
+    Priority-flood fill of one chunk: the lowest water level at which each pixel drains,
+    either through its neighbours or straight out of the chunk (escape: -inf = outlet,
+    +inf = no way out, else the level needed to leave through the halo).
+
+    Priority-flood grows the flooded area from the outlets, always over its lowest rim
+    pixel, which is Prim's algorithm on the pixel graph with edge cost max(z_u, z_v).
+    scipy's minimum spanning tree builds the same tree in C; a pixel's fill level is the
+    highest cost on its tree path to the outlets. O(n log n), no per-pixel Python.
+
+    Returns (level, edges): the pixel-to-pixel edges of the tree. Escape levels only ever
+    drop between halo exchanges, so an edge left out of the tree once is never needed
+    again and re-runs can pass these back instead of the full 8-connected grid.
+    """
+    h, w = z.shape
+    valid = ~np.isnan(z)
+    n = z.size
+    root = n
+    zf = z.ravel().astype(np.float64)
+    u, v = edges if edges is not None else grid_edges(valid)
+    cost = np.maximum(zf[u], zf[v])
+
+    out = np.flatnonzero(valid.ravel() & (escape.ravel() < np.inf))
+    out_cost = np.maximum(zf[out], escape.ravel()[out])
+    level = np.full(n, np.inf)
+    level[~valid.ravel()] = np.nan
+    if out.size == 0: return level.reshape(h, w).astype(np.float32), (u, v)
+
+    # csgraph drops zero-weight edges, so shift every cost to >= 1
+    costs = np.concatenate([cost, out_cost])
+    base = costs.min() - 1.0
+    graph = coo_matrix((costs - base, (np.concatenate([u, out]), np.concatenate([v, np.full(out.size, root)]))),
+                       shape=(n + 1, n + 1)).tocsr()
+    tree = minimum_spanning_tree(graph)
+    order, parent = breadth_first_order(tree, root, directed=False, return_predecessors=True)
+    tree = tree.tocoo()
+    inner = (tree.row < root) & (tree.col < root)
+    tree_edges = (tree.row[inner].astype(np.int32), tree.col[inner].astype(np.int32))
+
+    # Node value: own elevation, plus the escape level for pixels that drain out directly
+    value = np.append(zf, -np.inf)
+    parent[root] = root
+    reached = np.zeros(n + 1, dtype=bool)
+    reached[order] = True
+    parent[~reached] = root
+    direct = np.flatnonzero(reached[:n] & (parent[:n] == root))
+    lookup = np.full(n, -np.inf)
+    lookup[out] = out_cost
+    value[direct] = np.maximum(value[direct], lookup[direct])
+
+    best = max_to_root(value, parent, root)[:n]
+    level = np.where(reached[:n], best, level)
+    level[~valid.ravel()] = np.nan
+    return level.reshape(h, w).astype(np.float32), tree_edges
+
+
+def fill_chunk(job):
+    grid, work_dir, key = job
+    r0, c0, h, w = chunk_window(grid, key)
+    dem = read_dem(grid, r0 - 1, c0 - 1, h + 2, w + 2)
+    filled = work_array(work_dir, "filled", grid)
+    halo = padded(filled, r0, c0, h, w, 1, -np.inf)  # Outside the mosaic: water leaves freely
+
+    # Level needed to leave through each neighbour: no data = free, own chunk = left to the graph
+    leave = np.where(np.isnan(dem), -np.inf, halo)
+    leave[1:-1, 1:-1] = np.where(np.isnan(dem[1:-1, 1:-1]), -np.inf, np.inf)
+    escape = minimum_filter(leave, size=3, mode="constant", cval=-np.inf)[1:-1, 1:-1]
+
+    # Tree edges from this chunk's previous run (scratch, next to the work arrays)
+    tree_path = os.path.join(work_dir, f"tree_{key[0]}_{key[1]}.npy")
+    edges = tuple(np.load(tree_path)) if os.path.exists(tree_path) else None
+    level, edges = flood(dem[1:-1, 1:-1], escape, edges)
+    np.save(tree_path, np.stack(edges).astype(np.int32))
+
+    readers = halo_readers(filled[r0:r0 + h, c0:c0 + w], level)
+    filled[r0:r0 + h, c0:c0 + w] = level
+    filled.flush()
+    return key, readers
+
+
+def flat_masks(f):
+    """(exit, flat) masks for the core of a 1-pixel padded filled DEM."""
+    core = f[1:-1, 1:-1]
+    valid = ~np.isnan(core)
+    lower = np.zeros(core.shape, dtype=bool)
+    edge = np.zeros(core.shape, dtype=bool)
+    for dr, dc, _ in NEIGHBOURS:
+        nb = shifted(f, dr, dc)
+        lower |= nb < core
+        edge |= np.isnan(nb)
+    exits = valid & (lower | edge)
+    return exits, valid & ~exits
+
+
+def flats_chunk(job):
+    """Steps (8-connected) from every flat pixel to the nearest pixel that drains lower."""
+    grid, work_dir, key = job
+    r0, c0, h, w = chunk_window(grid, key)
+    f = padded(work_array(work_dir, "filled", grid, "r"), r0, c0, h, w, 1, np.nan)
+    dist_map = work_array(work_dir, "flat_dist", grid)
+    d = padded(dist_map, r0, c0, h, w, 1, np.inf)
+    core = f[1:-1, 1:-1]
+    exits, flat = flat_masks(f)
+
+    dist = np.where(exits, 0.0, np.inf).astype(np.float32)
+    if flat.any():
+        # Seed: one step past the best equal-level neighbour already known (exit here, or halo)
+        inner = np.zeros((h + 2, w + 2), dtype=bool)
+        inner[1:-1, 1:-1] = True
+        known = np.where(inner, np.inf, d)
+        known[1:-1, 1:-1][exits] = 0.0
+        seed = np.full(core.shape, np.inf)
+        for dr, dc, _ in NEIGHBOURS:
+            same = flat & (shifted(f, dr, dc) == core)
+            seed[same] = np.minimum(seed[same], shifted(known, dr, dc)[same] + 1.0)
+
+        # Unit-cost BFS over equal-level flat neighbours from a virtual source (dijkstra in C)
+        ids = np.full(core.size, -1)
+        cells = np.flatnonzero(flat.ravel())
+        ids[cells] = np.arange(cells.size)
+        u, v = grid_edges(flat)
+        cu, cv = core.ravel()[u], core.ravel()[v]
+        u, v = ids[u[cu == cv]], ids[v[cu == cv]]
+        src = cells.size
+        seeded = np.flatnonzero(np.isfinite(seed.ravel()[cells]))
+        rows = np.concatenate([u, v, np.full(seeded.size, src)])
+        cols = np.concatenate([v, u, seeded])
+        weights = np.concatenate([np.ones(2 * u.size), seed.ravel()[cells][seeded]])
+        graph = coo_matrix((weights, (rows, cols)), shape=(src + 1, src + 1)).tocsr()
+        steps = dijkstra(graph, directed=True, indices=src)[:src]
+        dist.ravel()[cells] = steps
+    dist[np.isnan(core)] = np.nan
+
+    readers = halo_readers(dist_map[r0:r0 + h, c0:c0 + w], dist)
+    dist_map[r0:r0 + h, c0:c0 + w] = dist
+    dist_map.flush()
+    return key, readers
+
+
+def d8_chunk(job):
+    """ESRI D8 codes: steepest descent, or along falling flat distance, or D8_OUTLET at the edge."""
+    grid, work_dir, key = job
+    r0, c0, h, w = chunk_window(grid, key)
+    f = padded(work_array(work_dir, "filled", grid, "r"), r0, c0, h, w, 1, np.nan)
+    d = padded(work_array(work_dir, "flat_dist", grid, "r"), r0, c0, h, w, 1, np.nan)
+    core, core_d = f[1:-1, 1:-1], d[1:-1, 1:-1]
+    res_x, res_y = grid["transform"][0], -grid["transform"][4]
+
+    slopes = np.full((8, h, w), -np.inf, dtype=np.float32)
+    flat_next = np.full((8, h, w), np.inf, dtype=np.float32)
+    for k, (dr, dc, _) in enumerate(NEIGHBOURS):
+        nb, nb_d = shifted(f, dr, dc), shifted(d, dr, dc)
+        drop = (core - nb) / np.hypot(dr * res_y, dc * res_x)
+        slopes[k] = np.where(np.isnan(drop), -np.inf, drop)
+        flat_next[k] = np.where((nb == core) & (nb_d < core_d), nb_d, np.inf)
+
+    codes = np.array([code for _, _, code in NEIGHBOURS], dtype=np.uint8)
+    steep, towards = slopes.argmax(axis=0), flat_next.argmin(axis=0)
+    out = np.where(slopes.max(axis=0) > 0, codes[steep],
+                   np.where(np.isfinite(flat_next.min(axis=0)), codes[towards], D8_OUTLET)).astype(np.uint8)
+    out[np.isnan(core)] = D8_NODATA
+
+    d8 = work_array(work_dir, "d8", grid)
+    d8[r0:r0 + h, c0:c0 + w] = out
+    d8.flush()
+    return key, []
+
+
+def receivers(grid, key, codes):
+    """
+    Local receiver index per pixel (-1 where flow leaves the chunk or the mosaic), global
+    receiver index (-1 = off the mosaic) and D8 step length in metres.
+    """
+    r0, c0, h, w = chunk_window(grid, key)
+    res_x, res_y = grid["transform"][0], -grid["transform"][4]
+    rows, cols = np.divmod(np.arange(h * w), w)
+    dr, dc = np.zeros(h * w, dtype=np.int64), np.zeros(h * w, dtype=np.int64)
+    flat_codes = codes.ravel()
+    for code, (r, c) in CODE_OFFSETS.items():
+        hit = flat_codes == code
+        dr[hit], dc[hit] = r, c
+    moves = (dr != 0) | (dc != 0)
+    tr, tc = rows + dr, cols + dc
+    inside = moves & (tr >= 0) & (tr < h) & (tc >= 0) & (tc < w)
+    local = np.where(inside, tr * w + tc, -1)
+    glob_recv = np.where(moves, (r0 + tr) * grid["width"] + (c0 + tc), -1)
+    step = np.hypot(dr * res_y, dc * res_x)
+    return local, glob_recv, step
+
+
+def distinct(ids, slot):
+    """ids without repeats in O(len(ids)), using a scratch array as big as the id space."""
+    slot[ids] = np.arange(ids.size)
+    return ids[slot[ids] == np.arange(ids.size)]
+
+
+def accumulate(recv, weights):
+    """Sum of weights over each pixel and everything upstream of it (Kahn order, one batch per level)."""
+    acc = np.asarray(weights, dtype=np.float64).copy()
+    moves = recv >= 0
+    pending = np.bincount(recv[moves], minlength=recv.size)
+    slot = np.empty(recv.size, dtype=np.int64)
+    frontier = np.flatnonzero(moves & (pending == 0))
+    while frontier.size:
+        targets = recv[frontier]
+        np.add.at(acc, targets, acc[frontier])
+        np.subtract.at(pending, targets, 1)
+        frontier = distinct(targets[(pending[targets] == 0) & moves[targets]], slot)
+    return acc
+
+
+def to_exit(recv, step):
+    """Each pixel's last pixel inside the chunk on its flow path, and the path length to it."""
+    n = recv.size
+    up = np.where(recv >= 0, recv, np.arange(n))
+    length = np.where(recv >= 0, step, 0.0)
+    active = np.flatnonzero(up != np.arange(n))
+    while active.size:
+        nxt = up[active]
+        length[active] += length[nxt]
+        up[active] = up[nxt]
+        active = active[up[up[active]] != up[active]]
+    return up, length
+
+
+def ring_mask(h, w):
+    ring = np.zeros((h, w), dtype=bool)
+    ring[0], ring[-1], ring[:, 0], ring[:, -1] = True, True, True, True
+    return ring.ravel()
+
+
+def accumulate_chunk(job):
+    """Pass 1: upstream area inside the chunk, plus its edge pixels for the mosaic-wide solve."""
+    grid, work_dir, key = job
+    r0, c0, h, w = chunk_window(grid, key)
+    codes = np.asarray(work_array(work_dir, "d8", grid, "r")[r0:r0 + h, c0:c0 + w])
+    valid = (codes != D8_NODATA).ravel()
+    local, glob_recv, step = receivers(grid, key, codes)
+    pixel_area = abs(grid["transform"][0] * grid["transform"][4])
+    acc = accumulate(local, valid * pixel_area)
+
+    area = work_array(work_dir, "upstream_area", grid)
+    area[r0:r0 + h, c0:c0 + w] = np.where(valid, acc, np.nan).reshape(h, w)
+    area.flush()
+
+    to_global = lambda i: (r0 + i // w) * grid["width"] + (c0 + i % w)
+    exits = np.flatnonzero(valid & (local < 0))
+    edge = np.flatnonzero(valid & ring_mask(h, w))
+    link, length = to_exit(local, step)
+    return key, {
+        "exit": to_global(exits), "exit_recv": glob_recv[exits], "exit_area": acc[exits], "exit_step": step[exits],
+        "edge": to_global(edge), "edge_link": to_global(link[edge]), "edge_length": length[edge],
+    }
+
+
+def solve_mosaic(grid, parts):
+    """
+    Chunk-to-chunk flow over edge pixels only: the area each edge pixel receives from
+    upstream chunks, and each exit pixel's flow length to the gauge.
+    """
+    cat = lambda name: np.concatenate([p[name] for p in parts]) if parts else np.empty(0)
+    exit_ids, exit_recv = cat("exit").astype(np.int64), cat("exit_recv").astype(np.int64)
+    edge_ids, edge_link, edge_length = cat("edge").astype(np.int64), cat("edge_link").astype(np.int64), cat("edge_length")
+    order = np.argsort(exit_ids)
+    exit_ids, exit_recv, exit_area, exit_step = exit_ids[order], exit_recv[order], cat("exit_area")[order], cat("exit_step")[order]
+    edge_order = np.argsort(edge_ids)
+    edge_ids, edge_link, edge_length = edge_ids[edge_order], edge_link[edge_order], edge_length[edge_order]
+
+    # Exit x -> the edge pixel it drains into (another chunk) -> that chunk's exit
+    moves = exit_recv >= 0
+    entry = np.full(exit_ids.size, -1)
+    entry[moves] = np.searchsorted(edge_ids, exit_recv[moves])
+    down = np.full(exit_ids.size, -1)
+    down[moves] = np.searchsorted(exit_ids, edge_link[entry[moves]])
+
+    # Upstream totals at every exit, in topological order (one batch per level)
+    total = exit_area.astype(np.float64).copy()
+    has = down >= 0
+    pending = np.bincount(down[has], minlength=down.size)
+    slot = np.empty(down.size, dtype=np.int64)
+    frontier = np.flatnonzero(pending == 0)
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        src = frontier[has[frontier]]
+        np.add.at(total, down[src], total[src])
+        np.subtract.at(pending, down[src], 1)
+        targets = down[src]
+        frontier = distinct(targets[pending[targets] == 0], slot)
+
+    inflow = np.zeros(edge_ids.size)
+    np.add.at(inflow, entry[moves], total[moves])
+
+    # Flow length to the gauge: D8 path to where the flow leaves the mosaic, then the
+    # straight-line estimate routing.py uses for the rest of the way
+    rows, cols = np.divmod(exit_ids, grid["width"])
+    xs, ys = Affine(*grid["transform"]) * (cols + 0.5, rows + 0.5)
+    lons, lats = transform(grid["crs"], "EPSG:4326", xs, ys)
+    tail = distance_to_outlet_m(np.asarray(lats), np.asarray(lons)) * FLOW_PATH_SINUOSITY
+    length = np.zeros(exit_ids.size)
+    for level in reversed(levels):  # Downstream first
+        last = level[~has[level]]
+        length[last] = exit_step[last] + tail[last]
+        on = level[has[level]]
+        length[on] = exit_step[on] + edge_length[entry[on]] + length[down[on]]
+    return {"edge": edge_ids, "inflow": inflow, "exit": exit_ids, "length": length}
+
+
+def finish_chunk(job):
+    """Pass 2: add the inflow from upstream chunks and write flow lengths."""
+    grid, work_dir, key, edge_ids, inflow, exit_ids, exit_length = job
+    r0, c0, h, w = chunk_window(grid, key)
+    codes = np.asarray(work_array(work_dir, "d8", grid, "r")[r0:r0 + h, c0:c0 + w])
+    valid = (codes != D8_NODATA).ravel()
+    local, _, step = receivers(grid, key, codes)
+
+    area = work_array(work_dir, "upstream_area", grid)
+    if inflow.size:
+        rows, cols = np.divmod(edge_ids, grid["width"])
+        extra = np.zeros(h * w)
+        extra[(rows - r0) * w + (cols - c0)] = inflow
+        area[r0:r0 + h, c0:c0 + w] += accumulate(local, extra).reshape(h, w).astype(np.float32)
+        area.flush()
+
+    link, length = to_exit(local, step)
+    rows, cols = np.divmod(exit_ids, grid["width"])
+    tail = np.zeros(h * w)
+    tail[(rows - r0) * w + (cols - c0)] = exit_length
+    flow_length = work_array(work_dir, "flow_length", grid)
+    flow_length[r0:r0 + h, c0:c0 + w] = np.where(valid, length + tail[link], np.nan).reshape(h, w)
+    flow_length.flush()
+    return key, []
+
+
+# --- DRIVER ---
+
+def run_chunks(pool, fn, jobs):
+    return list(pool.map(fn, jobs)) if pool else [fn(job) for job in jobs]
+
+
+def relax(pool, fn, grid, work_dir, label):
+    """Runs fn over every chunk, then re-runs the chunks whose halo changed until none does."""
+    keys = set(chunk_keys(grid))
+    pending, rounds, runs = set(keys), 0, 0
+    while pending:
+        rounds += 1
+        runs += len(pending)
+        results = run_chunks(pool, fn, [(grid, work_dir, key) for key in sorted(pending)])
+        pending = {(key[0] + dr, key[1] + dc) for key, readers in results for dr, dc in readers} & keys
+    print(f"   {label}: {rounds} rounds, {runs} chunk runs")
+
+
+def build(tif_files, cache_dir=FLOW_CACHE, chunk=CHUNK_SIZE, workers=1):
+    """Computes every derived raster into cache_dir (scratch arrays live in cache_dir/work)."""
+    grid = mosaic_grid(tif_files, chunk)
+    work_dir = os.path.join(cache_dir, "work")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    for name in WORK_DTYPES:
+        array = work_array(work_dir, name, grid, "w+")
+        if name in ("filled", "flat_dist"): array[:] = np.inf  # Unknown until a chunk says otherwise
+        del array
+    keys = chunk_keys(grid)
+    print(f"Mosaic {grid['width']}x{grid['height']} px, {len(keys)} chunks of {chunk}px, {workers} workers")
+
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(keys))) if workers > 1 and len(keys) > 1 else None
+    try:
+        relax(pool, fill_chunk, grid, work_dir, "fill")
+        relax(pool, flats_chunk, grid, work_dir, "flats")
+        run_chunks(pool, d8_chunk, [(grid, work_dir, key) for key in keys])
+        parts = run_chunks(pool, accumulate_chunk, [(grid, work_dir, key) for key in keys])
+        solved = solve_mosaic(grid, [part for _, part in parts])
+
+        # Hand every chunk its slice of the solution
+        edge_chunk, exit_chunk = chunk_of(grid, solved["edge"]), chunk_of(grid, solved["exit"])
+        jobs = []
+        for key in keys:
+            e, x = edge_chunk == chunk_of(grid, key), exit_chunk == chunk_of(grid, key)
+            jobs.append((grid, work_dir, key, solved["edge"][e], solved["inflow"][e], solved["exit"][x], solved["length"][x]))
+        run_chunks(pool, finish_chunk, jobs)
+    finally:
+        if pool: pool.shutdown()
+
+    write_rasters(grid, work_dir, cache_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return grid
+
+
+def write_rasters(grid, work_dir, cache_dir):
+    """Scratch arrays -> tiled, compressed GeoTIFFs (written 256 rows at a time)."""
+    profile = {"driver": "GTiff", "height": grid["height"], "width": grid["width"], "count": 1,
+               "crs": grid["crs"], "transform": Affine(*grid["transform"]),
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+    sources = {"filled": ("filled", np.nan), "d8": ("d8", D8_NODATA),
+               "upstream_area": ("upstream_area", np.nan), "flow_length": ("flow_length", np.nan)}
+    for out_name, (work_name, nodata) in sources.items():
+        array = work_array(work_dir, work_name, grid, "r")
+        path = os.path.join(cache_dir, out_name + ".tif")
+        with rasterio.open(path + ".tmp", "w", dtype=array.dtype.name, nodata=nodata, **profile) as ds:
+            for row in range(0, grid["height"], 256):
+                rows = min(256, grid["height"] - row)
+                ds.write(np.asarray(array[row:row + rows]), 1, window=Window(0, row, grid["width"], rows))
+        os.replace(path + ".tmp", path)
+        del array
+
+
+# --- CACHED RASTERS ---
+
+class FlowRasters:
+    """Read access to the cached derived rasters, e.g. upstream area at catchment points."""
+
+    def __init__(self, cache_dir=FLOW_CACHE):
+        missing = [name for name in OUTPUTS if not os.path.exists(os.path.join(cache_dir, name + ".tif"))]
+        if missing: raise FileNotFoundError(f"{cache_dir} has no {', '.join(missing)} raster (run flow_engine.py)")
+        self.datasets = {name: rasterio.open(os.path.join(cache_dir, name + ".tif")) for name in OUTPUTS}
+
+    def sample(self, xs, ys, crs, names=("upstream_area", "flow_length"), band_rows=512):
+        """Values at points given in `crs` (NaN off the mosaic). Reads one window per band of rows."""
+        ref = self.datasets[names[0]]
+        if crs != ref.crs:
+            xs, ys = transform(crs, ref.crs, xs, ys)
+        cols, rows = ~ref.transform * (np.asarray(xs, np.float64), np.asarray(ys, np.float64))
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        inside = (rows >= 0) & (rows < ref.height) & (cols >= 0) & (cols < ref.width)
+        out = {name: np.full(len(rows), np.nan, dtype=np.float32) for name in names}
+        for band in np.unique(rows[inside] // band_rows):
+            pick = np.flatnonzero(inside & (rows // band_rows == band))
+            top, left = rows[pick].min(), cols[pick].min()
+            window = Window(left, top, cols[pick].max() - left + 1, rows[pick].max() - top + 1)
+            for name in names:
+                data = self.datasets[name].read(1, window=window, masked=True).filled(np.nan)
+                out[name][pick] = data[rows[pick] - top, cols[pick] - left]
+        return out
+
+    def close(self):
+        for ds in self.datasets.values(): ds.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill depressions and derive D8 flow directions, upstream area and flow length.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Chunks processed in parallel")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="Chunk side in pixels (memory per worker grows with its square)")
+    parser.add_argument("--rehash", action="store_true", help="Hash every tile even if size/mtime are unchanged")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cached rasters match the tiles")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    os.makedirs(FLOW_CACHE, exist_ok=True)
+    manifest = load_manifest(FLOW_CACHE)
+    tif_files = sorted(glob(os.path.join(TILE_FOLDER, "*.tif")))
+    tiles = {}
+    for tif_path in tif_files:
+        name = os.path.basename(tif_path)
+        digest, st = tile_fingerprint(tif_path, manifest["tiles"].get(name), args.rehash)
+        tiles[name] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    # The rasters depend on the tiles only (not on chunk size or worker count)
+    outputs = [os.path.join(FLOW_CACHE, name + ".tif") for name in OUTPUTS]
+    same = {n: t["sha256"] for n, t in tiles.items()} == {n: t.get("sha256") for n, t in manifest["tiles"].items()}
+    if same and not args.force and all(os.path.exists(p) for p in outputs):
+        manifest["tiles"] = tiles
+        save_manifest(FLOW_CACHE, manifest)
+        print(f"Flow rasters up to date ({time.perf_counter() - started:.1f}s).")
+        return
+
+    print(f"Deriving drainage for {len(tif_files)} tiles...")
+    build(tif_files, FLOW_CACHE, args.chunk, args.workers)
+    manifest["tiles"] = tiles
+    save_manifest(FLOW_CACHE, manifest)
+    print(f"Saved {', '.join(outputs)} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
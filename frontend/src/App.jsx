@@ -2,9 +2,12 @@ import React, { useRef, useEffect, useState } from 'react';
 import mapboxgl from 'mapbox-gl';
 import 'mapbox-gl/dist/mapbox-gl.css';
 import ReportModal from './ReportModal';
+import { PointFrameStore, base64ToBuffer } from './pointFrames';
 import { Users, Droplets, Waves, Clock, Wind, Thermometer, CloudRain } from 'lucide-react';
 
 mapboxgl.accessToken = import.meta.env.VITE_MAPBOX_TOKEN;
+// Binary point frames + per-tick deltas instead of JSON (VITE_COMPACT_FEED=0 falls back to JSON)
+const COMPACT_FEED = import.meta.env.VITE_COMPACT_FEED !== '0';
 
 function App() {
   const mapContainer = useRef(null);
@@ -18,6 +21,9 @@ function App() {
   // REF FOR LATEST DISCHARGE (Fixes stale state in click listener)
   const dischargeRef = useRef(5000);
 
+  // Tile URL of the flood-extent raster currently on the map (changes with water level)
+  const inundationUrlRef = useRef(null);
+
   const [weather, setWeather] = useState({ 
     rain: 0, condition: '(Clear Sky)', temp: '--', humidity: '--', wind: '--',
     discharge: 5000, risk: 0, source: 'Init',
@@ -135,66 +141,91 @@ function App() {
   }, []); // Run once on mount
 
   // --- DATA LOOP ---
+  // LIVE mode: server pushes one shared state per tick (SSE). SIMULATOR mode: poll with slider values.
   useEffect(() => {
     let isFetching = false; 
+    const frames = new PointFrameStore();
+
+    const applyState = (data, points) => {
+        if (data.error || data.total_discharge_cusecs === undefined) { 
+            return; 
+        }
+        
+        const riskLevel = data.total_discharge_cusecs > 140000 ? 2 : (data.total_discharge_cusecs > 80000 ? 1 : 0);
+        
+        setWeather(prev => ({ 
+            ...prev,
+            rain: data.rainfall_input,
+            condition: data.rainfall_input > 0 ? '(Raining)' : '(Clear Sky)', 
+            
+            temp: data.temperature !== undefined ? data.temperature : prev.temp,
+            humidity: data.humidity !== undefined ? data.humidity : prev.humidity,
+            wind: data.wind_speed !== undefined ? data.wind_speed : prev.wind,
+            
+            soil_moisture: data.soil_moisture || 0.2,
+            snow_depth: data.snow_depth || 0,
+            dam_release: data.dam_release || 0,
+            
+            impact_people: data.impact_people || 0,
+            impact_crops: data.impact_crops || 0,
+            lag_time_hours: data.lag_time_hours || 0,
+
+            discharge: data.total_discharge_cusecs || 0, 
+            risk: riskLevel, 
+            source: "SCS-CN Distributed",
+            confidence: 98.5,
+            advisory: data.advisory || "Normal Flow",
+            return_period: data.return_period || "Normal"
+        }));
+
+        if (map.current && map.current.getSource('distributed-flood')) {
+            const geojsonData = points || {
+                type: "FeatureCollection",
+                features: data.distributed_points.map(p => ({
+                    type: "Feature",
+                    geometry: { type: "Point", coordinates: [p.lon, p.lat] },
+                    properties: { runoff: p.runoff_mm }
+                }))
+            };
+            map.current.getSource('distributed-flood').setData(geojsonData);
+        }
+
+        // Full flood extent: server-rendered depth tiles for the current water level
+        if (map.current && data.inundation_tiles && map.current.getLayer('distributed-flood-layer')) {
+            const url = `http://127.0.0.1:5000${data.inundation_tiles}`;
+            const source = map.current.getSource('inundation');
+            if (!source) {
+                map.current.addSource('inundation', { type: 'raster', tiles: [url], tileSize: 256, minzoom: 8, maxzoom: 19 });
+                map.current.addLayer({ id: 'inundation-layer', type: 'raster', source: 'inundation', paint: { 'raster-opacity': 0.85 } }, 'distributed-flood-layer');
+            } else if (inundationUrlRef.current !== url) {
+                source.setTiles([url]);
+            }
+            inundationUrlRef.current = url;
+        }
+    };
 
     const fetchDistributed = async () => {
         if (isFetching) return; 
         isFetching = true;
 
         try {
-            const currentSimMode = simulationModeRef.current;
-            let url = 'http://127.0.0.1:5000/predict-distributed';
-            if (currentSimMode) {
-                url += `?sim_rain=${simRainRef.current}`;
-                url += `&sim_soil=${simSoilRef.current}`;
-                url += `&sim_dam=${simDamRef.current}`;
+            const params = new URLSearchParams();
+            if (simulationModeRef.current) {
+                params.set('sim_rain', simRainRef.current);
+                params.set('sim_soil', simSoilRef.current);
+                params.set('sim_dam', simDamRef.current);
             }
-
-            const res = await fetch(url);
-            const data = await res.json();
-            
-            if (data.error || data.total_discharge_cusecs === undefined) { 
-                return; 
+            if (COMPACT_FEED) {
+                params.set('format', 'compact');
+                if (frames.frameId) params.set('base', frames.frameId);
             }
-            
-            const riskLevel = data.total_discharge_cusecs > 140000 ? 2 : (data.total_discharge_cusecs > 80000 ? 1 : 0);
-            
-            setWeather(prev => ({ 
-                ...prev,
-                rain: data.rainfall_input,
-                condition: data.rainfall_input > 0 ? '(Raining)' : '(Clear Sky)', 
-                
-                temp: data.temperature !== undefined ? data.temperature : prev.temp,
-                humidity: data.humidity !== undefined ? data.humidity : prev.humidity,
-                wind: data.wind_speed !== undefined ? data.wind_speed : prev.wind,
-                
-                soil_moisture: data.soil_moisture || 0.2,
-                snow_depth: data.snow_depth || 0,
-                dam_release: data.dam_release || 0,
-                
-                impact_people: data.impact_people || 0,
-                impact_crops: data.impact_crops || 0,
-                lag_time_hours: data.lag_time_hours || 0,
-
-                discharge: data.total_discharge_cusecs || 0, 
-                risk: riskLevel, 
-                source: "SCS-CN Distributed",
-                confidence: 98.5,
-                advisory: data.advisory || "Normal Flow",
-                return_period: data.return_period || "Normal"
-            }));
-
-            if (map.current && map.current.getSource('distributed-flood')) {
-                const geojsonData = {
-                    type: "FeatureCollection",
-                    features: data.distributed_points.map(p => ({
-                        type: "Feature",
-                        geometry: { type: "Point", coordinates: [p.lon, p.lat] },
-                        properties: { runoff: p.runoff_mm }
-                    }))
-                };
-                map.current.getSource('distributed-flood').setData(geojsonData);
+            const query = params.toString();
+
+            const res = await fetch(`http://127.0.0.1:5000/predict-distributed${query ? `?${query}` : ''}`);
+            if ((res.headers.get('Content-Type') || '').includes('json')) applyState(await res.json());  // Errors stay JSON
+            else {
+                const state = frames.apply(await res.arrayBuffer());
+                if (state) applyState(state, frames.geojson());
             }
 
         } catch(e) {
@@ -204,11 +235,36 @@ function App() {
         }
     };
 
-    const interval = setInterval(fetchDistributed, 1000); 
-    fetchDistributed(); 
+    let interval = null;
+    const startPolling = () => {
+        if (interval) return;
+        interval = setInterval(fetchDistributed, 1000);
+        fetchDistributed();
+    };
+
+    if (!simulationMode && typeof EventSource !== 'undefined') {
+        // Reconnects automatically; the server sends the latest snapshot immediately on (re)connect
+        const source = new EventSource(`http://127.0.0.1:5000/stream-distributed${COMPACT_FEED ? '?format=compact' : ''}`);
+        source.addEventListener('state', (e) => {
+            try { applyState(JSON.parse(e.data)); }
+            catch(err) { console.error("Stream Error:", err); }
+        });
+        source.addEventListener('frame', (e) => {
+            try {
+                const state = frames.apply(base64ToBuffer(e.data));
+                if (state) applyState(state, frames.geojson());
+            }
+            catch(err) { console.error("Stream Error:", err); }
+        });
+        // A server with every live stream taken answers 503 and the browser gives up: poll instead
+        source.onerror = () => { if (source.readyState === EventSource.CLOSED) startPolling(); };
+        return () => { source.close(); clearInterval(interval); };
+    }
+
+    startPolling();
 
     return () => clearInterval(interval);
-  }, []); 
+  }, [simulationMode]); 
 
   // ... (Rest of JSX Return logic same as previous answer) ...
   // Ensure the layout matches the previous correct version with 3 rows of metrics.
@@ -9,18 +9,24 @@ ChartJS.register(CategoryScale, LinearScale, PointElement, LineElement, Title, T
 
 const ReportModal = ({ onClose, weather, simulationMode, simRain }) => {
   const [forecast, setForecast] = useState([]);
+  const [ensemble, setEnsemble] = useState(null);
   const [generating, setGenerating] = useState(false);
 
   useEffect(() => {
     const controller = new AbortController();
     const signal = controller.signal;
 
-    let url = 'http://127.0.0.1:5000/get-forecast';
-    if (simulationMode) url += `?sim_rain=${simRain}`;
+    // Ensemble mode: deterministic hydrograph + uncertainty bands from 2000 perturbed members
+    let url = 'http://127.0.0.1:5000/get-forecast?ensemble=1&members=2000';
+    if (simulationMode) url += `&sim_rain=${simRain}`;
 
     fetch(url, { signal })
       .then(res => res.json())
-      .then(data => setForecast(data))
+      .then(data => {
+          // Older servers answer with the bare hourly list
+          if (Array.isArray(data)) { setForecast(data); setEnsemble(null); }
+          else { setForecast(data.forecast || []); setEnsemble(data.bands ? data : null); }
+      })
       .catch(err => {
           if (err.name !== 'AbortError') console.error("Forecast Error:", err);
       });
@@ -70,14 +76,23 @@ const ReportModal = ({ onClose, weather, simulationMode, simRain }) => {
         backgroundColor: weather.risk >= 2 ? 'rgba(239, 68, 68, 0.2)' : 'rgba(59, 130, 246, 0.2)',
         fill: true,
         tension: 0.4,
-      }
+      },
+      // Uncertainty bands: each lower edge fills up to the upper edge drawn just before it
+      ...(ensemble ? [
+        { label: 'Ensemble 5-95%', data: ensemble.bands.p95, borderColor: 'transparent', backgroundColor: 'rgba(148, 163, 184, 0.15)', pointRadius: 0, fill: false, tension: 0.4 },
+        { label: '', data: ensemble.bands.p5, borderColor: 'transparent', backgroundColor: 'rgba(148, 163, 184, 0.15)', pointRadius: 0, fill: '-1', tension: 0.4 },
+        { label: 'Ensemble 25-75%', data: ensemble.bands.p75, borderColor: 'transparent', backgroundColor: 'rgba(148, 163, 184, 0.3)', pointRadius: 0, fill: false, tension: 0.4 },
+        { label: '', data: ensemble.bands.p25, borderColor: 'transparent', backgroundColor: 'rgba(148, 163, 184, 0.3)', pointRadius: 0, fill: '-1', tension: 0.4 },
+      ] : [])
     ]
   };
 
+  const exceedance = (threshold) => ensemble ? Math.round(ensemble.peak.exceedance[threshold] * 100) : null;
+
   const chartOptions = {
     responsive: true,
     plugins: { 
-        legend: { labels: { color: 'white' } } 
+        legend: { labels: { color: 'white', filter: item => item.text } } 
     },
     scales: {
       y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
@@ -223,6 +238,13 @@ const ReportModal = ({ onClose, weather, simulationMode, simRain }) => {
                 <div style={{height: '250px'}}>
                     {forecast.length > 0 ? <Line data={chartData} options={chartOptions} /> : <p>Loading Forecast...</p>}
                 </div>
+                {ensemble && (
+                    <div style={{display:'flex', gap:'20px', marginTop:'10px', fontSize:'12px', color:'#cbd5e1'}}>
+                        <span>Chance of exceeding <strong>{ensemble.thresholds.warning.toLocaleString()}</strong> cusecs: <strong style={{color:'#fbbf24'}}>{exceedance(ensemble.thresholds.warning)}%</strong></span>
+                        <span>Chance of exceeding <strong>{ensemble.thresholds.critical.toLocaleString()}</strong> cusecs: <strong style={{color:'#ef4444'}}>{exceedance(ensemble.thresholds.critical)}%</strong></span>
+                        <span style={{color:'#64748b'}}>({ensemble.members.toLocaleString()} ensemble members)</span>
+                    </div>
+                )}
             </div>
 
             {/* 4. AI Analysis Text */}
@@ -0,0 +1,70 @@
+// Decoder for the compact map-point frames of /predict-distributed?format=compact and
+// /stream-distributed?format=compact (layout documented in point_codec.py).
+// Points are kept as GeoJSON features keyed by catchment point id, so a delta only touches
+// the points that moved; coordinates arrive once, when a point first enters the map.
+
+const MAGIC = 'RVFRAME1';
+const RUNOFF_STEP_MM = 0.1;
+const TYPED = { '<u4': Uint32Array, '<f4': Float32Array, '<u2': Uint16Array, '|u1': Uint8Array };
+
+export const decodeFrame = (buffer) => {
+  const bytes = new Uint8Array(buffer);
+  if (String.fromCharCode(...bytes.subarray(0, 8)) !== MAGIC) throw new Error('Not a Riverly frame');
+  const headerLength = new DataView(buffer).getUint32(8, true);
+  const header = JSON.parse(new TextDecoder().decode(bytes.subarray(12, 12 + headerLength)));
+  const start = 12 + headerLength;
+  const arrays = {};
+  // Offsets are 4-byte aligned, so every column is a zero-copy view
+  for (const a of header.arrays) arrays[a.name] = new TYPED[a.dtype](buffer, start + a.offset, a.length);
+  return { header, arrays };
+};
+
+// SSE carries frames as base64 text
+export const base64ToBuffer = (text) => {
+  const raw = atob(text);
+  const bytes = new Uint8Array(raw.length);
+  for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+  return bytes.buffer;
+};
+
+export class PointFrameStore {
+  constructor() {
+    this.features = new Map();   // id -> GeoJSON feature
+    this.frameId = null;         // Sent back as ?base= so the server can answer with a delta
+  }
+
+  // Applies one frame and returns the dashboard state it carries (null if the delta did not fit)
+  apply(buffer) {
+    const { header, arrays } = decodeFrame(buffer);
+    if (header.base === null) {
+      this.features.clear();
+      this._add(arrays.id, arrays.lat, arrays.lon, arrays.runoff, arrays.status);
+    } else if (header.base === this.frameId) {
+      for (const id of arrays.removed) this.features.delete(id);
+      this._add(arrays.added_id, arrays.added_lat, arrays.added_lon, arrays.added_runoff, arrays.added_status);
+      for (let i = 0; i < arrays.changed_id.length; i++) {
+        const f = this.features.get(arrays.changed_id[i]);
+        f.properties = { runoff: arrays.changed_runoff[i] * RUNOFF_STEP_MM, status: arrays.changed_status[i] };
+      }
+    } else {
+      this.frameId = null;  // Out of step: the next request asks for a keyframe
+      return null;
+    }
+    this.frameId = header.frame;
+    return header.state;
+  }
+
+  _add(ids, lats, lons, runoff, status) {
+    for (let i = 0; i < ids.length; i++) {
+      this.features.set(ids[i], {
+        type: "Feature",
+        geometry: { type: "Point", coordinates: [lons[i], lats[i]] },
+        properties: { runoff: runoff[i] * RUNOFF_STEP_MM, status: status[i] }
+      });
+    }
+  }
+
+  geojson() {
+    return { type: "FeatureCollection", features: Array.from(this.features.values()) };
+  }
+}
@@ -1,79 +1,163 @@
 import rasterio
-import pandas as pd
 import numpy as np
 from glob import glob
 from rasterio.warp import transform
 import os
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from catchment_store import CatchmentStore, CatchmentWriter, REQUIRED
+from raster_cache import row_strip_windows, STRIP_BYTES
+from flow_engine import FlowRasters, FLOW_CACHE
 
 # CONFIGURATION
 TILE_FOLDER = "tiles"
 RIVER_BED_THRESHOLD = 300.0  # Capture river bed + banks
 SAMPLE_STEP = 300 # Step size (Higher = fewer points, faster performance)
+BACKEND_PATH = "catchment_points.bin"  # Memory-mapped columnar store read by app.py
+MERGE_CHUNK = 1 << 20  # Points copied per step when stitching tile outputs together
+CHANNEL_AREA_M2 = 50_000  # Upstream area (flow_engine.py) above which a pixel is channel, not bank
+FLOW_COLUMNS = ("upstream_area", "flow_length")
 
-data_rows = []
-print("Scanning LiDAR for Distributed Catchment Points...")
 
-tif_files = glob(os.path.join(TILE_FOLDER, "*.tif"))
+def catchment_columns(elevation, lats, lons, flow=None):
+    """
+    DISTRIBUTE DATA LOGIC (vectorized):
+    Rainfall Weight from Elevation - Higher Elevation (Mountains) = 1.2x rain, else 1.0x
+    Curve Number from location guess - River bed (< 294 m) = High CN (90), Banks = Med CN (70)
+    With flow rasters (flow={"upstream_area", "flow_length"}), pixels draining at least
+    CHANNEL_AREA_M2 are river bed too, and both values are stored for routing.py.
+    """
+    elevation = np.asarray(elevation, dtype=np.float64)
+    river_bed = elevation < 294
+    columns = {
+        "lat": np.round(lats, 5),
+        "lon": np.round(lons, 5),
+        "elevation": np.round(elevation, 2),
+        "rain_weight": np.where(elevation > 350, 1.2, 1.0),
+    }
+    if flow is not None:
+        river_bed = river_bed | (flow["upstream_area"] >= CHANNEL_AREA_M2)
+        columns.update({name: flow[name] for name in FLOW_COLUMNS})
+    columns["cn"] = np.where(river_bed, 90, 70)
+    return columns
 
-point_id = 0
 
-for tif_path in tif_files:
+def sample_tile(tif_path, out_path, sample_step=SAMPLE_STEP, strip_bytes=STRIP_BYTES, flow_dir=None):
+    """
+    Streams one tile strip by strip and appends every sample_step-th low-lying
+    pixel to out_path. Strips are read in row-major order and the sampling phase
+    carries over between strips, so the points are exactly those of a whole-tile
+    np.where(...)[::sample_step]. flow_dir adds upstream area / flow length from
+    the flow_engine.py rasters. Returns (tif_path, points written).
+    """
+    writer = CatchmentWriter(out_path, list(REQUIRED) + (list(FLOW_COLUMNS) if flow_dir else []))
+    flow_rasters = FlowRasters(flow_dir) if flow_dir else None
+    seen = 0  # Low-lying pixels counted so far in this tile
     try:
         with rasterio.open(tif_path) as ds:
-            data = ds.read(1)
-            # Finding relevant pixels (low lying areas)
-            valid_pixels = np.where((data > 0) & (data < RIVER_BED_THRESHOLD))
-            
-            rows = valid_pixels[0][::SAMPLE_STEP]
-            cols = valid_pixels[1][::SAMPLE_STEP]
-            
-            if len(rows) > 0:
-                xs, ys = rasterio.transform.xy(ds.transform, rows, cols)
+            for window in row_strip_windows(ds, strip_bytes):
+                data = ds.read(1, window=window)
+                # Finding relevant pixels (low lying areas)
+                valid = np.flatnonzero((data > 0) & (data < RIVER_BED_THRESHOLD))
+                picks = valid[(-seen) % sample_step::sample_step]
+                seen += len(valid)
+                if len(picks) == 0: continue
+
+                rows, cols = np.divmod(picks, window.width)
+                elevation = data.ravel()[picks]
+                # Pixel centres in the tile CRS, then to lat/lon
+                xs, ys = ds.transform * (cols + 0.5, rows + window.row_off + 0.5)
                 if ds.crs != 'EPSG:4326':
                     lons, lats = transform(ds.crs, 'EPSG:4326', xs, ys)
                 else:
                     lons, lats = xs, ys
-                
-                # Extract Elevation for these points
-                # We can't easily vector read elevation from row/col in one go without looping or advanced indexing
-                # For a generator script, looping is acceptable
-                
-                for r, c, lat, lon in zip(rows, cols, lats, lons):
-                    elev = float(data[r, c])
-                    
-                    # DISTRIBUTE DATA LOGIC:
-                    # Assign a "Rainfall Weight" based on Elevation
-                    # Higher Elevation (Mountains) = Higher Weight (1.2x rain)
-                    # Lower Elevation (City) = Normal Weight (1.0x rain)
-                    rain_weight = 1.0
-                    if elev > 350: rain_weight = 1.2
-                    elif elev < 295: rain_weight = 1.0 # River bed
-                    
-                    # Assign Curve Number (CN) based on location guess
-                    # River bed = High CN (90), Banks = Med CN (70)
-                    cn_val = 90 if elev < 294 else 70
-                    
-                    data_rows.append({
-                        "id": point_id,
-                        "lat": round(lat, 5),
-                        "lon": round(lon, 5),
-                        "elevation": round(elev, 2),
-                        "rain_weight": rain_weight,
-                        "cn": cn_val
-                    })
-                    point_id += 1
+                flow = flow_rasters.sample(xs, ys, ds.crs, FLOW_COLUMNS) if flow_rasters else None
+                writer.append(catchment_columns(elevation, np.asarray(lats), np.asarray(lons), flow))
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if flow_rasters: flow_rasters.close()
+    return tif_path, writer.count
+
+
+def _sample_tile_job(job):
+    tif_path, out_path, sample_step, flow_dir = job
+    try:
+        return sample_tile(tif_path, out_path, sample_step, flow_dir=flow_dir)
     except Exception as e:
-        print(f"Skipped {tif_path}: {e}")
+        return tif_path, e
+
+
+def merge_parts(part_paths, out_path, names=REQUIRED):
+    """Concatenates per-tile stores (in tile order) into the final store, one chunk at a time."""
+    writer = CatchmentWriter(out_path, list(names))
+    for path in part_paths:
+        part = CatchmentStore.open(path)
+        for start in range(0, len(part), MERGE_CHUNK):
+            writer.append({name: part[name][start:start + MERGE_CHUNK] for name in part.columns})
+        del part
+    writer.close()
+    return writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the distributed catchment point store from LiDAR tiles.")
+    parser.add_argument("--csv", action="store_true", help="Also export catchment_points.csv (backend + frontend debugging copies)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Tiles processed in parallel (1 = no process pool)")
+    parser.add_argument("--sample-step", type=int, default=SAMPLE_STEP, help="Keep every Nth low-lying pixel")
+    parser.add_argument("--flow", action="store_true",
+                        help=f"Use upstream area / flow length from {FLOW_CACHE}/ (run flow_engine.py first)")
+    args = parser.parse_args()
+
+    print("Scanning LiDAR for Distributed Catchment Points...")
+    started = time.perf_counter()
+
+    tif_files = glob(os.path.join(TILE_FOLDER, "*.tif"))
+    flow_dir = FLOW_CACHE if args.flow else None
+    if flow_dir: FlowRasters(flow_dir).close()  # Fail before any tile work if the rasters are missing
+
+    # Each tile goes to its own part file; parts are stitched in tile order, so ids
+    # don't depend on which worker finishes first
+    parts_dir = tempfile.mkdtemp(prefix=".catchment_parts_", dir=os.path.dirname(os.path.abspath(BACKEND_PATH)))
+    try:
+        jobs = [(tif_path, os.path.join(parts_dir, f"{i:06d}.bin"), args.sample_step, flow_dir) for i, tif_path in enumerate(tif_files)]
+        if args.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+                results = list(pool.map(_sample_tile_job, jobs))
+        else:
+            results = [_sample_tile_job(job) for job in jobs]
+
+        part_paths = []
+        for (tif_path, outcome), (_, part_path, _, _) in zip(results, jobs):
+            if isinstance(outcome, Exception):
+                print(f"Skipped {tif_path}: {outcome}")
+                continue
+            print(f"   {os.path.basename(tif_path)}: {outcome} points")
+            part_paths.append(part_path)
+
+        # Save Columnar Binary Store (S and Ia pre-calculated inside)
+        count = merge_parts(part_paths, BACKEND_PATH, list(REQUIRED) + (list(FLOW_COLUMNS) if flow_dir else []))
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    print(f"Generated {count} Distributed Points in {time.perf_counter() - started:.1f}s ({args.workers} workers).")
+    print(f"   Saved to: {BACKEND_PATH} (For Backend)")
 
-# Save to CSV
-df = pd.DataFrame(data_rows)
-output_path = "frontend/public/catchment_points.csv"
-# Also save a copy for backend to read easily
-backend_path = "catchment_points.csv"
+    # Optional CSV Export
+    if args.csv:
+        store = CatchmentStore.open(BACKEND_PATH)
+        output_path = "frontend/public/catchment_points.csv"
+        csv_path = "catchment_points.csv"
+        store.to_csv(csv_path)
+        store.to_csv(output_path)
+        print(f"   Saved to: {csv_path} (CSV Export)")
+        print(f"   Saved to: {output_path} (For Frontend Debugging)")
 
-df.to_csv(output_path, index=False)
-df.to_csv(backend_path, index=False)
 
-print(f"Generated {len(df)} Distributed Points.")
-print(f"   Saved to: {backend_path} (For Backend)")
-print(f"   Saved to: {output_path} (For Frontend Debugging)")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
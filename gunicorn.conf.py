@@ -0,0 +1,44 @@
+#gunicorn.conf.py
+# Pre-forked production serving of the Flask API (Linux/macOS):
+#
+#   gunicorn app:app -c gunicorn.conf.py
+#   RIVERLY_WEB_WORKERS=8 RIVERLY_WEB_THREADS=4 gunicorn app:app -c gunicorn.conf.py
+#
+# preload_app imports app.py once in the master: the model, tile metadata and the
+# memory-mapped catchment store are loaded before forking (pre_fork waits for the
+# background startup to finish) and shared copy-on-write. No LiDAR file is open at fork
+# time (raster_pool opens handles lazily, per process), and each worker stays within
+# RIVERLY_MAX_OPEN_TILES handles.
+# RIVERLY_PRELOAD=0 skips that: every worker imports app.py itself, answers /health at
+# once and loads in the background (fast restarts with the tile manifest, no sharing).
+import os
+
+# CONFIGURATION
+bind = os.environ.get("RIVERLY_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("RIVERLY_WEB_WORKERS", min(4, os.cpu_count() or 1)))
+threads = int(os.environ.get("RIVERLY_WEB_THREADS", 4))
+worker_class = "gthread"
+preload_app = os.environ.get("RIVERLY_PRELOAD", "1").lower() not in ("0", "false", "no", "off")
+timeout = int(os.environ.get("RIVERLY_WORKER_TIMEOUT", 120))
+# /stream-distributed holds a worker thread per viewer: it ends well within the timeout (the
+# browser reconnects), and each worker keeps at least one thread for the other routes
+os.environ.setdefault("RIVERLY_STREAM_SECONDS", str(max(timeout // 2, 1)))
+os.environ.setdefault("RIVERLY_SYNC_STREAMS", str(threads // 2))  # 0 with one thread: dashboards poll
+if int(os.environ["RIVERLY_SYNC_STREAMS"]) >= threads:
+    raise ValueError(f"RIVERLY_SYNC_STREAMS must be below RIVERLY_WEB_THREADS ({threads}): streams would take every thread")
+
+
+def pre_fork(server, worker):
+    # Loader threads do not survive fork(): a preloaded master finishes loading first
+    if preload_app:
+        import app
+        for basin in app.basins.basins.values():
+            if basin.started: basin.startup.wait()  # Pinned basins (the default one at least)
+
+
+def post_fork(server, worker):
+    # Per-process state that must not be inherited: pooled GDAL handles and the profiler thread
+    import metrics
+    from raster_pool import raster_pool
+    raster_pool.after_fork()
+    metrics.start_profiler()
@@ -0,0 +1,241 @@
+#inference.py
+import os
+import re
+import time
+import numpy as np
+import joblib
+from sklearn import __version__ as SKLEARN_VERSION
+
+# CONFIGURATION
+MODEL_PATH = os.environ.get("RIVERLY_MODEL_PATH", "flood_model.pkl")
+FEATURES = ["rain_mm", "soil_moisture", "snow_mm", "rain_last_5_days", "discharge_cusecs"]
+SKLEARN_BATCH_ROWS = 1500  # From this many rows scikit-learn's compiled traversal beats the NumPy one (same results)
+
+
+def sklearn_before(major, minor, version=SKLEARN_VERSION):
+    """True for a scikit-learn older than major.minor ("1.6rc1", "1.4.dev0" parse too; an unknown format counts as new)."""
+    parts = re.match(r"(\d+)\.(\d+)", version)
+    return parts is not None and (int(parts[1]), int(parts[2])) < (major, minor)
+
+
+# scikit-learn >= 1.4 keeps class fractions in tree_.value and returns them untouched;
+# older versions keep weighted counts and normalize them in predict_proba
+NORMALIZE_LEAVES = sklearn_before(1, 4)
+
+
+class FlatForest:
+    """
+    RandomForestClassifier flattened into contiguous NumPy node arrays.
+    One vectorized traversal (rows x trees) gives both the class and its
+    probability, with the same numerics as scikit-learn:
+      - features are cast to float32 before comparing with the float64 thresholds
+      - per-tree leaf values are taken (or normalized) like DecisionTreeClassifier.predict_proba
+      - tree probabilities are summed in estimator order, then divided by n_trees
+    The NumPy traversal wins on single rows and small batches (no validation / per-tree
+    dispatch overhead); large batches are handed to scikit-learn itself.
+    """
+
+    def __init__(self, forest):
+        self.estimator = forest
+        self.classes_ = np.asarray(forest.classes_)
+        self.n_classes = len(self.classes_)
+        self.n_features = forest.n_features_in_
+        self.n_trees = len(forest.estimators_)
+
+        features, thresholds, lefts, probas, roots = [], [], [], [], []
+        offset, max_depth = 0, 0
+        for est in forest.estimators_:
+            tree = est.tree_
+            order = _breadth_first_order(tree.children_left, tree.children_right)
+            n = len(order)
+            new_id = np.empty(n, dtype=np.int64)
+            new_id[order] = np.arange(n)
+
+            left = tree.children_left[order]
+            is_leaf = left == -1
+            # Breadth-first numbering puts each right child right after its left child,
+            # so traversal is: next = left[node] + (x > threshold).
+            # Leaves point to themselves with an infinite threshold, so extra steps are no-ops.
+            lefts.append(np.where(is_leaf, np.arange(n), new_id[np.where(is_leaf, 0, left)]) + offset)
+            features.append(np.where(is_leaf, 0, tree.feature[order]))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold[order]))
+
+            proba = tree.value[order, 0, :self.n_classes].astype(np.float64)
+            if NORMALIZE_LEAVES:
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                proba = proba / normalizer
+            probas.append(proba)
+
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.leaf_proba = np.concatenate(probas)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.is_leaf = ~np.isfinite(self.threshold)
+        self.max_depth = max_depth
+        self.estimator_bytes = sum(_tree_nbytes(est.tree_) for est in forest.estimators_)
+
+    def nbytes(self):
+        """Node arrays plus the scikit-learn trees kept for large batches (both stay resident)."""
+        flat = sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.leaf_proba, self.roots))
+        return flat + self.estimator_bytes
+
+    def _as_matrix(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1: X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN or infinity.")
+        # scikit-learn trees compare float32 inputs against float64 thresholds
+        return X.astype(np.float32).astype(np.float64)
+
+    def apply(self, X):
+        """Leaf node id (global) per row and tree: shape (n_rows, n_trees)."""
+        return self._apply(self._as_matrix(X))
+
+    def _apply(self, X):
+        n_rows = len(X)
+        # Feature-major copy of X: value of feature f for row r sits at f * n_rows + r
+        X_flat = np.ascontiguousarray(X.T).ravel()
+        feature_offset = self.feature * n_rows
+
+        nodes = np.tile(self.roots, n_rows)
+        # Only (row, tree) pairs that have not reached a leaf keep traversing
+        pos = np.arange(len(nodes))
+        cur = nodes.copy()
+        rows = np.repeat(np.arange(n_rows, dtype=np.intp), self.n_trees)
+        for _ in range(self.max_depth):
+            values = X_flat.take(feature_offset.take(cur) + rows)
+            cur = self.left.take(cur) + (values > self.threshold.take(cur))
+            nodes[pos] = cur
+            active = ~self.is_leaf.take(cur)
+            if not active.all():
+                pos, cur, rows = pos[active], cur[active], rows[active]
+                if len(pos) == 0: break
+        return nodes.reshape(n_rows, self.n_trees)
+
+    def _sklearn_proba(self, X):
+        names = getattr(self.estimator, "feature_names_in_", None)
+        if names is not None:
+            import pandas as pd
+            X = pd.DataFrame(X, columns=names)  # Fitted on a DataFrame: named columns, no warning
+        return self.estimator.predict_proba(X)
+
+    def predict_proba(self, X, max_flat_rows=SKLEARN_BATCH_ROWS):
+        """Class probabilities; batches of max_flat_rows or more go to scikit-learn (None: always the NumPy traversal)."""
+        X = self._as_matrix(X)
+        if max_flat_rows is not None and len(X) >= max_flat_rows: return self._sklearn_proba(X)
+        leaves = self._apply(X)
+        total = np.zeros((len(leaves), self.n_classes))
+        # Summed in estimator order, exactly like the forest's running sum
+        for t in range(self.n_trees):
+            total += self.leaf_proba.take(leaves[:, t], axis=0)
+        return total / self.n_trees
+
+    def predict_with_confidence(self, X):
+        """(classes, max class probability) for every row, from one traversal."""
+        proba = self.predict_proba(X)
+        best = np.argmax(proba, axis=1)
+        return self.classes_.take(best, axis=0), proba[np.arange(len(proba)), best]
+
+    def predict(self, X):
+        return self.predict_with_confidence(X)[0]
+
+    def predict_one(self, features):
+        """Single feature row -> (risk class as int, confidence in %)."""
+        classes, confidence = self.predict_with_confidence(features)
+        return int(classes[0]), round(float(confidence[0]) * 100, 1)
+
+
+def _tree_nbytes(tree):
+    """Bytes of a fitted scikit-learn tree's node and value arrays."""
+    state = tree.__getstate__()
+    return state["nodes"].nbytes + state["values"].nbytes
+
+
+def _breadth_first_order(children_left, children_right):
+    """Node ids in breadth-first order, so siblings end up adjacent."""
+    order, queue = [], [0]
+    while queue:
+        order.extend(queue)
+        nxt = []
+        for node in queue:
+            if children_left[node] != -1:
+                nxt.append(children_left[node])
+                nxt.append(children_right[node])
+        queue = nxt
+    return np.asarray(order, dtype=np.int64)
+
+
+def threshold_rows(flat, X):
+    """One row per node with its split feature set exactly to the threshold (exercises the <= boundary)."""
+    rows = np.tile(np.median(X, axis=0), (len(flat.feature), 1))
+    rows[np.arange(len(rows)), flat.feature] = np.where(np.isfinite(flat.threshold), flat.threshold, 0)
+    return rows
+
+
+def load_model(path=MODEL_PATH):
+    """Loads the pickled forest once and flattens it."""
+    return FlatForest(joblib.load(path))
+
+
+def verify_against_sklearn(flat, X):
+    """Raises AssertionError unless the NumPy traversal's class and probabilities match scikit-learn bit for bit."""
+    X = np.asarray(X, dtype=np.float64)
+    expected_proba = flat.estimator.predict_proba(X)
+    expected_class = flat.estimator.predict(X)
+    proba = flat.predict_proba(X, max_flat_rows=None)
+    best = np.argmax(proba, axis=1)
+    classes, confidence = flat.classes_.take(best, axis=0), proba[np.arange(len(proba)), best]
+    assert np.array_equal(proba, expected_proba), "probabilities differ from scikit-learn"
+    assert np.array_equal(classes, expected_class), "classes differ from scikit-learn"
+    assert np.array_equal(confidence, expected_proba.max(axis=1)), "confidence differs from scikit-learn"
+
+
+def sample_features(n, seed=0):
+    """Feature rows spanning dry season to extreme monsoon."""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.gamma(0.6, 25.0, n),              # rain_mm
+        rng.uniform(0.0, 0.6, n),             # soil_moisture
+        rng.exponential(0.5, n) * (rng.random(n) < 0.2),  # snow_mm
+        rng.gamma(0.8, 60.0, n),              # rain_last_5_days
+        rng.uniform(5000, 400000, n),         # discharge_cusecs
+    ])
+    return X
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    flat = load_model()
+    print(f"Flattened {flat.n_trees} trees, {len(flat.feature)} nodes, depth {flat.max_depth} ({flat.nbytes() / 1024:.0f} KB with the scikit-learn trees)")
+
+    X = sample_features(20000)
+    boundary = threshold_rows(flat, X)
+    for batch in (X, boundary, X[:1]):
+        verify_against_sklearn(flat, batch)
+    print(f"Verified against scikit-learn on {len(X) + len(boundary) + 1} rows: identical.")
+
+    row = X[:1]
+    t0 = time.perf_counter()
+    for _ in range(200):
+        int(flat.estimator.predict(row)[0]); flat.estimator.predict_proba(row)[0]
+    sk_ms = (time.perf_counter() - t0) / 200 * 1000
+    t0 = time.perf_counter()
+    for _ in range(200): flat.predict_one(row)
+    flat_ms = (time.perf_counter() - t0) / 200 * 1000
+    print(f"Single row: scikit-learn predict+predict_proba {sk_ms:.2f} ms | flat {flat_ms:.3f} ms")
+
+    for n in (100, SKLEARN_BATCH_ROWS, len(X)):
+        t0 = time.perf_counter(); flat._sklearn_proba(X[:n]); sk_batch = time.perf_counter() - t0
+        t0 = time.perf_counter(); flat.predict_proba(X[:n], max_flat_rows=None); flat_batch = time.perf_counter() - t0
+        print(f"Batch of {n}: scikit-learn {sk_batch * 1000:.1f} ms | flat {flat_batch * 1000:.1f} ms"
+              f" (served by {'scikit-learn' if n >= SKLEARN_BATCH_ROWS else 'flat'})")
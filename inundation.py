@@ -0,0 +1,274 @@
+#inundation.py
+import os
+import io
+import json
+import math
+import hashlib
+import argparse
+import numpy as np
+from PIL import Image
+from scenario_cache import ScenarioCache, quantize
+
+# --- RATING CURVE (shared by /check-location and the map tiles) ---
+BASE_LEVEL = 292.5        # River bed reference level (m) at Haridwar (other basins: basins.json base_level)
+RATING_DIVISOR = 55000    # Cusecs per metre of rise
+MAX_DEPTH_PROXY = 15.0    # Deepest part of channel (m)
+BANK_HEIGHT = 1.5         # Below base + this a wet pixel is the active channel, above it is inundated land
+
+# CONFIGURATION
+LEVEL_STEP = float(os.environ.get("RIVERLY_WATER_LEVEL_STEP", 0.05))  # Tiles are rendered per 5 cm of water level
+INUNDATION_CACHE_DIR = os.environ.get("RIVERLY_INUNDATION_DIR", "inundation_cache")  # Pre-rendered PNGs
+ELEVATION_TILE_CACHE = 256   # Sampled terrain grids kept in memory (256 KB each)
+PNG_TILE_CACHE = 4096        # Rendered PNGs kept in memory
+TILE_SIZE = 256
+MIN_ZOOM, MAX_ZOOM = 8, 19
+
+# Seasonal base flows + warning / critical thresholds + extreme events (cusecs)
+COMMON_DISCHARGES = [8500, 15000, 20000, 45000, 80000, 140000, 200000, 300000]
+
+
+def get_water_surface_elevation(discharge, base_level=BASE_LEVEL):
+    return base_level + discharge / RATING_DIVISOR
+
+def calculate_inundation(elevation, discharge, base_level=BASE_LEVEL):
+    """Status, flood depth and local flow for one terrain point."""
+    water_surface_elevation = get_water_surface_elevation(discharge, base_level)
+
+    status = "Terrain"; flood_depth = 0; is_active_river = False
+    local_flow = 0
+
+    if elevation < water_surface_elevation:
+        is_active_river = True
+        status = "Inundated" if elevation > base_level + BANK_HEIGHT else "Active Channel"
+        flood_depth = round(water_surface_elevation - elevation, 2)
+
+        # --- LOCAL FLOW CALCULATION (The Fix) ---
+        # Deepest part of channel ~12m.
+        # Formula: Local Flow = Total * (Depth / Max_Depth)^1.5
+        ratio = min(flood_depth / MAX_DEPTH_PROXY, 1.0)
+
+        # Apply exponential factor (Manning's Eq approx)
+        local_flow = int(discharge * (ratio ** 1.5))
+        if local_flow < 100: local_flow = 100 # Minimum visible flow
+
+    return {
+        'is_river': is_active_river, 'status': status, 'flood_depth': flood_depth,
+        'local_discharge': local_flow, 'water_level': round(water_surface_elevation, 2)
+    }
+
+# Status codes for the vectorized masks
+TERRAIN, ACTIVE_CHANNEL, INUNDATED = 0, 1, 2
+
+def inundation_masks(elevation, water_level, base_level=BASE_LEVEL):
+    """
+    calculate_inundation for a whole grid at once.
+    Returns (status uint8: 0 Terrain / no data, 1 Active Channel, 2 Inundated,
+             depth float32 in metres, 0 where dry). NaN elevation counts as no data.
+    """
+    elevation = np.asarray(elevation, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        wet = elevation < water_level
+        depth = np.where(wet, water_level - elevation, 0.0).astype(np.float32)
+        status = np.where(wet, np.where(elevation > base_level + BANK_HEIGHT, INUNDATED, ACTIVE_CHANNEL), TERRAIN)
+    return status.astype(np.uint8), depth
+
+
+def terrain_digest(tile_paths, base_level=BASE_LEVEL):
+    """
+    Short sha256 of what a rendered tile depends on besides the water level: the LiDAR tiles
+    (path, size, mtime, as the tile manifest checks them) and the rating curve's base level.
+    Pre-rendered PNGs live under it, so changed tiles or another basin never reuse stale ones.
+    """
+    stamps = []
+    for path in sorted(tile_paths):
+        try: st = os.stat(path)
+        except OSError: continue
+        stamps.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    payload = json.dumps({"base_level": base_level, "bank_height": BANK_HEIGHT, "tiles": stamps})
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def level_key(water_level):
+    """Water level -> integer centimetres, snapped to LEVEL_STEP (the tile cache key)."""
+    return int(round(quantize(water_level, LEVEL_STEP) * 100))
+
+
+# --- PALETTE ---
+# Index 0 is transparent; 1 is the active channel; 2+ are inundated land by depth
+DEPTH_BINS = np.array([0.5, 1.0, 2.0, 3.0], dtype=np.float32)  # metres
+PALETTE = [
+    (0, 0, 0, 0),            # dry / no data
+    (29, 78, 216, 170),      # active channel
+    (147, 197, 253, 150),    # < 0.5 m
+    (96, 165, 250, 170),     # 0.5 - 1 m
+    (59, 130, 246, 190),     # 1 - 2 m
+    (37, 99, 235, 205),      # 2 - 3 m
+    (30, 58, 138, 220),      # > 3 m
+]
+
+def encode_png(status, depth):
+    """Palette PNG (1 byte per pixel, alpha via tRNS) of the inundation masks."""
+    index = np.where(status == INUNDATED, 2 + np.searchsorted(DEPTH_BINS, depth, side="right"), status).astype(np.uint8)
+    image = Image.fromarray(index, mode="P")
+    image.putpalette([c for rgba in PALETTE for c in rgba[:3]])
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", transparency=bytes(rgba[3] for rgba in PALETTE), compress_level=6)
+    return buf.getvalue()
+
+EMPTY_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE), np.uint8), np.zeros((TILE_SIZE, TILE_SIZE), np.float32))
+
+
+# --- XYZ TILE MATH (Web Mercator) ---
+
+def tile_lonlat_bounds(z, x, y):
+    n = 2 ** z
+    west, east = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tile_pixel_lonlat(z, x, y, size=TILE_SIZE):
+    """Lon/lat of every pixel centre in tile z/x/y, shape (size, size) each."""
+    n = size * 2 ** z
+    px = x * size + np.arange(size) + 0.5
+    py = y * size + np.arange(size) + 0.5
+    lons = px / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py / n))))
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    return lon_grid, lat_grid
+
+def tiles_covering(bounds, z):
+    """(x, y) XYZ tiles at zoom z touching a lon/lat box (west, south, east, north)."""
+    west, south, east, north = bounds
+    n = 2 ** z
+    def to_xy(lon, lat):
+        lat = max(min(lat, 85.0511), -85.0511)
+        tx = int((lon + 180.0) / 360.0 * n)
+        ty = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return min(max(tx, 0), n - 1), min(max(ty, 0), n - 1)
+    x0, y0 = to_xy(west, north)
+    x1, y1 = to_xy(east, south)
+    return [(tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)]
+
+
+class InundationTiles:
+    """
+    XYZ inundation tiles for any water level.
+    Terrain is sampled once per tile (it never changes) and reused for every
+    water level; only the threshold + PNG encode runs per level.
+    Lookup order: memory -> pre-rendered file on disk -> render. Files on disk are keyed on
+    the terrain digest (terrain_digest), set with the coverage once the LiDAR tiles are known.
+    """
+
+    def __init__(self, elevation_lookup, coverage, cache_dir=INUNDATION_CACHE_DIR, base_level=BASE_LEVEL):
+        # elevation_lookup(lats, lons) -> (elevations with NaN where unknown, ...)
+        self.elevation_lookup = elevation_lookup
+        self.coverage = [tuple(b) for b in coverage]   # lon/lat boxes of the LiDAR tiles
+        self.cache_dir = cache_dir
+        self.base_level = base_level
+        self.terrain = terrain_digest([], base_level)
+        self.elevations = ScenarioCache(ELEVATION_TILE_CACHE)
+        self.pngs = ScenarioCache(PNG_TILE_CACHE)
+        self.rendered = 0
+        self.from_disk = 0
+
+    def set_terrain(self, coverage, tile_paths):
+        """New LiDAR tiles: their lon/lat boxes and digest. Grids and PNGs of other terrain are dropped."""
+        terrain = terrain_digest(tile_paths, self.base_level)
+        self.coverage = [tuple(b) for b in coverage]
+        if terrain != self.terrain:
+            self.terrain = terrain
+            self.elevations.clear()
+            self.pngs.clear()
+
+    def url_template(self, discharge, query=""):
+        """XYZ template for a discharge; ?v=<terrain digest> gives new LiDAR new URLs past browser caches."""
+        query = f"?v={self.terrain}" + (f"&{query.lstrip('?')}" if query else "")
+        return f"/inundation-tiles/{level_key(get_water_surface_elevation(discharge, self.base_level))}/{{z}}/{{x}}/{{y}}.png{query}"
+
+    def covers(self, z, x, y):
+        west, south, east, north = tile_lonlat_bounds(z, x, y)
+        return any(w <= east and e >= west and s <= north and n >= south for w, s, e, n in self.coverage)
+
+    def elevation_grid(self, z, x, y):
+        def sample():
+            lons, lats = tile_pixel_lonlat(z, x, y)
+            elevations = self.elevation_lookup(lats.ravel(), lons.ravel())[0]
+            return np.asarray(elevations, dtype=np.float32).reshape(TILE_SIZE, TILE_SIZE)
+        return self.elevations.get_or_compute((z, x, y), sample)
+
+    def masks(self, level_cm, z, x, y):
+        """(status, depth) grids for one tile at a water level given in centimetres."""
+        return inundation_masks(self.elevation_grid(z, x, y), level_cm / 100.0, self.base_level)
+
+    def tile_path(self, level_cm, z, x, y):
+        return os.path.join(self.cache_dir, self.terrain, str(level_cm), str(z), str(x), f"{y}.png")
+
+    def get_tile(self, level_cm, z, x, y):
+        """PNG bytes for tile z/x/y. level_cm is snapped to LEVEL_STEP so near-identical levels share tiles."""
+        level_cm = level_key(level_cm / 100.0)
+        if not self.covers(z, x, y): return EMPTY_PNG
+        return self.pngs.get_or_compute((level_cm, z, x, y), lambda: self._load_or_render(level_cm, z, x, y))
+
+    def _load_or_render(self, level_cm, z, x, y):
+        path = self.tile_path(level_cm, z, x, y)
+        if os.path.exists(path):
+            self.from_disk += 1
+            with open(path, "rb") as f: return f.read()
+        return self.render(level_cm, z, x, y)
+
+    def render(self, level_cm, z, x, y):
+        status, depth = self.masks(level_cm, z, x, y)
+        self.rendered += 1
+        if not status.any(): return EMPTY_PNG
+        return encode_png(status, depth)
+
+    def prerender(self, discharges, zooms, log=print):
+        """Writes tiles for each discharge band and zoom to cache_dir. Returns the number written."""
+        written = 0
+        levels = sorted({level_key(get_water_surface_elevation(q, self.base_level)) for q in discharges})
+        for z in zooms:
+            # Union of the tile ranges of every LiDAR tile at this zoom
+            xyz = sorted({t for bounds in self.coverage for t in tiles_covering(bounds, z)})
+            for x, y in xyz:
+                for level_cm in levels:
+                    png = self.render(level_cm, z, x, y)
+                    if png is EMPTY_PNG: continue
+                    path = self.tile_path(level_cm, z, x, y)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = path + ".tmp"
+                    with open(tmp, "wb") as f: f.write(png)
+                    os.replace(tmp, path)
+                    written += 1
+            log(f"Zoom {z}: {len(xyz)} tiles x {len(levels)} levels ({written} files so far)")
+        return written
+
+    def stats(self):
+        return {
+            "elevation_tiles": self.elevations.stats(), "png_tiles": self.pngs.stats(),
+            "rendered": self.rendered, "from_disk": self.from_disk, "terrain": self.terrain
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render inundation map tiles for common discharge bands.")
+    parser.add_argument("--zooms", type=int, nargs="+", default=[12, 13, 14, 15])
+    parser.add_argument("--discharges", type=float, nargs="+", default=COMMON_DISCHARGES, help="Discharge bands (cusecs)")
+    parser.add_argument("--basin", help="Basin id from basins.json (default: the default basin)")
+    args = parser.parse_args()
+
+    import app  # Loads the LiDAR tiles and builds the tile engine
+    basin = app.basins.get(args.basin)
+    app.basins.ready(basin, "tiles")  # Starts loading a basin that is not loaded yet
+    basin.startup.wait(None, "tiles")
+    engine = basin.resources.inundation_tiles
+    if not engine.coverage:
+        print("No LiDAR tiles loaded; nothing to render.")
+        return
+    print(f"Pre-rendering {len(args.discharges)} discharge bands at zooms {args.zooms} into {engine.cache_dir}/{engine.terrain}/")
+    written = engine.prerender(args.discharges, args.zooms)
+    print(f"Done: {written} tiles written.")
+
+
+if __name__ == "__main__":
+    main()
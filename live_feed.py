@@ -0,0 +1,175 @@
+#live_feed.py
+import os
+import json
+import time
+import base64
+import asyncio
+import threading
+import metrics
+import point_codec
+
+# CONFIGURATION
+FEED_INTERVAL = float(os.environ.get("RIVERLY_FEED_INTERVAL", 1.0))   # Seconds between live ticks
+FEED_IDLE_TIMEOUT = 30.0    # Stop ticking this long after the last subscriber leaves
+HEARTBEAT_SECONDS = 15.0    # Keeps proxies from closing quiet connections
+# The Flask app streams from a worker thread per dashboard: at most this many per process
+# (the rest get 503 and poll), each closed after RIVERLY_STREAM_SECONDS (the browser reconnects).
+# The ASGI app holds no thread per dashboard and has neither limit.
+SYNC_STREAMS = int(os.environ.get("RIVERLY_SYNC_STREAMS", 2))
+SYNC_STREAM_SECONDS = float(os.environ.get("RIVERLY_STREAM_SECONDS", 60))
+
+
+class LiveFeed:
+    """
+    Server-push broadcaster for the live dashboard state.
+    One background thread computes the state once per tick and encodes it once;
+    every subscriber receives the same pre-encoded Server-Sent Event.
+    Cost scales with the tick rate, not the number of viewers.
+    Compact subscribers get the tick as a binary frame (base64 in the SSE data): a delta
+    against the previous tick if they saw it, else a keyframe. Both are encoded once per tick.
+    """
+
+    def __init__(self, compute, interval=FEED_INTERVAL, idle_timeout=FEED_IDLE_TIMEOUT, ready=None):
+        self.compute = compute
+        self.ready = ready          # Ticks are skipped while this returns False (server still starting)
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.ticks = 0
+        self.errors = 0
+        self._cond = threading.Condition()
+        self._state = None
+        self._event = None
+        self._frame = None          # Previous tick's map points, the base of the next delta
+        self._key_event = None      # Compact keyframe of the latest tick
+        self._delta_event = None    # Compact delta from the tick before it
+        self._version = 0
+        self._subscribers = 0
+        self._last_seen = time.monotonic()
+        self._thread = None
+        self._listeners = []   # Wake-up callbacks for asyncio subscribers
+
+    # --- Producer ---
+
+    def _ensure_running(self):
+        # Caller holds the condition lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self._cond:
+                if self._subscribers == 0 and time.monotonic() - self._last_seen > self.idle_timeout:
+                    self._thread = None
+                    return
+            self.tick()
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0: time.sleep(delay)
+            else: next_tick = time.monotonic()  # Fell behind: don't burst to catch up
+
+    def tick(self):
+        """Computes and publishes one state (also usable without the thread)."""
+        if self.ready is not None and not self.ready(): return
+        try:
+            with metrics.span("live_feed_tick"):
+                state = self.compute()
+        except Exception as e:
+            self.errors += 1
+            metrics.count("live_feed_error")
+            print(f"Live feed tick failed: {e}")
+            return
+        payload = json.dumps(state, separators=(",", ":"))
+        with metrics.span("compact_encode"):
+            frame = point_codec.Frame.from_points(state.get('distributed_points'))
+            key = base64.b64encode(point_codec.encode(state, frame)).decode()
+            delta = base64.b64encode(point_codec.encode(state, frame, self._frame)).decode() if self._frame is not None else key
+            self._frame = frame
+        with self._cond:
+            self._version += 1
+            self.ticks += 1
+            self._state = state
+            self._event = f"id: {self._version}\nevent: state\ndata: {payload}\n\n"
+            self._key_event = f"id: {self._version}\nevent: frame\ndata: {key}\n\n"
+            self._delta_event = f"id: {self._version}\nevent: frame\ndata: {delta}\n\n"
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for wake in listeners:
+            try: wake()
+            except RuntimeError: pass  # Event loop already closed
+
+    # --- Consumers ---
+
+    def latest(self):
+        with self._cond:
+            return self._state
+
+    def _event_for(self, seen, compact):
+        # Caller holds the condition lock
+        if not compact: return self._event
+        return self._delta_event if seen == self._version - 1 and seen else self._key_event
+
+    def subscribe(self, compact=False, max_seconds=None):
+        """
+        Generator of SSE messages. The latest snapshot is sent straight away on (re)connect.
+        With max_seconds the stream ends after that long and the browser reconnects.
+        """
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        with self._cond:
+            self._subscribers += 1
+            self._ensure_running()
+        try:
+            yield "retry: 2000\n\n"
+            seen = 0
+            while deadline is None or time.monotonic() < deadline:
+                with self._cond:
+                    if self._version == seen:
+                        wait = HEARTBEAT_SECONDS if deadline is None else min(HEARTBEAT_SECONDS, max(deadline - time.monotonic(), 0))
+                        self._cond.wait(wait)
+                    if self._version == seen:
+                        event = ": heartbeat\n\n"
+                    else:
+                        seen, event = self._version, self._event_for(seen, compact)
+                yield event
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                self._last_seen = time.monotonic()
+
+    async def subscribe_async(self, compact=False):
+        """asyncio version of subscribe(): idle subscribers hold no thread, only an asyncio.Event."""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        wake = lambda: loop.call_soon_threadsafe(changed.set)
+        with self._cond:
+            self._subscribers += 1
+            self._listeners.append(wake)
+            self._ensure_running()
+        try:
+            yield "retry: 2000\n\n"
+            seen = 0
+            while True:
+                changed.clear()
+                with self._cond:
+                    version, event = self._version, self._event_for(seen, compact)
+                if version == seen:
+                    try:
+                        await asyncio.wait_for(changed.wait(), HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                    continue
+                seen = version
+                yield event
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                self._listeners.remove(wake)
+                self._last_seen = time.monotonic()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "subscribers": self._subscribers, "ticks": self.ticks, "errors": self.errors,
+                "interval": self.interval, "running": self._thread is not None
+            }
@@ -0,0 +1,231 @@
+#metrics.py
+# In-process instrumentation: stage spans, event counters and latency histograms,
+# exported in the Prometheus text format (GET /metrics), plus an opt-in sampling profiler.
+#
+#   with metrics.span("scs_cn"): ...      # Time one pipeline stage
+#   metrics.count("weather_unavailable")  # Count a failure / fallback
+#
+# RIVERLY_METRICS=0 turns spans and counters into no-ops (one global check per call).
+import os
+import sys
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+# CONFIGURATION
+METRICS_ENABLED = os.environ.get("RIVERLY_METRICS", "1").lower() not in ("0", "false", "no", "off")
+PROFILE_HZ = float(os.environ.get("RIVERLY_PROFILE_HZ", 0))  # Stack samples per second (0 = profiler off)
+PROFILE_MAX_DEPTH = 64
+# Seconds; covers sub-millisecond lookups up to a slow upstream
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# --- METRIC FAMILIES ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names: return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class CounterFamily:
+    """Monotonic counters, one per label-value tuple."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, values=(), n=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + n
+
+    def value(self, values=()):
+        return self._values.get(values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock: items = sorted(self._values.items())
+        for values, v in items:
+            lines.append(f"{self.name}{_labels(self.labels, values)} {v}")
+        return lines
+
+
+class Histogram:
+    """Latency histogram (cumulative buckets, _sum, _count), one series per label-value tuple."""
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # values -> [count per bucket ..., count above last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values, seconds):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def count(self, values=()):
+        series = self._series.get(values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: items = sorted((k, list(v)) for k, v in self._series.items())
+        for values, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + (f'{bound:g}',))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + ('+Inf',))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("riverly_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+REQUEST_SECONDS = Histogram("riverly_request_seconds", "Request latency per route.", ["route"])
+REQUESTS = CounterFamily("riverly_requests_total", "Requests per route and status code.", ["route", "status"])
+EVENTS = CounterFamily("riverly_events_total", "Upstream failures, fallbacks and swallowed errors.", ["event"])
+GAUGES = {}  # name -> (help, type, fn returning a number), read at scrape time
+STARTED = time.time()
+
+
+# --- RECORDING ---
+
+class Span:
+    """Context manager that adds its wall time to STAGE_SECONDS{stage}."""
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = (stage,)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+NO_SPAN = _NoSpan()
+
+
+def span(stage):
+    return Span(stage) if METRICS_ENABLED else NO_SPAN
+
+
+def count(event, n=1):
+    if METRICS_ENABLED: EVENTS.inc((event,), n)
+
+
+def observe_request(route, status, seconds):
+    if not METRICS_ENABLED: return
+    REQUEST_SECONDS.observe((route,), seconds)
+    REQUESTS.inc((route, str(status)))
+
+
+def gauge(name, help_text, fn, kind="gauge"):
+    """Registers a value read at scrape time (e.g. from an existing stats()); kind='counter' for running totals."""
+    GAUGES[name] = (help_text, kind, fn)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = ["# HELP riverly_uptime_seconds Seconds since the process started.",
+             "# TYPE riverly_uptime_seconds gauge", f"riverly_uptime_seconds {time.time() - STARTED:.1f}",
+             "# HELP riverly_metrics_enabled 1 if spans and counters are being recorded.",
+             "# TYPE riverly_metrics_enabled gauge", f"riverly_metrics_enabled {int(METRICS_ENABLED)}"]
+    for family in (REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, EVENTS):
+        lines.extend(family.render())
+    for name, (help_text, kind, fn) in sorted(GAUGES.items()):
+        try: value = fn()
+        except Exception: continue
+        if value is None: continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {float(value):g}"]
+    if profiler is not None:
+        lines += ["# HELP riverly_profile_samples_total Stack samples taken by the sampling profiler.",
+                  "# TYPE riverly_profile_samples_total counter", f"riverly_profile_samples_total {profiler.samples}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- SAMPLING PROFILER ---
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack `hz` times a second from a daemon thread and
+    aggregates them as folded stacks ("outer;inner;leaf count"), ready for flamegraph.pl
+    or speedscope. Costs nothing in the request path; enable with RIVERLY_PROFILE_HZ.
+    """
+
+    def __init__(self, hz):
+        self.hz = hz
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # A thread object inherited across fork() is not running in this process
+        if self._thread is not None and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = 1.0 / self.hz
+        while not self._stop.wait(interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own: continue
+                names = []
+                while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(names)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def folded(self, limit=None):
+        """Folded stacks, most frequent first."""
+        with self._lock: items = self._stacks.most_common(limit)
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+
+profiler = SamplingProfiler(PROFILE_HZ) if PROFILE_HZ > 0 else None
+
+
+def start_profiler():
+    """Starts the opt-in profiler (no-op unless RIVERLY_PROFILE_HZ > 0)."""
+    if profiler is not None:
+        profiler.start()
+        print(f"Sampling profiler on: {PROFILE_HZ:g} Hz (GET /debug/profile)")
@@ -0,0 +1,150 @@
+#raster_cache.py
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from rasterio.windows import Window
+
+# CONFIGURATION
+# Total memory (MB) the decoded block cache may hold, shared by all tiles
+RASTER_CACHE_MB = float(os.environ.get("RIVERLY_RASTER_CACHE_MB", 256))
+# Fallback window size when a file's native block is too big to cache
+# (e.g. untiled GeoTIFFs with one giant strip)
+FALLBACK_WINDOW = 256
+MAX_NATIVE_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+class BlockCache:
+    """LRU cache of decoded raster blocks, bounded by a byte budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        size = block.nbytes
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None: self.current_bytes -= old.nbytes
+            self._blocks[key] = block
+            self.current_bytes += size
+            # Evict least recently used blocks until we fit the budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.current_bytes = 0
+
+    def purge(self, match):
+        """Drops the blocks whose key (path, block row, block col) match(key) accepts; returns bytes freed."""
+        with self._lock:
+            keys = [key for key in self._blocks if match(key)]
+            freed = sum(self._blocks.pop(key).nbytes for key in keys)
+            self.current_bytes -= freed
+        return freed
+
+    def stats(self):
+        return {
+            "blocks": len(self._blocks), "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses
+        }
+
+
+# One cache for every open tile in this process
+block_cache = BlockCache(RASTER_CACHE_MB * 1024 * 1024)
+
+
+def get_block_shape(ds):
+    """Cache unit for a dataset: its native block, or a fixed window if that block is huge."""
+    block_h, block_w = ds.block_shapes[0]
+    if block_h * block_w * np.dtype(ds.dtypes[0]).itemsize <= MAX_NATIVE_BLOCK_BYTES:
+        return block_h, block_w
+    return FALLBACK_WINDOW, FALLBACK_WINDOW
+
+
+def read_block(ds, block_row, block_col, block_shape=None, cache=block_cache):
+    """Returns the decoded block (band 1) at a block grid position, reading it on a miss."""
+    block_h, block_w = block_shape or get_block_shape(ds)
+    key = (ds.name, block_row, block_col)
+    block = cache.get(key)
+    if block is None:
+        # Windowed read: decode only this block, never the whole band
+        row_off, col_off = block_row * block_h, block_col * block_w
+        window = Window(col_off, row_off, min(block_w, ds.width - col_off), min(block_h, ds.height - row_off))
+        block = ds.read(1, window=window)
+        cache.put(key, block)
+    return block
+
+
+def read_pixel(ds, row, col, cache=block_cache):
+    """Single pixel value of band 1, served from the shared block cache."""
+    if not (0 <= row < ds.height and 0 <= col < ds.width): return None
+    block_h, block_w = get_block_shape(ds)
+    block_row, block_col = row // block_h, col // block_w
+    block = read_block(ds, block_row, block_col, (block_h, block_w), cache)
+    return block[row - block_row * block_h, col - block_col * block_w]
+
+
+def read_pixels(ds, rows, cols, cache=block_cache):
+    """
+    Vectorized lookup of many pixels (band 1).
+    Points are grouped by block so each block is decoded at most once.
+    Out-of-range pixels come back as NaN.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    values = np.full(len(rows), np.nan, dtype=np.float64)
+    inside = (rows >= 0) & (rows < ds.height) & (cols >= 0) & (cols < ds.width)
+    if not inside.any(): return values
+
+    block_h, block_w = get_block_shape(ds)
+    idx = np.nonzero(inside)[0]
+    block_rows, block_cols = rows[idx] // block_h, cols[idx] // block_w
+    blocks_per_row = (ds.width + block_w - 1) // block_w
+    block_ids = block_rows * blocks_per_row + block_cols
+
+    order = np.argsort(block_ids, kind="stable")
+    idx, block_ids = idx[order], block_ids[order]
+    starts = np.flatnonzero(np.r_[True, block_ids[1:] != block_ids[:-1]])
+    ends = np.r_[starts[1:], len(idx)]
+    for start, end in zip(starts, ends):
+        block_row, block_col = divmod(int(block_ids[start]), blocks_per_row)
+        block = read_block(ds, block_row, block_col, (block_h, block_w), cache)
+        members = idx[start:end]
+        values[members] = block[rows[members] - block_row * block_h, cols[members] - block_col * block_w]
+    return values
+
+
+# --- STREAMING (batch scripts) ---
+STRIP_BYTES = 64 * 1024 * 1024  # Decoded strip budget for whole-tile scans
+
+
+def row_strip_windows(ds, max_bytes=STRIP_BYTES):
+    """
+    Full-width windows of whole block rows, top to bottom.
+    Reading them in order visits every pixel once in row-major order, decodes each
+    block once and keeps at most ~max_bytes of the band in memory, however big the tile.
+    """
+    block_h = ds.block_shapes[0][0]
+    row_bytes = ds.width * np.dtype(ds.dtypes[0]).itemsize
+    rows_per_strip = max(block_h, (max_bytes // max(row_bytes, 1)) // block_h * block_h)
+    for row_off in range(0, ds.height, rows_per_strip):
+        yield Window(0, row_off, ds.width, min(rows_per_strip, ds.height - row_off))
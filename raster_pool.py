@@ -0,0 +1,279 @@
+#raster_pool.py
+# LiDAR tiles for the API servers: metadata loaded once, file handles opened on demand.
+#
+# TileMeta holds everything a lookup needs before touching the file (bounds, transform,
+# block layout), read once at startup. Loaded before a pre-forking server forks
+# (gunicorn --preload), it is shared copy-on-write by every worker.
+# GDAL handles are never shared: RasterPool lends a handle to one thread at a time, keeps
+# at most RIVERLY_MAX_OPEN_TILES open per process (least recently used closed first) and
+# drops everything it inherited across fork(), so N workers x M threads over thousands of
+# tiles stay within N x RIVERLY_MAX_OPEN_TILES descriptors.
+# load_tile_metas() persists the headers in RIVERLY_TILE_MANIFEST, so a restart only opens
+# tiles that are new or changed (size / mtime), in parallel.
+import os
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import rasterio
+from affine import Affine
+from pyproj import Transformer
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import rowcol
+
+# CONFIGURATION
+MAX_OPEN_TILES = int(os.environ.get("RIVERLY_MAX_OPEN_TILES", 64))  # Open handles per process
+TILE_MANIFEST = os.environ.get("RIVERLY_TILE_MANIFEST", "tile_manifest.json")  # Persisted tile headers
+STARTUP_WORKERS = int(os.environ.get("RIVERLY_STARTUP_WORKERS", 8))  # Threads opening uncached tiles
+MANIFEST_VERSION = 1
+
+
+class RasterPool:
+    """
+    Process-wide pool of open rasterio datasets, keyed by path.
+    A handle is checked out by one thread at a time; idle handles are kept in LRU order
+    and closed once more than max_open are open. If every handle is busy, a new one is
+    opened anyway (the overshoot is bounded by the number of threads) and closed on return.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_TILES, opener=rasterio.open):
+        self.max_open = max(1, int(max_open))
+        self.opener = opener
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()  # path -> [idle handles], least recently used first
+        self.open_count = 0
+        self.opened = 0
+        self.closed = 0
+        self.reused = 0
+
+    def after_fork(self):
+        """
+        Forget (never close) handles inherited from the parent: their GDAL state and
+        file offsets belong to it. Runs automatically on first use in a new process.
+        """
+        self._reset()
+
+    @contextmanager
+    def dataset(self, path):
+        """Borrows an open dataset for path (opened on a miss), returned to the pool afterwards."""
+        if self._pid != os.getpid(): self.after_fork()
+        ds = None
+        with self._lock:
+            handles = self._idle.get(path)
+            if handles:
+                ds = handles.pop()
+                if not handles: del self._idle[path]
+                self.reused += 1
+        if ds is None:
+            ds = self.opener(path)
+            with self._lock:
+                self.open_count += 1
+                self.opened += 1
+        try:
+            yield ds
+        finally:
+            self._give_back(path, ds)
+
+    def _give_back(self, path, ds):
+        if self._pid != os.getpid(): return  # Forked while borrowed: the handle is the parent's
+        to_close = []
+        with self._lock:
+            self._idle.setdefault(path, []).append(ds)
+            self._idle.move_to_end(path)
+            # Close least recently used idle handles until we are back under the budget
+            while self.open_count > self.max_open and self._idle:
+                old_path, handles = next(iter(self._idle.items()))
+                to_close.append(handles.pop(0))
+                if not handles: del self._idle[old_path]
+                self.open_count -= 1
+                self.closed += 1
+        for handle in to_close:
+            try: handle.close()
+            except Exception: pass
+
+    def close_paths(self, paths):
+        """Closes the idle handles of these files (borrowed ones are kept until given back)."""
+        with self._lock:
+            handles = [ds for path in paths for ds in self._idle.pop(path, [])]
+            self.open_count -= len(handles)
+            self.closed += len(handles)
+        for ds in handles:
+            try: ds.close()
+            except Exception: pass
+
+    def close_all(self):
+        with self._lock:
+            handles = [ds for group in self._idle.values() for ds in group]
+            self._idle.clear()
+            self.open_count -= len(handles)
+            self.closed += len(handles)
+        for ds in handles:
+            try: ds.close()
+            except Exception: pass
+
+    def stats(self):
+        return {"open": self.open_count, "idle": sum(len(h) for h in self._idle.values()), "max_open": self.max_open,
+                "opened": self.opened, "closed": self.closed, "reused": self.reused}
+
+
+# One pool per process (re-initialised after fork)
+raster_pool = RasterPool()
+
+
+class TileMeta:
+    """
+    Metadata of one tile, with the attributes raster_cache reads from a dataset
+    (name, height, width, dtypes, block_shapes, transform, bounds, crs, nodata), plus its
+    lon/lat box. read() borrows a handle from the pool, so a block cache hit never opens the file.
+    """
+    __slots__ = ("name", "height", "width", "dtypes", "block_shapes", "transform", "bounds", "crs", "nodata",
+                 "lonlat", "pool")
+
+    def __init__(self, name, height, width, dtypes, block_shapes, transform, bounds, crs, nodata=None,
+                 lonlat=None, pool=raster_pool):
+        self.name, self.height, self.width = name, height, width
+        self.dtypes, self.block_shapes = tuple(dtypes), [tuple(s) for s in block_shapes]
+        self.transform, self.bounds, self.crs, self.nodata = transform, bounds, crs, nodata
+        self.lonlat = tuple(lonlat) if lonlat is not None else lonlat_bounds(bounds, crs)
+        self.pool = pool
+
+    @classmethod
+    def load(cls, path, pool=raster_pool):
+        """Reads the header once; the handle is closed again straight away."""
+        with rasterio.open(path) as ds:
+            return cls(ds.name, ds.height, ds.width, ds.dtypes, ds.block_shapes, ds.transform,
+                       ds.bounds, ds.crs, ds.nodata, pool=pool)
+
+    def to_dict(self):
+        return {"name": self.name, "height": self.height, "width": self.width, "dtypes": list(self.dtypes),
+                "block_shapes": [list(s) for s in self.block_shapes], "transform": list(self.transform)[:6],
+                "bounds": list(self.bounds), "crs": self.crs.to_string() if self.crs else None,
+                "nodata": self.nodata, "lonlat": list(self.lonlat)}
+
+    @classmethod
+    def from_dict(cls, d, pool=raster_pool):
+        return cls(d["name"], d["height"], d["width"], d["dtypes"], d["block_shapes"], Affine(*d["transform"]),
+                   BoundingBox(*d["bounds"]), CRS.from_string(d["crs"]) if d["crs"] else None, d["nodata"],
+                   d["lonlat"], pool)
+
+    def index(self, x, y):
+        """(row, col) of the pixel containing (x, y), like DatasetReader.index."""
+        return rowcol(self.transform, x, y)
+
+    def read(self, *args, **kwargs):
+        with self.pool.dataset(self.name) as ds:
+            return ds.read(*args, **kwargs)
+
+    def __repr__(self):
+        return f"TileMeta({os.path.basename(self.name)!r}, {self.width}x{self.height})"
+
+
+_to_lonlat = {}  # CRS string -> Transformer (building one per tile is the slow part)
+
+def lonlat_bounds(bounds, crs):
+    """(west, south, east, north) of the tile's lower-left / upper-right corners in EPSG:4326."""
+    left, bottom, right, top = bounds
+    if crs is None or crs == "EPSG:4326": return (left, bottom, right, top)
+    key = crs.to_string()
+    transformer = _to_lonlat.get(key)
+    if transformer is None: transformer = _to_lonlat[key] = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+    min_lon, min_lat = transformer.transform(left, bottom)
+    max_lon, max_lat = transformer.transform(right, top)
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+def load_tile_metas(paths, manifest_path=TILE_MANIFEST, workers=STARTUP_WORKERS, pool=raster_pool, on_cached=None):
+    """
+    TileMeta for every path (same order), from the manifest where size and mtime still match,
+    opening the rest in parallel. on_cached(metas) is called with the cached ones before any
+    tile is opened. Returns (metas, {path: error}, {"cached", "opened"}); failed tiles are skipped.
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION: raise ValueError("old manifest")
+    except (OSError, ValueError):
+        manifest = {"version": MANIFEST_VERSION, "tiles": {}}
+    entries = manifest["tiles"]
+
+    found, errors, stamps, missing = {}, {}, {}, []
+    for path in paths:
+        try: st = os.stat(path)
+        except OSError as e:
+            errors[path] = str(e)
+            continue
+        stamps[path] = (st.st_size, st.st_mtime_ns)
+        entry = entries.get(path)
+        if entry and (entry.get("size"), entry.get("mtime_ns")) == stamps[path]:
+            try: found[path] = TileMeta.from_dict(entry["meta"], pool)
+            except (KeyError, TypeError, ValueError): missing.append(path)
+        else:
+            missing.append(path)
+    cached = len(found)
+    if on_cached is not None and found: on_cached([found[p] for p in paths if p in found])
+
+    def open_one(path):
+        try: return path, TileMeta.load(path, pool), None
+        except Exception as e: return path, None, f"{type(e).__name__}: {e}"
+
+    if missing:
+        with ThreadPoolExecutor(max(1, workers)) as executor:
+            for path, meta, error in executor.map(open_one, missing):
+                if meta is None: errors[path] = error
+                else: found[path] = meta
+
+    fresh = {p: {"size": stamps[p][0], "mtime_ns": stamps[p][1], "meta": found[p].to_dict()} for p in found}
+    if fresh != entries:
+        try:
+            os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+            with open(manifest_path + ".tmp", "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "tiles": fresh}, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+        except OSError as e:
+            print(f"Tile manifest not saved ({manifest_path}): {e}")
+    return [found[p] for p in paths if p in found], errors, {"cached": cached, "opened": len(found) - cached}
+
+
+if __name__ == "__main__":
+    # Hammer a small pool from many threads: handle count must stay bounded and reads correct
+    import sys
+    import time
+    import tempfile
+    import numpy as np
+    from glob import glob
+    from concurrent.futures import ThreadPoolExecutor
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    if folder is None:
+        folder = tempfile.mkdtemp(prefix="riverly_pool_")
+        for i in range(40):
+            with rasterio.open(os.path.join(folder, f"t{i:03d}.tif"), "w", driver="GTiff", height=64, width=64, count=1,
+                               dtype="float32", crs="EPSG:32644", transform=from_origin(i * 64, 64, 1, 1)) as ds:
+                ds.write(np.full((64, 64), i, dtype=np.float32), 1)
+    paths = sorted(glob(os.path.join(folder, "*.tif")))
+    pool = RasterPool(max_open=8)
+    tiles = [TileMeta.load(p, pool) for p in paths]
+    expected = [float(t.read(1, window=Window(0, 0, 1, 1))[0, 0]) for t in tiles]
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(tiles), 4000)
+    peak = [0]
+
+    def lookup(i):
+        value = float(tiles[i].read(1, window=Window(0, 0, 1, 1))[0, 0])
+        peak[0] = max(peak[0], pool.open_count)
+        return value == expected[i]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(16) as executor:
+        ok = all(executor.map(lookup, picks))
+    took = time.perf_counter() - started
+    print(f"{len(picks)} reads over {len(tiles)} tiles from 16 threads in {took:.2f}s: correct={ok}, "
+          f"peak open {peak[0]} (budget {pool.max_open}), {pool.stats()}")
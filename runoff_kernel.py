@@ -0,0 +1,116 @@
+#runoff_kernel.py
+import threading
+import numpy as np
+import metrics
+
+# CONFIGURATION
+ACTIVE_RUNOFF_MM = 5.0     # Points below this runoff are not drawn
+WARNING_RUNOFF_MM = 15.0   # status 1
+CRITICAL_RUNOFF_MM = 35.0  # status 2
+CHUNK_SIZE = 1 << 18       # Points per pass (keeps the work buffers cache-sized)
+
+
+class DistributedRunoffKernel:
+    """
+    Pure NumPy SCS-CN runoff over contiguous catchment columns.
+    Work buffers are preallocated per thread and reused on every call;
+    the only per-call allocations are the (small) active index lists.
+    """
+
+    def __init__(self, rain_weight, Ia, S, chunk_size=CHUNK_SIZE):
+        # Memory-mapped float32 columns are used as-is (no copy)
+        self.rain_weight = np.ascontiguousarray(rain_weight, dtype=np.float32)
+        self.Ia = np.ascontiguousarray(Ia, dtype=np.float32)
+        self.S = np.ascontiguousarray(S, dtype=np.float32)
+        self.size = len(self.rain_weight)
+        self.chunk_size = max(1, min(chunk_size, self.size or 1))
+        self._local = threading.local()
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        if store.empty: return cls(np.empty(0), np.empty(0), np.empty(0), **kwargs)
+        return cls(store['rain_weight'], store['Ia'], store['S'], **kwargs)
+
+    def _buffers(self):
+        bufs = getattr(self._local, "bufs", None)
+        if bufs is None:
+            n = self.chunk_size
+            bufs = (np.empty(n, np.float32), np.empty(n, np.float32), np.empty(n, np.float32), np.empty(n, np.bool_))
+            self._local.bufs = bufs
+        return bufs
+
+    def runoff_into(self, rain_mm, start, stop, excess, denom, runoff):
+        """Runoff (mm) for points [start, stop) written into runoff[:stop-start]."""
+        n = stop - start
+        excess, denom, runoff = excess[:n], denom[:n], runoff[:n]
+        # P - Ia, clipped at 0 (no runoff until initial abstraction is satisfied)
+        np.multiply(self.rain_weight[start:stop], np.float32(rain_mm), out=excess)
+        np.subtract(excess, self.Ia[start:stop], out=excess)
+        np.maximum(excess, 0, out=excess)
+        # Q = (P - Ia)^2 / (P - Ia + S)
+        np.add(excess, self.S[start:stop], out=denom)
+        np.multiply(excess, excess, out=runoff)
+        np.divide(runoff, denom, out=runoff)
+        return runoff
+
+    def run(self, rain_mm, max_points=None, rng=None):
+        """
+        Returns (point_ids, runoff_mm, status) for active points (runoff > 5 mm).
+        With max_points, a uniform subset is drawn on indices before any per-point
+        values are gathered: by a fixed hash of the point id (stable_sample) unless an
+        rng is given, so the map keeps the same points while the rain barely changes.
+        """
+        empty = (np.empty(0, np.int64), np.empty(0, np.float32), np.empty(0, np.int8))
+        if self.size == 0 or rain_mm <= 0: return empty
+
+        excess, denom, runoff, mask = self._buffers()
+        active = []
+        # Single mask pass over the points, one cache-sized chunk at a time
+        with np.errstate(invalid="ignore", divide="ignore"):  # CN=100 gives 0/0 -> NaN -> inactive
+            for start in range(0, self.size, self.chunk_size):
+                stop = min(start + self.chunk_size, self.size)
+                chunk_runoff = self.runoff_into(rain_mm, start, stop, excess, denom, runoff)
+                chunk_mask = np.greater(chunk_runoff, ACTIVE_RUNOFF_MM, out=mask[:stop - start])
+                hits = np.flatnonzero(chunk_mask)
+                if len(hits): active.append(hits + start)
+        if not active: return empty
+        point_ids = np.concatenate(active) if len(active) > 1 else active[0]
+
+        if max_points is not None and len(point_ids) > max_points:
+            with metrics.span("sampling"):
+                if rng is not None: point_ids = np.sort(rng.choice(point_ids, size=max_points, replace=False))
+                else: point_ids = stable_sample(point_ids, max_points)
+
+        # Recompute runoff for the selected points only (same operation order as the pass above)
+        runoff_mm, status = self.runoff_at(rain_mm, point_ids)
+        return point_ids, runoff_mm, status
+
+    def runoff_at(self, rain_mm, point_ids):
+        """(runoff_mm, status) for the given point ids only (gathered, no full pass)."""
+        excess = self.rain_weight[point_ids] * np.float32(rain_mm) - self.Ia[point_ids]
+        np.maximum(excess, 0, out=excess)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            runoff_mm = excess * excess / (excess + self.S[point_ids])
+        return runoff_mm, classify_runoff(runoff_mm)
+
+
+def stable_sample(point_ids, k):
+    """
+    The k ids with the smallest Fibonacci hash (bottom-k sampling): uniform over the ids,
+    yet the same id is picked on every call it is active, so consecutive ticks share
+    their points and compact deltas stay small. Returned sorted.
+    """
+    return np.sort(point_ids[np.argpartition(hash_rank(point_ids), k - 1)[:k]])
+
+
+def hash_rank(point_ids):
+    """Fixed pseudo-random rank (uint64 < 2**32) of each point id (Fibonacci hashing)."""
+    return (np.asarray(point_ids).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+
+
+def classify_runoff(runoff_mm):
+    """0 = Normal, 1 = Warning (>15 mm), 2 = Critical (>35 mm)."""
+    status = np.zeros(len(runoff_mm), dtype=np.int8)
+    status[runoff_mm > WARNING_RUNOFF_MM] = 1
+    status[runoff_mm > CRITICAL_RUNOFF_MM] = 2
+    return status
@@ -1,56 +1,225 @@
 #scan_risk.py
 import rasterio
 import json
+import struct
+import hashlib
+import argparse
 import numpy as np
 from glob import glob
 from rasterio.warp import transform
+from concurrent.futures import ProcessPoolExecutor
 import os
+import time
+from raster_cache import row_strip_windows
 
 # CONFIGURATION
 TILE_FOLDER = "tiles"
 RISK_THRESHOLD = 296.0  # Meters (Elevation of Har Ki Pauri Banks)
 SAMPLE_STEP = 100 # Check every 100th point (Optimization for speed)
+OUTPUT_JSON = "frontend/public/death_zones.json"
+OUTPUT_BIN = "frontend/public/death_zones.bin"
+SCAN_CACHE = "risk_cache"   # Manifest + one partial result per scanned tile
+MANIFEST_VERSION = 1
 
-risk_points = []
-print("Scanning LiDAR Geometry for Death Zones...")
+# Binary Danger Zone Format (little-endian), ~8 bytes per point vs ~40 in JSON
+#   [8 bytes]  magic  b"RVZONES1"
+#   [4 bytes]  point count (uint32)
+#   [........] count x (lon, lat) float32 pairs
+# In the browser: new Float32Array(buffer, 12, count * 2)
+BIN_MAGIC = b"RVZONES1"
 
-tif_files = glob(os.path.join(TILE_FOLDER, "*.tif"))
 
-for tif_path in tif_files:
-    try:
-        with rasterio.open(tif_path) as ds:
-            data = ds.read(1)
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1 << 22)
+            if not chunk: break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan_tile(tif_path, threshold=RISK_THRESHOLD, step=SAMPLE_STEP):
+    """
+    Low-lying pixels of one tile as an (n, 2) float64 [lon, lat] array.
+    Reads one strip at a time; the sampling phase carries across strips, so the
+    result equals a whole-band np.where(...)[::step].
+    """
+    chunks, seen = [], 0
+    with rasterio.open(tif_path) as ds:
+        for window in row_strip_windows(ds):
+            data = ds.read(1, window=window)
             # Find low-lying pixels
-            low_areas = np.where((data > 0) & (data < RISK_THRESHOLD))
-            
+            low = np.flatnonzero((data > 0) & (data < threshold))
             # Subsample points
-            rows = low_areas[0][::SAMPLE_STEP]
-            cols = low_areas[1][::SAMPLE_STEP]
-            
-            if len(rows) > 0:
-                # Convert to GPS Coordinates
-                xs, ys = rasterio.transform.xy(ds.transform, rows, cols)
-                if ds.crs != 'EPSG:4326':
-                    lons, lats = transform(ds.crs, 'EPSG:4326', xs, ys)
-                else:
-                    lons, lats = xs, ys
-                
-                for lat, lon in zip(lats, lons):
-                    risk_points.append([lon, lat])
-    except:
+            picks = low[(-seen) % step::step]
+            seen += len(low)
+            if len(picks) == 0: continue
+
+            # Convert to GPS Coordinates (pixel centres)
+            rows, cols = np.divmod(picks, window.width)
+            xs, ys = ds.transform * (cols + 0.5, rows + window.row_off + 0.5)
+            if ds.crs != 'EPSG:4326':
+                lons, lats = transform(ds.crs, 'EPSG:4326', xs, ys)
+            else:
+                lons, lats = xs, ys
+            chunks.append(np.column_stack([lons, lats]))
+    return np.concatenate(chunks) if chunks else np.empty((0, 2))
+
+
+def _scan_job(job):
+    tif_path, part_path, threshold, step = job
+    try:
+        points = scan_tile(tif_path, threshold, step)
+    except Exception as e:
+        return tif_path, e
+    tmp = part_path + ".tmp.npy"
+    np.save(tmp, points)
+    os.replace(tmp, part_path)
+    return tif_path, len(points)
+
+
+# --- MANIFEST ---
+# {"version": 1, "tiles": {"<tile file>": {"sha256", "size", "mtime_ns", "threshold", "step", "points", "part"}}}
+
+def load_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION: return manifest
+    except (OSError, ValueError):
         pass
+    return {"version": MANIFEST_VERSION, "tiles": {}}
+
+
+def save_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def tile_fingerprint(tif_path, previous, rehash=False):
+    """sha256 of the tile. Re-hashing is skipped when size and mtime match the manifest."""
+    st = os.stat(tif_path)
+    if not rehash and previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return previous["sha256"], st
+    return file_hash(tif_path), st
+
+
+# --- OUTPUTS ---
+
+def write_json(path, parts):
+    """Same FeatureCollection / MultiPoint layout as before, streamed part by part."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write('{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": {"type": "MultiPoint", "coordinates": [')
+        first = True
+        for points in parts:
+            if len(points) == 0: continue
+            if not first: f.write(", ")
+            f.write(json.dumps(points.tolist())[1:-1])
+            first = False
+        f.write(']}}]}')
+    os.replace(tmp, path)
+
+
+def write_bin(path, parts):
+    tmp = path + ".tmp"
+    count = sum(len(points) for points in parts)
+    with open(tmp, "wb") as f:
+        f.write(BIN_MAGIC)
+        f.write(struct.pack("<I", count))
+        for points in parts:
+            f.write(points.astype("<f4").tobytes())
+    os.replace(tmp, path)
+
+
+def read_bin(path):
+    """(n, 2) float32 [lon, lat] array from a death_zones.bin file."""
+    with open(path, "rb") as f:
+        if f.read(len(BIN_MAGIC)) != BIN_MAGIC: raise ValueError(f"{path} is not a danger zone file")
+        (count,) = struct.unpack("<I", f.read(4))
+        return np.frombuffer(f.read(count * 8), dtype="<f4").reshape(count, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan LiDAR tiles for low-lying danger zones (incremental).")
+    parser.add_argument("--threshold", type=float, default=RISK_THRESHOLD, help="Elevation (m) below which a pixel is at risk")
+    parser.add_argument("--step", type=int, default=SAMPLE_STEP, help="Keep every Nth low-lying pixel")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Tiles scanned in parallel")
+    parser.add_argument("--format", choices=["json", "bin", "both"], default="json",
+                        help="json: death_zones.json (GeoJSON); bin: compact death_zones.bin (float32 pairs)")
+    parser.add_argument("--rehash", action="store_true", help="Hash every tile even if size/mtime are unchanged")
+    parser.add_argument("--force", action="store_true", help="Rescan every tile")
+    args = parser.parse_args()
+
+    print("Scanning LiDAR Geometry for Death Zones...")
+    started = time.perf_counter()
+    os.makedirs(SCAN_CACHE, exist_ok=True)
+    manifest = load_manifest(SCAN_CACHE)
+    old_tiles = manifest["tiles"]
+
+    tif_files = glob(os.path.join(TILE_FOLDER, "*.tif"))
+    new_tiles, jobs = {}, []
+    for tif_path in tif_files:
+        name = os.path.basename(tif_path)
+        previous = old_tiles.get(name)
+        try:
+            digest, st = tile_fingerprint(tif_path, previous, args.rehash)
+        except OSError as e:
+            print(f"Skipped {name}: {e}")
+            continue
+        # Parts are keyed by content + settings, so a renamed or restored tile is reused too
+        part = f"{digest[:20]}_{args.threshold:g}_{args.step}.npy"
+        entry = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                 "threshold": args.threshold, "step": args.step, "part": part}
+        cached = os.path.exists(os.path.join(SCAN_CACHE, part))
+        if cached and not args.force:
+            entry["points"] = len(np.load(os.path.join(SCAN_CACHE, part), mmap_mode="r"))
+        else:
+            jobs.append((tif_path, os.path.join(SCAN_CACHE, part), args.threshold, args.step))
+        new_tiles[name] = entry
+
+    print(f"{len(tif_files)} tiles: {len(jobs)} to scan, {len(tif_files) - len(jobs)} unchanged.")
+    if len(jobs) > 1 and args.workers > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            results = list(pool.map(_scan_job, jobs))
+    else:
+        results = [_scan_job(job) for job in jobs]
+    for tif_path, outcome in results:
+        name = os.path.basename(tif_path)
+        if isinstance(outcome, Exception):
+            print(f"Skipped {name}: {outcome}")
+            new_tiles.pop(name, None)
+            continue
+        new_tiles[name]["points"] = outcome
+        print(f"   {name}: {outcome} points")
+
+    outputs = {"json": [OUTPUT_JSON], "bin": [OUTPUT_BIN], "both": [OUTPUT_JSON, OUTPUT_BIN]}[args.format]
+    if not jobs and new_tiles == old_tiles and all(os.path.exists(p) for p in outputs):
+        print(f"Up to date ({time.perf_counter() - started:.1f}s).")
+        return
+
+    # Merge partial results in tile order (memory-mapped, nothing is rescanned)
+    parts = [np.load(os.path.join(SCAN_CACHE, new_tiles[os.path.basename(p)]["part"]), mmap_mode="r")
+             for p in tif_files if os.path.basename(p) in new_tiles]
+    if OUTPUT_JSON in outputs: write_json(OUTPUT_JSON, parts)
+    if OUTPUT_BIN in outputs: write_bin(OUTPUT_BIN, parts)
+    total = sum(len(points) for points in parts)
+    del parts
+
+    manifest["tiles"] = new_tiles
+    save_manifest(SCAN_CACHE, manifest)
+    # Drop parts no tile refers to any more (removed tiles, old thresholds)
+    live = {entry["part"] for entry in new_tiles.values()}
+    for name in os.listdir(SCAN_CACHE):
+        if name.endswith(".npy") and name not in live:
+            try: os.remove(os.path.join(SCAN_CACHE, name))
+            except OSError: pass
 
-# Save to Frontend Public Folder
-output = {
-    "type": "FeatureCollection",
-    "features": [{
-        "type": "Feature",
-        "geometry": { "type": "MultiPoint", "coordinates": risk_points }
-    }]
-}
+    print(f"Found {total} Danger Points in {time.perf_counter() - started:.1f}s. Saved to {', '.join(outputs)}")
 
-# SAVE PATH: Adjust if your folder is named differently
-with open("frontend/public/death_zones.json", "w") as f:
-    json.dump(output, f)
 
-print(f"Found {len(risk_points)} Danger Points. Saved to frontend/public/death_zones.json")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
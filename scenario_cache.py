@@ -0,0 +1,65 @@
+#scenario_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+# CONFIGURATION
+SCENARIO_CACHE_SIZE = int(os.environ.get("RIVERLY_SCENARIO_CACHE_SIZE", 512))
+
+# Quantization steps for simulation inputs (match the dashboard sliders)
+RAIN_STEP = 0.1     # mm
+SOIL_STEP = 0.001   # volumetric fraction
+DAM_STEP = 1.0      # cusecs
+
+
+def quantize(value, step):
+    return round(round(float(value) / step) * step, 6)
+
+
+class ScenarioCache:
+    """LRU memo of fully computed simulation results, with hit/miss counters."""
+
+    def __init__(self, max_entries=SCENARIO_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        result = compute()
+
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def purge(self, match):
+        """Drops the entries whose key match(key) accepts (e.g. an unloaded basin's); returns how many."""
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys: del self._entries[key]
+        return len(keys)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "max_entries": self.max_entries,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
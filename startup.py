@@ -0,0 +1,103 @@
+#startup.py
+# Background startup: heavy resources (model, LiDAR tile metadata, catchment store) load in
+# parallel threads while the server is already answering. Routes that need a resource that
+# is still loading get 503 + Retry-After; /ready reports every component with its state,
+# load time and error, and /health answers as soon as the process is up.
+#
+#   startup.add("model", load_model_fn)     # fn returns a dict of details (or None)
+#   startup.start()
+#   startup.ready("model")                  # True once loaded, missing or failed
+import time
+import threading
+from collections import OrderedDict
+import metrics
+
+PENDING, LOADING, READY, MISSING, FAILED = "pending", "loading", "ready", "missing", "failed"
+DONE = (READY, MISSING, FAILED)   # Missing / failed components leave the app on its fallbacks
+
+
+class Startup:
+    """Named components loaded on their own threads, with per-component state, timing and errors."""
+
+    def __init__(self):
+        self._components = OrderedDict()   # name -> {"load", "state", "seconds", "error", "details"}
+        self._cond = threading.Condition()
+        self.started = time.time()
+
+    def add(self, name, load=None):
+        """Registers a component. Without a loader it is a milestone that another loader finish()es."""
+        with self._cond:
+            self._components[name] = {"load": load, "state": PENDING, "seconds": None, "error": None, "details": {}}
+
+    def start(self):
+        """Starts every registered loader on a daemon thread (call once, before any fork)."""
+        for name, component in self._components.items():
+            if component["load"] is None: continue
+            threading.Thread(target=self._run, args=(name,), name=f"startup-{name}", daemon=True).start()
+
+    def run_all(self):
+        """Loads every component in the calling thread, one after another (scripts, tests)."""
+        for name, component in self._components.items():
+            if component["load"] is not None: self._run(name)
+
+    def _run(self, name):
+        component = self._components[name]
+        with self._cond:
+            if component["state"] != PENDING: return
+            component["state"] = LOADING
+        started = time.perf_counter()
+        state, error, details = READY, None, None
+        try:
+            details = component["load"]()
+        except FileNotFoundError as e:
+            state, error = MISSING, str(e)
+            metrics.count(f"{name}_missing")
+        except Exception as e:
+            state, error = FAILED, f"{type(e).__name__}: {e}"
+            metrics.count(f"{name}_load_error")
+        seconds = time.perf_counter() - started
+        if error: print(f"Startup: {name} {state} after {seconds:.2f}s: {error}")
+        else: print(f"Startup: {name} ready in {seconds:.2f}s")
+        self.finish(name, state, error, seconds, **(details or {}))
+
+    def finish(self, name, state=READY, error=None, seconds=None, **details):
+        """Marks a component (or milestone) done; later calls only add details."""
+        with self._cond:
+            component = self._components[name]
+            if component["state"] not in DONE:
+                component["state"], component["error"] = state, error
+                component["seconds"] = seconds if seconds is not None else time.time() - self.started
+            component["details"].update(details)
+            self._cond.notify_all()
+
+    def ready(self, *names):
+        """True when the named components (all if none are named) are done loading."""
+        with self._cond:
+            return all(c["state"] in DONE for n, c in self._components.items() if not names or n in names)
+
+    def pending(self, *names):
+        with self._cond:
+            return [n for n, c in self._components.items() if (not names or n in names) and c["state"] not in DONE]
+
+    def wait(self, timeout=None, *names):
+        """Blocks until the named (or all) components are done. Returns ready()."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not all(c["state"] in DONE for n, c in self._components.items() if not names or n in names):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0: return False
+                self._cond.wait(remaining)
+        return True
+
+    def status(self):
+        """/ready payload: overall status ("loading", "ready" or "degraded") and every component."""
+        with self._cond:
+            components = {name: {"state": c["state"],
+                                 "seconds": round(c["seconds"], 3) if c["seconds"] is not None else None,
+                                 "error": c["error"], **c["details"]}
+                          for name, c in self._components.items()}
+        states = [c["state"] for c in components.values()]
+        if any(s not in DONE for s in states): overall = "loading"
+        elif all(s == READY for s in states): overall = "ready"
+        else: overall = "degraded"
+        return {"status": overall, "uptime_seconds": round(time.time() - self.started, 1), "components": components}
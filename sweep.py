@@ -0,0 +1,123 @@
+#sweep.py
+# Scenario sweeps: every combination of rain x soil moisture x dam release x antecedent rain
+# through the same engines as app.run_scenario (hydrology.py: SCS-CN discharge, lag time, impact,
+# rule risk; plus the risk model), as whole-grid array calls and batched model inference.
+#
+#   table = sweep(rain=[0, 50, 100], soil_moisture=[0.2, 0.4], dam_release=[0], past_rain_sum=[0, 120],
+#                 base_flow=45000, model=load_model())
+import os
+import numpy as np
+from hydrology import scs_cn_discharge, calculate_lag_time, calculate_impact, rule_risk
+from scenario_cache import quantize, RAIN_STEP, SOIL_STEP, DAM_STEP
+
+# CONFIGURATION
+SWEEP_MAX_SCENARIOS = int(os.environ.get("RIVERLY_SWEEP_MAX_SCENARIOS", 100_000))  # Request cap
+MODEL_CHUNK_ROWS = 8192      # Rows per model traversal (bounds the (rows x trees) work arrays)
+
+# Sweep axis -> (quantization step, allowed range). Steps match the dashboard sliders.
+AXES = {
+    "rain": (RAIN_STEP, 0.0, 2000.0),                # mm
+    "soil_moisture": (SOIL_STEP, 0.0, 1.0),          # volumetric fraction
+    "dam_release": (DAM_STEP, 0.0, 500000.0),        # cusecs
+    "past_rain_sum": (RAIN_STEP, 0.0, 10000.0),      # mm over the last 5 days
+}
+COLUMNS = ("total_discharge_cusecs", "risk_level", "confidence", "impact_people", "impact_crops", "lag_time_hours")
+
+
+def axis_values(spec, name):
+    """
+    Sorted, de-duplicated values of one axis from "start:stop:step" (stop included),
+    "a,b,c" or a single number, quantized like the simulator inputs. Raises ValueError.
+    """
+    step_q, low, high = AXES[name]
+    text = str(spec).strip()
+    try:
+        if ":" in text:
+            parts = [float(p) for p in text.split(":")]
+            if len(parts) != 3 or parts[2] <= 0: raise ValueError()
+            start, stop, step = parts
+            if (stop - start) / step > SWEEP_MAX_SCENARIOS: raise ValueError()
+            values = start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+        else:
+            values = np.array([float(p) for p in text.split(",")])
+    except ValueError:
+        raise ValueError(f"{name} must be start:stop:step (step > 0), a comma list or a number")
+    if len(values) == 0 or not np.isfinite(values).all(): raise ValueError(f"{name} has no values")
+    if values.min() < low or values.max() > high: raise ValueError(f"{name} must be within {low:g}-{high:g}")
+    return np.unique([quantize(v, step_q) for v in values])
+
+
+def classify(model, features):
+    """(risk class, confidence %) per row: batched model traversal, or the discharge rule without a model."""
+    if model is not None:
+        try:
+            risk, confidence = np.empty(len(features), dtype=np.int64), np.empty(len(features))
+            for start in range(0, len(features), MODEL_CHUNK_ROWS):
+                rows = slice(start, start + MODEL_CHUNK_ROWS)
+                risk[rows], confidence[rows] = model.predict_with_confidence(features[rows])
+            return risk, np.round(confidence * 100, 1)
+        except Exception as e:
+            print(f"Sweep model inference failed, using the discharge rule: {e}")
+    return rule_risk(features[:, 4]), np.zeros(len(features))
+
+
+def sweep(rain, soil_moisture, dam_release, past_rain_sum, base_flow, snow_depth=0.0, model=None):
+    """
+    Evaluates the full grid of the four axes (C order: rain slowest, past_rain_sum fastest).
+    Returns {"axes", "shape", "count", "columns"}: one flat list per output column.
+    """
+    axes = {"rain": rain, "soil_moisture": soil_moisture, "dam_release": dam_release, "past_rain_sum": past_rain_sum}
+    axes = {name: np.atleast_1d(np.asarray(values, dtype=np.float64)) for name, values in axes.items()}
+    shape = tuple(len(v) for v in axes.values())
+    count = int(np.prod(shape))
+    if count > SWEEP_MAX_SCENARIOS: raise ValueError(f"{count} scenarios requested (max {SWEEP_MAX_SCENARIOS})")
+
+    rain_g, soil_g, dam_g, past_g = (g.ravel() for g in np.meshgrid(*axes.values(), indexing="ij"))
+    discharge = scs_cn_discharge(rain_g, past_g, dam_g, base_flow)
+    people, crops = calculate_impact(discharge)
+    lag = calculate_lag_time(rain_g, soil_g)
+    # Same feature order as run_scenario: rain, soil moisture, snow depth, past rain, discharge
+    features = np.column_stack([rain_g, soil_g, np.full(count, float(snow_depth)), past_g, discharge])
+    risk, confidence = classify(model, features)
+
+    return {
+        "axes": {name: values.tolist() for name, values in axes.items()},
+        "shape": list(shape),
+        "count": count,
+        "columns": {
+            "total_discharge_cusecs": discharge.tolist(),
+            "risk_level": risk.tolist(),
+            "confidence": confidence.tolist(),
+            "impact_people": people.tolist(),
+            "impact_crops": crops.tolist(),
+            "lag_time_hours": lag.tolist(),
+        },
+    }
+
+
+if __name__ == "__main__":
+    # Grid results == scalar (per-request) calls of the same engines + a 10,000-scenario timing
+    import time
+    from inference import load_model, MODEL_PATH
+
+    model = load_model() if os.path.exists(MODEL_PATH) else None
+    axes = dict(rain=axis_values("0:250:2.5", "rain"), soil_moisture=axis_values("0.05:0.5:0.05", "soil_moisture"),
+                dam_release=axis_values("0,5000,20000", "dam_release"), past_rain_sum=axis_values("0:300:100", "past_rain_sum"))
+    started = time.perf_counter()
+    table = sweep(**axes, base_flow=45000, snow_depth=0.0, model=model)
+    took = time.perf_counter() - started
+
+    cols, mismatches = table["columns"], 0
+    grid = np.meshgrid(*(np.asarray(v) for v in table["axes"].values()), indexing="ij")
+    for i, (r, s, d, p) in enumerate(zip(*(g.ravel().tolist() for g in grid))):
+        q = scs_cn_discharge(r, p, d, 45000)
+        mismatches += (cols["total_discharge_cusecs"][i] != q or cols["lag_time_hours"][i] != calculate_lag_time(r, s)
+                       or (cols["impact_people"][i], cols["impact_crops"][i]) != calculate_impact(q))
+    if model is not None:
+        sample = np.random.default_rng(0).choice(table["count"], 200, replace=False)
+        for i in sample.tolist():
+            r, s, d, p = (g.ravel()[i] for g in grid)
+            expected = model.predict_one([[r, s, 0.0, p, cols["total_discharge_cusecs"][i]]])
+            mismatches += (cols["risk_level"][i], cols["confidence"][i]) != expected
+    print(f"{table['count']} scenarios {table['shape']} in {took * 1000:.1f} ms "
+          f"({'model' if model is not None else 'rule-based risk'}), {mismatches} mismatches vs scalar calls")
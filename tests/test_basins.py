@@ -0,0 +1,49 @@
+# A slow shared load (a model file several basins use) must not stall the other basins' requests
+import threading
+import time
+from basins import BasinConfig, BasinRegistry
+
+
+class Model:
+    pass
+
+
+def registry():
+    reg = BasinRegistry([BasinConfig("haridwar"), BasinConfig("rishikesh")], "haridwar")
+    reg.on_reset(lambda basin: {})
+    return reg
+
+
+def test_shared_build_runs_outside_the_registry_lock():
+    reg, building, release = registry(), threading.Event(), threading.Event()
+
+    def slow_build():
+        building.set()
+        release.wait(5)
+        return Model()
+
+    loader = threading.Thread(target=reg.shared, args=(("model", "x"), slow_build))
+    loader.start()
+    assert building.wait(5)
+    started = time.perf_counter()
+    assert reg.ready(reg.default)   # No components registered: ready at once
+    assert reg.enforce() == []
+    assert reg.shared(("model", "y"), Model) is not None
+    assert time.perf_counter() - started < 0.5
+    release.set()
+    loader.join(5)
+
+
+def test_shared_builds_once_per_key():
+    reg, builds, model = registry(), [], Model()
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return model
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(reg.shared(("model", "x"), build))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join(5)
+    assert len(builds) == 1 and all(r is model for r in results)
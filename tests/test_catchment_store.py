@@ -0,0 +1,79 @@
+# The .bin catchment format must read back exactly what was written, however it was written
+import os
+import numpy as np
+import pytest
+from catchment_store import (CatchmentStore, CatchmentWriter, SCHEMA, ALIGN, compute_physics, load_catchment,
+                             write_catchment)
+
+
+def columns(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "lat": rng.uniform(29.9, 30.3, n), "lon": rng.uniform(78.0, 78.6, n),
+        "elevation": rng.uniform(285, 900, n), "rain_weight": rng.choice([1.0, 1.2], n),
+        "cn": rng.choice([70, 90], n), "flow_length": rng.uniform(0, 80000, n),
+    }
+
+
+def assert_same(store, expected):
+    for name, values in expected.items():
+        assert store[name].dtype == np.dtype(SCHEMA[name])
+        assert np.array_equal(store[name], np.asarray(values, dtype=SCHEMA[name]))
+
+
+def test_write_and_open_round_trip(tmp_path):
+    data = columns(1000)
+    path = str(tmp_path / "catchment_points.bin")
+    write_catchment(path, data)
+    store = CatchmentStore.open(path)
+    assert isinstance(store["lat"], np.memmap) and len(store) == 1000
+    assert_same(store, data)
+    S, Ia = compute_physics(data["cn"])
+    assert_same(store, {"S": S, "Ia": Ia})
+    assert os.path.getsize(path) % ALIGN == 0 and not os.path.exists(path + ".tmp")
+
+
+def test_writer_spills_chunks_into_one_file(tmp_path):
+    data = columns(2500, seed=1)
+    path = str(tmp_path / "catchment_points.bin")
+    writer = CatchmentWriter(path)
+    for start in range(0, 2500, 700):   # Uneven last chunk
+        writer.append({name: values[start:start + 700] for name, values in data.items()})
+    writer.append({name: values[:0] for name, values in data.items()})
+    writer.close()
+    assert_same(CatchmentStore.open(path), data)
+    assert os.listdir(tmp_path) == ["catchment_points.bin"]   # Spill files removed
+
+
+def test_empty_store_and_abort(tmp_path):
+    path = str(tmp_path / "empty.bin")
+    CatchmentWriter(path).close()
+    store = CatchmentStore.open(path)
+    assert store.empty and store["cn"].dtype == np.uint8
+    aborted = CatchmentWriter(str(tmp_path / "aborted.bin"))
+    aborted.append(columns(10))
+    aborted.abort()
+    assert os.listdir(tmp_path) == ["empty.bin"]
+
+
+def test_csv_fallback_matches_the_binary_store(tmp_path):
+    data = columns(500, seed=2)
+    data.pop("flow_length")
+    bin_path, csv_path = str(tmp_path / "catchment_points.bin"), str(tmp_path / "catchment_points.csv")
+    write_catchment(bin_path, data)
+    CatchmentStore.open(bin_path).to_csv(csv_path)
+    os.remove(bin_path)
+    store = load_catchment(bin_path, csv_path=csv_path)
+    assert store.path is None and len(store) == 500
+    S, Ia = compute_physics(data["cn"])
+    assert_same(store, {"rain_weight": data["rain_weight"], "cn": data["cn"], "S": S, "Ia": Ia})
+    assert np.allclose(store["lat"], data["lat"], atol=1e-5) and np.allclose(store["elevation"], data["elevation"], atol=0.01)
+    with pytest.raises(FileNotFoundError):
+        load_catchment(str(tmp_path / "missing.bin"), csv_path=str(tmp_path / "missing.csv"))
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_store.bin"
+    path.write_bytes(b"id,lat,lon\n")
+    with pytest.raises(ValueError):
+        CatchmentStore.open(str(path))
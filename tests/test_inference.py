@@ -0,0 +1,88 @@
+# FlatForest must give scikit-learn's classes and probabilities bit for bit
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from inference import (FlatForest, FEATURES, MODEL_PATH, SKLEARN_BATCH_ROWS, load_model, sample_features, sklearn_before,
+                       threshold_rows)
+
+
+def synthetic_forest(seed=0):
+    """Small 3-class forest fitted on a DataFrame, like train_flood_ai.py."""
+    X = sample_features(3000, seed=seed)
+    discharge = X[:, 4] + 400 * X[:, 0] + 150 * X[:, 3]
+    y = np.where(discharge > 250000, 2, np.where(discharge > 120000, 1, 0))
+    forest = RandomForestClassifier(n_estimators=25, max_depth=10, random_state=seed)
+    forest.fit(pd.DataFrame(X, columns=FEATURES), y)
+    return FlatForest(forest)
+
+
+FORESTS = {"synthetic": synthetic_forest}
+if os.path.exists(MODEL_PATH):
+    FORESTS["flood_model"] = load_model
+
+
+@pytest.fixture(scope="module", params=sorted(FORESTS))
+def flat(request):
+    return FORESTS[request.param]()
+
+
+def sklearn_proba(flat, X):
+    return flat.estimator.predict_proba(pd.DataFrame(X, columns=FEATURES))
+
+
+def edge_rows(flat):
+    """Split thresholds exactly, one float32 step either side, zeros and extremes."""
+    base = threshold_rows(flat, sample_features(100, seed=3))
+    up, down = base.copy(), base.copy()
+    rows = np.arange(len(base))
+    values = base[rows, flat.feature].astype(np.float32)
+    up[rows, flat.feature] = np.nextafter(values, np.float32(np.inf))
+    down[rows, flat.feature] = np.nextafter(values, np.float32(-np.inf))
+    extremes = np.array([[0.0] * 5, [1e6] * 5, [-1.0] * 5, [500.0, 1.0, 50.0, 2000.0, 1e6]])
+    return np.vstack([base, up, down, extremes])
+
+
+@pytest.mark.parametrize("rows", ["random", "edges", "single"])
+def test_matches_sklearn(flat, rows):
+    X = {"random": sample_features(SKLEARN_BATCH_ROWS - 1, seed=7), "edges": edge_rows(flat),
+         "single": sample_features(1, seed=11)}[rows]
+    expected = sklearn_proba(flat, X)
+    proba = flat.predict_proba(X, max_flat_rows=None)
+    assert np.array_equal(proba, expected)
+    classes, confidence = flat.predict_with_confidence(X[:SKLEARN_BATCH_ROWS - 1])
+    assert np.array_equal(classes, flat.estimator.predict(pd.DataFrame(X[:SKLEARN_BATCH_ROWS - 1], columns=FEATURES)))
+    assert np.array_equal(confidence, expected[:SKLEARN_BATCH_ROWS - 1].max(axis=1))
+
+
+def test_predict_one(flat):
+    for row in sample_features(50, seed=5):
+        expected = sklearn_proba(flat, row[None, :])[0]
+        best = int(np.argmax(expected))
+        assert flat.predict_one([row]) == (int(flat.classes_[best]), round(float(expected[best]) * 100, 1))
+
+
+def test_large_batches_use_sklearn(flat):
+    X = sample_features(SKLEARN_BATCH_ROWS + 10, seed=9)
+    assert np.array_equal(flat.predict_proba(X), sklearn_proba(flat, X))
+    assert np.array_equal(flat.predict_proba(X), flat.predict_proba(X, max_flat_rows=None))
+
+
+def test_rejects_bad_input(flat):
+    with pytest.raises(ValueError):
+        flat.predict_proba([[np.nan, 0.2, 0.0, 10.0, 50000.0]])
+    with pytest.raises(ValueError):
+        flat.predict_proba([[1.0, 2.0]])
+
+
+def test_memory_charge_includes_the_sklearn_trees(flat):
+    node_arrays = sum(a.nbytes for a in (flat.feature, flat.threshold, flat.left, flat.leaf_proba, flat.roots))
+    trees = sum(est.tree_.value.nbytes for est in flat.estimator.estimators_)
+    assert flat.nbytes() >= node_arrays + trees
+
+
+@pytest.mark.parametrize("version, older", [("1.3.2", True), ("1.4.0", False), ("1.6rc1", False), ("1.3.dev0", True),
+                                             ("2.0", False), ("nightly", False)])
+def test_sklearn_version_parsing(version, older):
+    assert sklearn_before(1, 4, version) is older
@@ -0,0 +1,43 @@
+# Pre-rendered and in-memory tiles belong to one terrain: new LiDAR or another base level never reuses them
+import os
+import numpy as np
+from inundation import InundationTiles, EMPTY_PNG, get_water_surface_elevation, level_key, tiles_covering
+
+BOX = (78.1, 29.9, 78.2, 30.0)   # LiDAR footprint near Haridwar
+TILE = (14, *tiles_covering(BOX, 14)[0])
+LEVEL = level_key(get_water_surface_elevation(45000))
+
+
+def flat(level):
+    return lambda lats, lons: (np.full(len(lats), level),)
+
+
+def engine(tmp_path, lidar, base_level=292.5, elevation=293.0):
+    tiles = InundationTiles(flat(elevation), [], str(tmp_path / "cache"), base_level)
+    tiles.set_terrain([BOX], [str(lidar)])
+    return tiles
+
+
+def test_prerendered_tiles_are_keyed_on_the_terrain(tmp_path):
+    lidar = tmp_path / "a.tif"
+    lidar.write_bytes(b"v1")
+    old = engine(tmp_path, lidar)
+    assert old.prerender([45000], [14], log=lambda m: None) > 0
+    assert os.path.exists(old.tile_path(LEVEL, *TILE))
+
+    os.utime(lidar, ns=(0, 10 ** 9))   # Tile replaced
+    assert not os.path.exists(engine(tmp_path, lidar).tile_path(LEVEL, *TILE))
+    assert not os.path.exists(engine(tmp_path, lidar, base_level=337.0).tile_path(LEVEL, *TILE))
+    assert engine(tmp_path, lidar).terrain != old.terrain
+
+
+def test_new_terrain_drops_cached_tiles(tmp_path):
+    lidar = tmp_path / "a.tif"
+    lidar.write_bytes(b"v1")
+    tiles = engine(tmp_path, lidar)
+    assert tiles.get_tile(LEVEL, *TILE) is not EMPTY_PNG
+    tiles.elevation_lookup = flat(400.0)   # Terrain far above the water
+    lidar.write_bytes(b"v2!")
+    tiles.set_terrain([BOX], [str(lidar)])
+    assert tiles.get_tile(LEVEL, *TILE) is EMPTY_PNG
+    assert f"?v={tiles.terrain}&basin=x" in tiles.url_template(45000, "?basin=x")
@@ -0,0 +1,12 @@
+# A WSGI subscriber holds a thread: its stream must end on time, and leave the feed when it does
+import time
+from live_feed import LiveFeed
+
+
+def test_bounded_stream_ends_and_unsubscribes():
+    feed = LiveFeed(lambda: {'tick': time.time()}, interval=0.05, idle_timeout=0.1)
+    started = time.monotonic()
+    events = list(feed.subscribe(max_seconds=0.5))
+    assert 0.5 <= time.monotonic() - started < 2
+    assert events[0].startswith("retry:") and any(e.startswith("id:") for e in events[1:])
+    assert feed.stats()["subscribers"] == 0
@@ -0,0 +1,41 @@
+# Routing only moves the lumped engine's runoff in time: same volume, same steady flow
+import numpy as np
+import pytest
+from catchment_store import compute_physics
+from hydrology import CURVE_NUMBER, DELAYED_FRACTION, direct_runoff_mm, runoff_to_cusecs, scs_cn_discharge
+from routing import Router, travel_times
+
+
+@pytest.fixture(scope="module")
+def uniform():
+    """CN-85 catchment without rain weighting: the lumped engine's assumptions, spread over space."""
+    rng = np.random.default_rng(0)
+    n = 20000
+    lat, lon = rng.uniform(29.9, 30.3, n), rng.uniform(78.0, 78.6, n)
+    S, Ia = compute_physics(np.full(n, CURVE_NUMBER))
+    return Router(np.ones(n), Ia, S, travel_times(lat, lon, rng.uniform(285, 900, n)))
+
+
+def test_routed_volume_equals_lumped(uniform):
+    rain = np.random.default_rng(1).gamma(0.4, 25, 72)
+    drained = np.r_[rain, np.zeros(uniform.uh.shape[1])]  # Every unit hydrograph empties
+    routed = uniform.outlet_hydrograph(drained, 0.0, 45000) - 45000
+    lumped = runoff_to_cusecs(direct_runoff_mm(rain))
+    assert routed.sum() == pytest.approx(lumped.sum(), rel=1e-9)
+
+
+def test_routing_attenuates_the_lumped_peak(uniform):
+    rain = np.random.default_rng(2).gamma(0.4, 25, 72)
+    routed = uniform.outlet_hydrograph(rain, 80.0, 45000)
+    lumped = scs_cn_discharge(rain, 80.0, 0, 45000)
+    assert routed.max() <= lumped.max() + 1.0
+
+
+def test_steady_rain_gives_lumped_discharge(uniform):
+    flow = uniform.outlet_hydrograph(np.full(200, 35.0), 120.0, 45000)
+    assert flow[-1] == pytest.approx(scs_cn_discharge(35.0, 120.0, 0, 45000), abs=1.0)
+
+
+def test_no_rain_is_base_plus_delayed(uniform):
+    flow = uniform.outlet_hydrograph(np.zeros(200), 60.0, 8500)
+    assert flow[-1] == pytest.approx(8500 + runoff_to_cusecs(60.0 * DELAYED_FRACTION), rel=1e-9)
@@ -0,0 +1,60 @@
+# The NumPy kernel must give the original pandas calculate_distributed_discharge's points
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.bench_distributed import legacy_distributed, make_catchment
+from runoff_kernel import DistributedRunoffKernel, stable_sample
+
+N = 50000
+
+
+@pytest.fixture(scope="module")
+def columns():
+    return make_catchment(N, seed=7)
+
+
+@pytest.fixture(scope="module")
+def frame(columns):
+    return pd.DataFrame(columns)
+
+
+def legacy_ids(frame, columns, rain):
+    """Point ids of the legacy records (its active rows, in catchment order)."""
+    local_rain = rain * frame['rain_weight']
+    runoff = np.where(local_rain > frame['Ia'], (local_rain - frame['Ia']) ** 2 / (local_rain - frame['Ia'] + frame['S']), 0)
+    return np.flatnonzero(runoff > 5)
+
+
+@pytest.mark.parametrize("rain", [0.0, 20.0, 45.5, 80.0, 250.0])
+@pytest.mark.parametrize("chunk_size", [1000, 4096, N])   # Chunk boundaries must not change the answer
+def test_matches_legacy(columns, frame, rain, chunk_size):
+    kernel = DistributedRunoffKernel(columns["rain_weight"], columns["Ia"], columns["S"], chunk_size=chunk_size)
+    point_ids, runoff_mm, status = kernel.run(rain)
+    legacy = legacy_distributed(frame, rain)
+    assert np.array_equal(point_ids, legacy_ids(frame, columns, rain))
+    assert len(legacy) == len(point_ids)
+    if legacy:
+        assert np.allclose([p['runoff_mm'] for p in legacy], runoff_mm, rtol=1e-5, atol=1e-4)
+        assert np.array_equal([p['status'] for p in legacy], status)
+        assert np.array_equal([p['lat'] for p in legacy], columns["lat"][point_ids])
+
+
+def test_sample_is_a_stable_uniform_subset(columns):
+    kernel = DistributedRunoffKernel(columns["rain_weight"], columns["Ia"], columns["S"], chunk_size=4096)
+    all_ids, all_runoff, all_status = kernel.run(80.0)
+    point_ids, runoff_mm, status = kernel.run(80.0, max_points=3000)
+    assert len(point_ids) == 3000 and np.isin(point_ids, all_ids).all()
+    assert np.array_equal(point_ids, kernel.run(80.0, max_points=3000)[0])   # Same points every tick
+    where = np.searchsorted(all_ids, point_ids)
+    assert np.array_equal(runoff_mm, all_runoff[where]) and np.array_equal(status, all_status[where])
+    # Uniform over the active points, like random.sample: every tenth of them gets ~10% of the sample
+    deciles = np.bincount(np.searchsorted(all_ids, point_ids) * 10 // len(all_ids), minlength=10)
+    assert deciles.min() > 240 and deciles.max() < 360
+
+
+def test_sample_keeps_points_that_stay_active():
+    ids = np.arange(100000)
+    sample = stable_sample(ids, 1000)
+    assert np.array_equal(stable_sample(ids[::-1], 1000), sample)    # Order of the active ids does not matter
+    subset = ids[ids % 2 == 0]                                       # Half the points go quiet
+    assert np.isin(sample[sample % 2 == 0], stable_sample(subset, 1000)).all()
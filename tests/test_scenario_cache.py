@@ -0,0 +1,35 @@
+# Memoized simulation results: least recently used out first, counters, purges and slider quantization
+from scenario_cache import ScenarioCache, quantize, RAIN_STEP
+
+
+def test_computes_each_key_once():
+    cache, calls = ScenarioCache(4), []
+    compute = lambda: calls.append(1) or len(calls)
+    assert cache.get_or_compute("a", compute) == 1
+    assert cache.get_or_compute("a", compute) == 1
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_evicts_least_recently_used():
+    cache = ScenarioCache(2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    cache.get_or_compute("a", lambda: None)    # "a" is now the most recent
+    cache.get_or_compute("c", lambda: 3)       # Evicts "b"
+    assert cache.get_or_compute("a", lambda: "recomputed") == 1
+    assert cache.get_or_compute("b", lambda: "recomputed") == "recomputed"
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 2
+
+
+def test_purge_drops_matching_keys():
+    cache = ScenarioCache()
+    for key in [("haridwar", 1), ("haridwar", 2), ("rishikesh", 1)]: cache.get_or_compute(key, lambda: 0)
+    assert cache.purge(lambda key: key[0] == "haridwar") == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_slider_positions_share_a_key():
+    assert quantize(42.04, RAIN_STEP) == quantize(41.96, RAIN_STEP) == 42.0
+    assert quantize(0.1 + 0.2, RAIN_STEP) == 0.3
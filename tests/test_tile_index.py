@@ -0,0 +1,21 @@
+# The grid index must answer like a scan over every tile's bounds, and never raise for a bad point
+import math
+import numpy as np
+from tile_index import TileIndex
+
+BOUNDS = [(0, 0, 100, 100), (100, 0, 200, 100), (50, 50, 150, 150)]
+
+
+def test_candidates_match_a_bounds_scan():
+    index = TileIndex(BOUNDS)
+    for x, y in np.random.default_rng(0).uniform(-20, 220, (500, 2)):
+        expected = [i for i, (l, b, r, t) in enumerate(BOUNDS) if l <= x <= r and b <= y <= t]
+        assert index.candidates(x, y) == expected
+
+
+def test_non_finite_points_are_outside():
+    index = TileIndex(BOUNDS)
+    for x, y in [(math.inf, math.inf), (math.nan, 10.0), (10.0, -math.inf)]:
+        assert index.candidates(x, y) == []
+    groups = index.group_points([math.inf, 10.0], [math.inf, 10.0])
+    assert {t: ids.tolist() for t, ids in groups.items()} == {0: [1]}
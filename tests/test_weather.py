@@ -0,0 +1,78 @@
+# The shared weather snapshot: fresh from memory, stale while it refreshes, one fetch at a time
+import threading
+import time
+from weather import LocalWeatherProvider, WeatherClient, default_snapshot
+
+
+class CountingProvider(LocalWeatherProvider):
+    """Local snapshots numbered by fetch, optionally slow."""
+
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay, self.calls = delay, 0
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {**default_snapshot(), "fetch": self.calls}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline: time.sleep(0.01)
+    return condition()
+
+
+def test_fresh_snapshot_is_served_from_memory():
+    client = WeatherClient(CountingProvider(), ttl=60)
+    first = client.get_snapshot()
+    assert first["fetch"] == 1
+    assert all(client.get_snapshot() is first for _ in range(10))
+    assert client.fetch_count == 1
+
+
+def test_stale_snapshot_is_served_while_it_refreshes():
+    provider = CountingProvider(delay=0.2)
+    client = WeatherClient(provider, ttl=0.05, max_stale=60)
+    assert client.get_snapshot()["fetch"] == 1
+    time.sleep(0.1)
+    started = time.monotonic()
+    assert client.get_snapshot()["fetch"] == 1      # Answered at once with the old snapshot
+    assert time.monotonic() - started < 0.1
+    assert client.get_snapshot()["fetch"] == 1      # The refresh already running is not started twice
+    assert wait_for(lambda: client.fetch_count == 2)
+    assert client.get_snapshot()["fetch"] == 2 and provider.calls == 2
+
+
+def test_failed_fetch_backs_off():
+    client = WeatherClient(LocalWeatherProvider("missing_weather.json"), retry_after=60)
+    assert client.get_snapshot() is None
+    assert client.get_snapshot() is None
+    assert client.fetch_count == 1 and client.error_count == 1 and "missing_weather.json" in client.last_error
+
+
+def test_backing_off_keeps_serving_the_stale_snapshot():
+    provider = CountingProvider()
+    client = WeatherClient(provider, ttl=0.05, max_stale=60, retry_after=60)
+    snapshot = client.get_snapshot()
+    provider.fetch = lambda: 1 / 0
+    time.sleep(0.1)
+    assert client.get_snapshot() is snapshot
+    assert wait_for(lambda: client.error_count == 1)
+    assert client.get_snapshot() is snapshot and client.fetch_count == 2   # No retry while backing off
+
+
+def test_concurrent_cold_requests_share_one_fetch():
+    provider = CountingProvider(delay=0.2)
+    client = WeatherClient(provider)
+    results, start = [], threading.Barrier(16)
+
+    def request():
+        start.wait()
+        results.append(client.get_snapshot(wait=2))
+
+    threads = [threading.Thread(target=request) for _ in range(16)]
+    for t in threads: t.start()
+    for t in threads: t.join(5)
+    assert provider.calls == 1 and client.fetch_count == 1
+    assert len(results) == 16 and all(r is results[0] for r in results)
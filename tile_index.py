@@ -0,0 +1,83 @@
+#tile_index.py
+import math
+import numpy as np
+
+
+class TileIndex:
+    """
+    Uniform grid index over tile bounds (native CRS).
+    Each grid cell lists the tiles overlapping it, so a lookup only
+    checks a handful of candidates instead of every tile.
+    """
+
+    def __init__(self, bounds_list, cell_size=None):
+        # bounds_list: [(left, bottom, right, top), ...] in tile order
+        self.bounds = np.array(bounds_list, dtype=np.float64).reshape(-1, 4)
+        self.cells = {}
+        if len(self.bounds) == 0:
+            self.origin_x = self.origin_y = 0.0
+            self.cell_size = 1.0
+            return
+
+        widths = self.bounds[:, 2] - self.bounds[:, 0]
+        heights = self.bounds[:, 3] - self.bounds[:, 1]
+        # Tiles are roughly the same size, so one tile extent per cell keeps buckets small
+        self.cell_size = float(cell_size or max(np.median(np.maximum(widths, heights)), 1e-9))
+        self.origin_x = float(self.bounds[:, 0].min())
+        self.origin_y = float(self.bounds[:, 1].min())
+
+        for tile_id, (left, bottom, right, top) in enumerate(self.bounds):
+            cx0, cy0 = self._cell(left, bottom)
+            cx1, cy1 = self._cell(right, top)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells.setdefault((cx, cy), []).append(tile_id)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def _cell(self, x, y):
+        return (int(math.floor((x - self.origin_x) / self.cell_size)),
+                int(math.floor((y - self.origin_y) / self.cell_size)))
+
+    def candidates(self, x, y):
+        """Tile ids (in load order) whose bounds contain the point; none for a non-finite point
+        (the transform returns inf for a latitude beyond the poles)."""
+        if not (math.isfinite(x) and math.isfinite(y)): return []
+        hits = []
+        for tile_id in self.cells.get(self._cell(x, y), ()):
+            left, bottom, right, top = self.bounds[tile_id]
+            if left <= x <= right and bottom <= y <= top:
+                hits.append(tile_id)
+        return hits
+
+    def group_points(self, xs, ys):
+        """
+        Vectorized bucketing of many points.
+        Returns {tile_id: indices of points inside that tile}, in tile load order.
+        A point near a tile edge can appear under more than one tile.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        groups = {}
+        if len(self.bounds) == 0 or len(xs) == 0: return groups
+
+        cx = np.floor((xs - self.origin_x) / self.cell_size).astype(np.int64)
+        cy = np.floor((ys - self.origin_y) / self.cell_size).astype(np.int64)
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        cell_keys = np.stack([cx, cy], axis=1)[finite]
+        point_ids = np.nonzero(finite)[0]
+        if len(point_ids) == 0: return groups
+
+        # One pass per occupied grid cell, not per point
+        unique_cells, inverse = np.unique(cell_keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        splits = np.cumsum(np.bincount(inverse.ravel(), minlength=len(unique_cells)))[:-1]
+        for (ux, uy), members in zip(unique_cells, np.split(point_ids[order], splits)):
+            for tile_id in self.cells.get((int(ux), int(uy)), ()):
+                left, bottom, right, top = self.bounds[tile_id]
+                px, py = xs[members], ys[members]
+                inside = members[(left <= px) & (px <= right) & (bottom <= py) & (py <= top)]
+                if len(inside): groups.setdefault(tile_id, []).append(inside)
+
+        return {tile_id: np.concatenate(groups[tile_id]) for tile_id in sorted(groups)}
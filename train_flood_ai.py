@@ -1,124 +1,146 @@
-import openmeteo_requests
-import requests_cache
+import time
+import argparse
 import pandas as pd
-from retry_requests import retry
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
+from archive import ArchiveCache, OpenMeteoArchiveProvider, LocalArchiveProvider, ARCHIVE_CACHE_DIR
+from inference import FEATURES
 
-print("Connecting to Open-Meteo Historical Archive (ERA5-Land)...")
-
-# SETUP API CLIENT (Unchanged)
-cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-openmeteo = openmeteo_requests.Client(session = retry_session)
-
-# FETCHING ADVANCED VARIABLES (Rain + Soil + Snow) - UPDATED
-url = "https://archive-api.open-meteo.com/v1/archive"
-params = {
-    "latitude": 29.956,
-    "longitude": 78.18,
-    "start_date": "1990-01-01",
-    "end_date": "2024-01-01",
-    "daily": [
-        "rain_sum",
-        "soil_moisture_0_to_7cm_mean",
-        "snowfall_sum"
-    ],
-    "timezone": "Asia/Kolkata"
-}
-
-try:
-    responses = openmeteo.weather_api(url, params=params)
-    response = responses[0]
-
-    # Process Daily Data
-    daily = response.Daily()
-    
-    # Extract Variables - UPDATED
-    daily_rain = daily.Variables(0).ValuesAsNumpy()
-    daily_soil = daily.Variables(1).ValuesAsNumpy()
-    daily_snow = daily.Variables(2).ValuesAsNumpy()
-
-    date_range = pd.date_range(
-        start = pd.to_datetime(daily.Time(), unit = "s", utc = True),
-        end = pd.to_datetime(daily.TimeEnd(), unit = "s", utc = True),
-        freq = pd.Timedelta(seconds = daily.Interval()),
-        inclusive = "left"
-    )
+# CONFIGURATION
+LATITUDE, LONGITUDE = 29.956, 78.18
+START_DATE, END_DATE = "1990-01-01", "2024-01-01"
+SEED = 42
+
+
+def load_history(cache, lat, lon, start, end):
+    """Daily rain / soil / snow for the location (local archive cache first, then the provider)."""
+    columns = cache.get(lat, lon, start, end)
 
     # DataFrame creation - UPDATED
     df = pd.DataFrame({
-        "date": date_range, 
-        "rain_mm": daily_rain,
-        "soil_moisture": daily_soil, # Volumetric fraction (0.0 - 1.0)
-        "snow_mm": daily_snow
+        "date": pd.to_datetime(columns["date"]),
+        "rain_mm": columns["rain_sum"],
+        "soil_moisture": columns["soil_moisture_0_to_7cm_mean"], # Volumetric fraction (0.0 - 1.0)
+        "snow_mm": columns["snowfall_sum"]
     })
-    
+
     # --- Antecedent Rainfall (Rolling Sum) ---
     # Adds "Memory" to the system (Last 5 days of rain)
     df['rain_last_5_days'] = df['rain_mm'].rolling(window=5).sum().fillna(0)
-    
-    print(f"Downloaded {len(df)} days of Hydrological Data.")
-    print(df.head()) 
+    return df
 
-except Exception as e:
-    print(f"API Error: {e}")
-    exit()
 
-# ADVANCED HYDROLOGY LOGIC - UPDATED
-def calculate_hydrology_advanced(row):
-    month = row['date'].month
-    is_monsoon = 6 <= month <= 9
+# ADVANCED HYDROLOGY LOGIC (vectorized over all days)
+def calculate_hydrology_advanced(df, rng):
+    """Returns (discharge_cusecs, risk_label) arrays for every row of df."""
+    month = df['date'].dt.month.to_numpy()
+    is_monsoon = (month >= 6) & (month <= 9)
 
     # A. Soil Saturation Impact
     # If soil is wet (>0.35), runoff is much higher
-    saturation_factor = 1.5 if row['soil_moisture'] > 0.35 else 0.8
-    
+    saturation_factor = np.where(df['soil_moisture'].to_numpy() > 0.35, 1.5, 0.8)
+
     # B. Snow Melt Impact
     # Snow melt contributes to base flow even if it doesn't rain
-    melt_contribution = row['snow_mm'] * 50 # Simplified melt physics
+    melt_contribution = df['snow_mm'].to_numpy(dtype=np.float64) * 50 # Simplified melt physics
 
     # C. Base Flow & Runoff
-    base_flow = 40000 if is_monsoon else 8000
-    runoff_factor = 1200 if is_monsoon else 400
-    
+    base_flow = np.where(is_monsoon, 40000, 8000)
+    runoff_factor = np.where(is_monsoon, 1200, 400)
+
     # Total Discharge Calculation
     # Discharge = Base + (Rain * Runoff_Factor * Saturation) + Melt
-    discharge = base_flow + (row['rain_mm'] * runoff_factor * saturation_factor) + melt_contribution
-    
-    # Add Noise (Natural variance)
-    discharge += np.random.normal(0, 2000)
-    
+    discharge = base_flow + (df['rain_mm'].to_numpy(dtype=np.float64) * runoff_factor * saturation_factor) + melt_contribution
+
+    # Add Noise (Natural variance) - seeded, so labels are reproducible
+    discharge = discharge + rng.normal(0, 2000, len(df))
+
     # Risk Labeling (Calibrated)
-    risk = 0
-    if discharge > 100000: risk = 1
-    if discharge > 180000: risk = 2
-    
-    return pd.Series([discharge, risk])
-
-print("Applying Advanced Hydrological Rating Curve...")
-df[['discharge_cusecs', 'risk_label']] = df.apply(calculate_hydrology_advanced, axis=1)
-df = df.dropna()
-
-# 4. We now train the AI on Rain, Soil, Snow, AND Antecedent Rain!
-X = df[["rain_mm", "soil_moisture", "snow_mm", "rain_last_5_days", "discharge_cusecs"]]
-y = df["risk_label"]
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-model = RandomForestClassifier(n_estimators=100, random_state=42)
-model.fit(X_train, y_train)
-
-# Accuracy Check
-predictions = model.predict(X_test)
-acc = accuracy_score(y_test, predictions)
-print(f"\nNew Model Accuracy: {acc * 100:.2f}%")
-print(classification_report(y_test, predictions))
-
-# Save Model
-model.fit(X, y)
-joblib.dump(model, "flood_model.pkl")
-print("Advanced Model Saved as 'flood_model.pkl'")
\ No newline at end of file
+    risk = np.where(discharge > 180000, 2, np.where(discharge > 100000, 1, 0))
+    return discharge, risk
+
+
+class Timer:
+    """Prints how long each training phase took."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+
+    def lap(self, label):
+        now = time.perf_counter()
+        print(f"   [{label}: {now - self.last:.2f}s]")
+        self.last = now
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the flood risk Random Forest on ERA5-Land history.")
+    parser.add_argument("--lat", type=float, default=LATITUDE)
+    parser.add_argument("--lon", type=float, default=LONGITUDE)
+    parser.add_argument("--start", default=START_DATE)
+    parser.add_argument("--end", default=END_DATE)
+    parser.add_argument("--fixture", help="Train offline from a CSV (date, rain_sum, soil_moisture_0_to_7cm_mean, snowfall_sum)")
+    parser.add_argument("--offline", action="store_true", help="Use only the local archive cache; never call the API")
+    parser.add_argument("--cache-dir", default=ARCHIVE_CACHE_DIR)
+    parser.add_argument("--seed", type=int, default=SEED, help="Seed for the label noise")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Cores for forest training (-1 = all)")
+    parser.add_argument("--out", default="flood_model.pkl")
+    args = parser.parse_args()
+    timer = Timer()
+
+    if args.fixture:
+        print(f"Loading Hydrological Data from fixture {args.fixture}...")
+        cache = ArchiveCache(LocalArchiveProvider(args.fixture), cache_dir=None)
+    else:
+        print("Connecting to Open-Meteo Historical Archive (ERA5-Land)...")
+        # Only date ranges missing from the local archive cache are downloaded
+        cache = ArchiveCache(None if args.offline else OpenMeteoArchiveProvider(), args.cache_dir)
+
+    try:
+        df = load_history(cache, args.lat, args.lon, args.start, args.end)
+        print(f"Loaded {len(df)} days of Hydrological Data ({cache.fetches} archive requests).")
+        print(df.head())
+    except Exception as e:
+        print(f"API Error: {e}")
+        exit()
+    timer.lap("data")
+
+    print("Applying Advanced Hydrological Rating Curve...")
+    rng = np.random.default_rng(args.seed)
+    df['discharge_cusecs'], df['risk_label'] = calculate_hydrology_advanced(df, rng)
+    df = df.dropna()
+    timer.lap("labels")
+
+    # 4. We now train the AI on Rain, Soil, Snow, AND Antecedent Rain!
+    X = df[FEATURES]
+    y = df["risk_label"]
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    model = RandomForestClassifier(n_estimators=args.n_estimators, random_state=42, n_jobs=args.n_jobs)
+    model.fit(X_train, y_train)
+    timer.lap(f"fit, n_jobs={args.n_jobs}")
+
+    # Accuracy Check
+    predictions = model.predict(X_test)
+    acc = accuracy_score(y_test, predictions)
+    print(f"\nNew Model Accuracy: {acc * 100:.2f}%")
+    print(classification_report(y_test, predictions))
+
+    # Save Model (refit on everything; scoring in the app is single-threaded)
+    model.fit(X, y)
+    model.set_params(n_jobs=None)
+    joblib.dump(model, args.out)
+    timer.lap("final fit + save")
+    print(f"Advanced Model Saved as '{args.out}' ({timer.total():.1f}s total)")
+
+
+if __name__ == "__main__":
+    main()
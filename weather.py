@@ -0,0 +1,296 @@
+#weather.py
+import os
+import json
+import time
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+try:
+    import aiohttp  # Only needed by the async (ASGI) client
+except ImportError:
+    aiohttp = None
+
+# CONFIGURATION
+HARIDWAR_LAT, HARIDWAR_LON = 29.956, 78.18
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+WEATHER_TTL = float(os.environ.get("RIVERLY_WEATHER_TTL", 60))              # Seconds a snapshot counts as fresh
+WEATHER_MAX_STALE = float(os.environ.get("RIVERLY_WEATHER_MAX_STALE", 900)) # Seconds a stale snapshot may still be served
+WEATHER_RETRY_AFTER = float(os.environ.get("RIVERLY_WEATHER_RETRY_AFTER", 10)) # Back-off after a failed fetch
+WEATHER_TIMEOUT = float(os.environ.get("RIVERLY_WEATHER_TIMEOUT", 1))  # Upstream timeout, and the longest a cold-cache request waits
+
+
+# --- PROVIDERS ---
+# A provider has fetch() (blocking) and fetch_async(session) (asyncio), both returning
+# an Open-Meteo shaped dict: {"current": {...}, "hourly": {"time": [...], "rain": [...]}}
+
+class OpenMeteoProvider:
+    """Live Open-Meteo forecast over a pooled HTTP session."""
+
+    def __init__(self, lat=HARIDWAR_LAT, lon=HARIDWAR_LON, timeout=WEATHER_TIMEOUT, session=None):
+        self.lat, self.lon, self.timeout = lat, lon, timeout
+        self.session = session or self._make_session()
+
+    @staticmethod
+    def _make_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def params(self):
+        # One request covers both endpoints:
+        # current conditions + [past 5 days] + [next 48 hrs] of hourly rain
+        return {
+            "latitude": self.lat, "longitude": self.lon,
+            "current": ["temperature_2m", "relative_humidity_2m", "wind_speed_10m", "rain", "showers", "soil_moisture_0_to_7cm", "snow_depth"],
+            "hourly": "rain", "past_days": 5, "forecast_days": 2,
+            "timezone": "Asia/Kolkata"
+        }
+
+    def fetch(self):
+        resp = self.session.get(OPEN_METEO_URL, params=self.params(), timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def fetch_async(self, session):
+        # aiohttp wants scalar query values: lists go comma-separated (Open-Meteo accepts both)
+        params = {k: ",".join(v) if isinstance(v, list) else str(v) for k, v in self.params().items()}
+        async with session.get(OPEN_METEO_URL, params=params, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+
+class LocalWeatherProvider:
+    """Offline provider for tests and air-gapped runs. Reads a saved Open-Meteo response,
+    or serves calm default weather when no file is given."""
+
+    def __init__(self, path=None, snapshot=None):
+        self.path = path
+        self.snapshot = snapshot
+
+    def fetch(self):
+        if self.snapshot is not None: return self.snapshot
+        if self.path:
+            with open(self.path) as f: return json.load(f)
+        return default_snapshot()
+
+    async def fetch_async(self, session):
+        return self.fetch()
+
+
+def default_snapshot(rain_mm=0.0, hours=168):
+    """Calm weather in the Open-Meteo response shape."""
+    return {
+        "current": {
+            "temperature_2m": 25.0, "relative_humidity_2m": 60, "wind_speed_10m": 5.0,
+            "rain": rain_mm, "showers": 0.0, "soil_moisture_0_to_7cm": 0.2, "snow_depth": 0.0
+        },
+        "hourly": {"rain": [0.0] * hours}
+    }
+
+
+# --- CACHED CLIENT ---
+
+class WeatherClient:
+    """
+    Shares one weather snapshot between all requests.
+    - Fresh (age < ttl): served from memory.
+    - Stale (age < max_stale): served from memory, refreshed in a background thread.
+    - Missing/expired: fetched once; concurrent callers wait for that same fetch (single-flight).
+    Upstream fetch rate stays at ~1 per ttl no matter how many clients poll.
+    """
+
+    def __init__(self, provider, ttl=WEATHER_TTL, max_stale=WEATHER_MAX_STALE, retry_after=WEATHER_RETRY_AFTER):
+        self.provider = provider
+        self.ttl, self.max_stale, self.retry_after = ttl, max_stale, retry_after
+        self.fetch_count = 0
+        self.error_count = 0
+        self.last_error = None
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._failed_at = None
+        self._inflight = None
+        self._lock = threading.Lock()
+
+    def get_snapshot(self, wait=WEATHER_TIMEOUT):
+        """Latest snapshot, or None if weather is unavailable."""
+        now = time.monotonic()
+        with self._lock:
+            age = now - self._fetched_at
+            if self._snapshot is not None and age < self.ttl:
+                return self._snapshot
+            backing_off = self._failed_at is not None and now - self._failed_at < self.retry_after
+            if self._snapshot is not None and age < self.max_stale:
+                # Stale-while-revalidate
+                if not backing_off: self._start_fetch(background=True)
+                metrics.count("weather_stale_served")
+                return self._snapshot
+            if backing_off and self._inflight is None:
+                # Upstream is down: don't let every request retry it
+                metrics.count("weather_unavailable")
+                return None
+            inflight, leader = self._start_fetch(background=False)
+
+        if leader: self._run_fetch(inflight)
+        else: inflight.wait(wait)
+
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._fetched_at < self.max_stale:
+                return self._snapshot
+        metrics.count("weather_unavailable")
+        return None
+
+    def refresh(self):
+        """Force a synchronous fetch (used by warm-up and background ticks)."""
+        with self._lock:
+            inflight, leader = self._start_fetch(background=False)
+        if leader: self._run_fetch(inflight)
+        else: inflight.wait()
+        return self._snapshot
+
+    def _start_fetch(self, background):
+        # Caller holds the lock. Returns (event, is_leader).
+        if self._inflight is not None: return self._inflight, False
+        self._inflight = threading.Event()
+        if background:
+            threading.Thread(target=self._run_fetch, args=(self._inflight,), daemon=True).start()
+            return self._inflight, False
+        return self._inflight, True
+
+    def _run_fetch(self, inflight):
+        snapshot, error = None, None
+        try:
+            snapshot = self.provider.fetch()
+        except Exception as e:
+            error = e
+        with self._lock:
+            self.fetch_count += 1
+            if error is None:
+                self._snapshot = snapshot
+                self._fetched_at = time.monotonic()
+                self._failed_at = None
+            else:
+                self.error_count += 1
+                self.last_error = str(error)
+                self._failed_at = time.monotonic()
+            self._inflight = None
+        inflight.set()
+        if error is not None:
+            metrics.count("weather_fetch_error")
+            print(f"Weather fetch failed: {error}")
+
+    def stats(self):
+        with self._lock:
+            age = time.monotonic() - self._fetched_at if self._snapshot is not None else None
+        return {
+            "provider": type(self.provider).__name__, "age_seconds": age,
+            "fetches": self.fetch_count, "errors": self.error_count, "last_error": self.last_error
+        }
+
+
+class AsyncWeatherClient:
+    """
+    asyncio twin of WeatherClient for the ASGI server: same fresh / stale / single-flight
+    rules, but waiting callers await the in-flight fetch instead of holding a thread.
+    Must be used from one event loop; the aiohttp session is opened on first use.
+    """
+
+    def __init__(self, provider, ttl=WEATHER_TTL, max_stale=WEATHER_MAX_STALE, retry_after=WEATHER_RETRY_AFTER):
+        self.provider = provider
+        self.ttl, self.max_stale, self.retry_after = ttl, max_stale, retry_after
+        self.fetch_count = 0
+        self.error_count = 0
+        self.last_error = None
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._failed_at = None
+        self._inflight = None
+        self._session = None
+
+    async def get_snapshot(self, wait=WEATHER_TIMEOUT):
+        """Latest snapshot, or None if weather is unavailable. Never blocks the loop."""
+        now = time.monotonic()
+        age = now - self._fetched_at
+        if self._snapshot is not None and age < self.ttl:
+            return self._snapshot
+        backing_off = self._failed_at is not None and now - self._failed_at < self.retry_after
+        if self._snapshot is not None and age < self.max_stale:
+            # Stale-while-revalidate: refresh as a task, answer now
+            if not backing_off: self._start_fetch()
+            metrics.count("weather_stale_served")
+            return self._snapshot
+        if backing_off and self._inflight is None:
+            metrics.count("weather_unavailable")
+            return None
+
+        inflight = self._start_fetch()
+        try:
+            # shield: a caller timing out must not cancel the fetch everyone else awaits
+            await asyncio.wait_for(asyncio.shield(inflight), wait)
+        except Exception:
+            metrics.count("weather_wait_timeout")
+        if self._snapshot is not None and time.monotonic() - self._fetched_at < self.max_stale:
+            return self._snapshot
+        metrics.count("weather_unavailable")
+        return None
+
+    async def refresh(self):
+        await self._start_fetch()
+        return self._snapshot
+
+    def _start_fetch(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run_fetch())
+        return self._inflight
+
+    async def _run_fetch(self):
+        try:
+            if self._session is None and aiohttp is not None:
+                self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=16))
+            snapshot = await self.provider.fetch_async(self._session)
+            self._snapshot = snapshot
+            self._fetched_at = time.monotonic()
+            self._failed_at = None
+        except Exception as e:
+            self.error_count += 1
+            self.last_error = str(e) or type(e).__name__
+            self._failed_at = time.monotonic()
+            metrics.count("weather_fetch_error")
+            print(f"Weather fetch failed: {self.last_error}")
+        finally:
+            self.fetch_count += 1
+            self._inflight = None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        age = time.monotonic() - self._fetched_at if self._snapshot is not None else None
+        return {
+            "provider": type(self.provider).__name__, "age_seconds": age,
+            "fetches": self.fetch_count, "errors": self.error_count, "last_error": self.last_error
+        }
+
+
+def create_provider(lat=HARIDWAR_LAT, lon=HARIDWAR_LON, weather_file=None):
+    """Provider picked by RIVERLY_WEATHER_PROVIDER ('open-meteo' or 'local') for one location."""
+    name = os.environ.get("RIVERLY_WEATHER_PROVIDER", "open-meteo").lower()
+    if name == "local":
+        return LocalWeatherProvider(weather_file or os.environ.get("RIVERLY_WEATHER_FILE"))
+    return OpenMeteoProvider(lat, lon)
+
+
+def create_weather_client(lat=HARIDWAR_LAT, lon=HARIDWAR_LON, weather_file=None):
+    return WeatherClient(create_provider(lat, lon, weather_file))
+
+
+def create_async_weather_client(lat=HARIDWAR_LAT, lon=HARIDWAR_LON, weather_file=None):
+    provider = create_provider(lat, lon, weather_file)
+    if aiohttp is None and isinstance(provider, OpenMeteoProvider):
+        raise ImportError("aiohttp is required for the async weather client (pip install aiohttp)")
+    return AsyncWeatherClient(provider)